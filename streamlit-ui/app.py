@@ -1,7 +1,8 @@
 import streamlit as st
 import plotly.express as px
 import pandas as pd
-from utils.db_utils import get_user_predictions
+from utils.db_utils import get_user_predictions, start_stats_reconciler
+from utils.prediction_utils import warm_up_classifier
 from datetime import datetime, timedelta
 
 st.set_page_config(
@@ -11,6 +12,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Keep the admin dashboard counters in step with the collections
+start_stats_reconciler()
+
 # Main title
 st.title("AI Garbage Classification System")
 st.markdown("---")
@@ -20,6 +24,10 @@ is_authenticated = st.session_state.get('authenticated', False)
 user_type = st.session_state.get('user_type', 'user')
 user_name = st.session_state.get('user_name', st.session_state.get('user', ''))
 
+# Signed-in users are likely to classify next; start loading the models in the background
+if is_authenticated:
+    warm_up_classifier()
+
 # Sidebar navigation
 with st.sidebar:
     st.markdown("## System Navigation")
@@ -0,0 +1,111 @@
+import argparse
+import os
+import sys
+import numpy as np
+from config import CASCADE_THRESHOLDS_FILE
+from utils.prediction_utils import GarbageClassifier, MODEL_PATHS, find_model_file
+from utils.evaluation import list_labelled_images, collect_probabilities
+from utils.cascade import CASCADE_FIRST_MODEL, CascadePolicy, calibrate_thresholds, exit_mask
+
+def split_images(images, holdout_fraction, seed=0):
+    # Shuffle and split into a calibration part and a part to check the thresholds on
+    order = np.random.default_rng(seed).permutation(len(images))
+    holdout_size = int(len(images) * holdout_fraction)
+    return [images[i] for i in order[holdout_size:]], [images[i] for i in order[:holdout_size]]
+
+def evaluate(outputs, labels, first_model, min_confidence, min_margin):
+    # Accuracy and early-exit rate of the cascade with the given thresholds
+    exits = exit_mask(outputs[first_model], min_confidence, min_margin)
+    predicted = np.where(exits, outputs[first_model].argmax(axis=1), outputs['ensemble'].argmax(axis=1))
+    return float((predicted == labels).mean()), float(exits.mean())
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick early-exit thresholds for the cascade ensemble")
+    parser.add_argument('--eval-dir', required=True,
+                        help="Held-out directory with one folder of images per class (not the training data)")
+    parser.add_argument('--limit', type=int, help="Maximum number of images per class to use")
+    parser.add_argument('--target-accuracy', type=float,
+                        help="Minimum cascade accuracy (default: full ensemble accuracy minus --max-accuracy-drop)")
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.005,
+                        help="Accuracy the cascade may lose against the full ensemble")
+    parser.add_argument('--holdout', type=float, default=0.2,
+                        help="Fraction of the images kept aside to check the chosen thresholds")
+    parser.add_argument('--output', help="Where to write the thresholds JSON (default: next to the saved models)")
+    args = parser.parse_args()
+
+    images = list_labelled_images(args.eval_dir, args.limit)
+    if not images:
+        print(f"No labelled images found in {args.eval_dir}")
+        return 1
+
+    calibration, holdout = split_images(images, args.holdout)
+    classifier = GarbageClassifier(cascade=False)
+    if CASCADE_FIRST_MODEL not in classifier.models:
+        print(f"{CASCADE_FIRST_MODEL} is not available, cannot calibrate the cascade")
+        return 1
+
+    print(f"Running the full ensemble on {len(calibration)} calibration images...")
+    outputs = collect_probabilities(classifier, [path for path, _ in calibration])
+    labels = np.array([label for _, label in calibration])
+
+    ensemble_accuracy = float((outputs['ensemble'].argmax(axis=1) == labels).mean())
+    target_accuracy = args.target_accuracy
+    if target_accuracy is None:
+        target_accuracy = ensemble_accuracy - args.max_accuracy_drop
+
+    best = calibrate_thresholds(outputs[CASCADE_FIRST_MODEL], outputs['ensemble'], labels, target_accuracy)
+
+    print(f"\n=== Cascade Calibration ({len(calibration)} images) ===")
+    print(f"Full ensemble accuracy: {ensemble_accuracy:.2%}")
+    print(f"Target accuracy:        {target_accuracy:.2%}")
+    print(f"Min confidence:         {best['min_confidence']}")
+    print(f"Min margin:             {best['min_margin']}")
+    print(f"Cascade accuracy:       {best['accuracy']:.2%}")
+    print(f"Early-exit rate:        {best['early_exit_rate']:.1%}")
+    if best['min_confidence'] is None and best['min_margin'] is None:
+        print("Warning: No thresholds reach the target accuracy, the cascade will always escalate")
+
+    report = {
+        'target_accuracy': target_accuracy,
+        'calibration': {
+            'images': len(calibration),
+            'ensemble_accuracy': ensemble_accuracy,
+            'accuracy': best['accuracy'],
+            'early_exit_rate': best['early_exit_rate']
+        }
+    }
+
+    if holdout:
+        print(f"\nChecking on {len(holdout)} held-out images...")
+        holdout_outputs = collect_probabilities(classifier, [path for path, _ in holdout])
+        holdout_labels = np.array([label for _, label in holdout])
+        accuracy, early_exit_rate = evaluate(
+            holdout_outputs, holdout_labels, CASCADE_FIRST_MODEL, best['min_confidence'], best['min_margin']
+        )
+        holdout_ensemble_accuracy = float((holdout_outputs['ensemble'].argmax(axis=1) == holdout_labels).mean())
+        print(f"Full ensemble accuracy: {holdout_ensemble_accuracy:.2%}")
+        print(f"Cascade accuracy:       {accuracy:.2%}")
+        print(f"Early-exit rate:        {early_exit_rate:.1%}")
+        report['holdout'] = {
+            'images': len(holdout),
+            'ensemble_accuracy': holdout_ensemble_accuracy,
+            'accuracy': accuracy,
+            'early_exit_rate': early_exit_rate
+        }
+
+    # Write next to the Keras models so the classifier finds it the same way; without a Keras
+    # file (e.g. only ONNX or TFLite exports) use the configured path itself
+    output_path = args.output
+    if output_path is None:
+        model_file = find_model_file(MODEL_PATHS[CASCADE_FIRST_MODEL])
+        if model_file is None:
+            output_path = CASCADE_THRESHOLDS_FILE
+        else:
+            output_path = os.path.join(os.path.dirname(model_file), os.path.basename(CASCADE_THRESHOLDS_FILE))
+    policy = CascadePolicy(CASCADE_FIRST_MODEL, best['min_confidence'], best['min_margin'])
+    policy.save(output_path, **report)
+    print(f"\nThresholds written to {output_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import argparse
+import os
+import sys
+import time
+from utils.prediction_utils import GarbageClassifier
+from utils.bulk import OUTPUT_FORMATS, ProgressPrinter, classify_source
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a directory, glob pattern, tar or zip archive of images")
+    parser.add_argument('input', help="Directory, glob pattern (quote it), .tar/.tar.gz or .zip archive")
+    parser.add_argument('output', help="Output file (.jsonl or .csv) or directory (.parquet)")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, help="Output format (default: from the output extension)")
+    parser.add_argument('--batch-size', type=int, default=32, help="Images per ensemble pass")
+    parser.add_argument('--decode-workers', type=int, default=os.cpu_count() or 4,
+                        help="Threads decoding and resizing images")
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: OUTPUT.checkpoint.json)")
+    parser.add_argument('--checkpoint-every', type=int, default=1000, help="Images between checkpoints")
+    parser.add_argument('--resume', action='store_true', help="Continue from the checkpoint of an interrupted run")
+    args = parser.parse_args()
+
+    classifier = GarbageClassifier()
+    if not classifier.models:
+        print("No models could be loaded")
+        return 1
+    print(f"Models loaded: {', '.join(classifier.models)}")
+
+    started = time.perf_counter()
+    written, total = classify_source(
+        classifier, args.input, args.output,
+        output_format=args.format,
+        batch_size=args.batch_size,
+        decode_workers=args.decode_workers,
+        checkpoint_path=args.checkpoint,
+        checkpoint_every=args.checkpoint_every,
+        resume=args.resume,
+        on_progress=ProgressPrinter()
+    )
+    elapsed = time.perf_counter() - started
+
+    print(f"\nClassified {written} images in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.1f} images/s)")
+    print(f"{total} records in {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -32,4 +32,97 @@ SENDER_PASSWORD = os.getenv('SENDER_PASSWORD')
 
 # MongoDB configuration
 MONGO_URI = os.getenv('MONGO_URI')
-MONGO_DB_NAME = os.getenv('MONGO_DB_NAME')
\ No newline at end of file
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME')
+# Shared MongoDB connection pool (per process) and timeouts in milliseconds (0 means no limit)
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '10000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '10000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '0'))
+# Read preference of the admin dashboard queries; set 'secondaryPreferred' on a replica set to read
+# from secondaries, at the cost of counts that may lag behind the primary
+MONGO_DASHBOARD_READ_PREFERENCE = os.getenv('MONGO_DASHBOARD_READ_PREFERENCE', 'primary')
+
+# Save predictions on a background thread in batches of up to PREDICTION_WRITE_BATCH_SIZE, at most
+# PREDICTION_WRITE_INTERVAL_MS after the first one; batches that keep failing go to the spill file, as do
+# predictions saved while PREDICTION_WRITE_QUEUE_SIZE are already waiting
+PREDICTION_WRITE_BEHIND = os.getenv('PREDICTION_WRITE_BEHIND', 'true').lower() == 'true'
+PREDICTION_WRITE_BATCH_SIZE = int(os.getenv('PREDICTION_WRITE_BATCH_SIZE', '50'))
+PREDICTION_WRITE_INTERVAL_MS = float(os.getenv('PREDICTION_WRITE_INTERVAL_MS', '200'))
+PREDICTION_WRITE_RETRIES = int(os.getenv('PREDICTION_WRITE_RETRIES', '5'))
+PREDICTION_WRITE_QUEUE_SIZE = int(os.getenv('PREDICTION_WRITE_QUEUE_SIZE', '1000'))
+PREDICTION_SPILL_FILE = os.getenv('PREDICTION_SPILL_FILE', '.write_behind/prediction_spill.jsonl')
+PREDICTION_SPILL_MAX_BYTES = int(os.getenv('PREDICTION_SPILL_MAX_BYTES', str(256 * 1024 * 1024)))
+# Create missing MongoDB indexes when the app starts (manage_indexes.py does the same on demand)
+DB_ENSURE_INDEXES = os.getenv('DB_ENSURE_INDEXES', 'true').lower() == 'true'
+# Recount the admin dashboard statistics rollups from scratch every this many seconds (0 disables)
+STATS_RECONCILE_INTERVAL = float(os.getenv('STATS_RECONCILE_INTERVAL', '3600'))
+
+# Inference thread budgets (0 lets TensorFlow pick based on the machine)
+INFERENCE_INTER_OP_THREADS = int(os.getenv('INFERENCE_INTER_OP_THREADS', '0'))
+INFERENCE_INTRA_OP_THREADS = int(os.getenv('INFERENCE_INTRA_OP_THREADS', '0'))
+INFERENCE_CONCURRENT = os.getenv('INFERENCE_CONCURRENT', 'false').lower() == 'true'
+
+# Micro-batching of concurrent prediction requests
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '16'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '5'))
+
+# Inference backend: 'tensorflow', 'tflite' or 'onnx' (converted models from convert_models.py)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'tensorflow')
+TFLITE_QUANTIZATION = os.getenv('TFLITE_QUANTIZATION', 'int8')
+TFLITE_NUM_THREADS = int(os.getenv('TFLITE_NUM_THREADS', '4'))
+ONNX_NUM_THREADS = int(os.getenv('ONNX_NUM_THREADS', '0'))
+
+# Load models in a background thread and wait at most this many seconds for them on the upload page
+MODEL_LAZY_LOADING = os.getenv('MODEL_LAZY_LOADING', 'true').lower() == 'true'
+MODEL_STARTUP_BUDGET = float(os.getenv('MODEL_STARTUP_BUDGET', '10'))
+
+# Send uint8 pixels to the models and normalize inside the model graph
+NORMALIZE_IN_GRAPH = os.getenv('NORMALIZE_IN_GRAPH', 'false').lower() == 'true'
+
+# Prediction cache keyed by image hash: in-memory LRU size (0 disables), entry lifetime in seconds,
+# and optional persistent tier ('disk' or 'mongo')
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '1024'))
+PREDICTION_CACHE_TTL = int(os.getenv('PREDICTION_CACHE_TTL', '86400'))
+PREDICTION_CACHE_BACKEND = os.getenv('PREDICTION_CACHE_BACKEND', '')
+PREDICTION_CACHE_DIR = os.getenv('PREDICTION_CACHE_DIR', '.prediction_cache')
+# Most result files kept in PREDICTION_CACHE_DIR (0 keeps all, expired files are always removed)
+PREDICTION_CACHE_DIR_MAX_ENTRIES = int(os.getenv('PREDICTION_CACHE_DIR_MAX_ENTRIES', '10000'))
+
+# Reuse a stored prediction when an upload's perceptual hash is within this many bits (-1 disables)
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', '4'))
+# Near-duplicate lookups only consider a user's own PHASH_INDEX_MAX_ENTRIES most recent hashed
+# predictions made by the serving models, and at most PHASH_INDEX_MAX_USERS users' indexes are kept in memory
+PHASH_INDEX_MAX_ENTRIES = int(os.getenv('PHASH_INDEX_MAX_ENTRIES', '1000'))
+PHASH_INDEX_MAX_USERS = int(os.getenv('PHASH_INDEX_MAX_USERS', '100'))
+
+# Early-exit cascade: run MobileNetV2 first and only run the other models when it is unsure
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'false').lower() == 'true'
+CASCADE_THRESHOLDS_FILE = os.getenv('CASCADE_THRESHOLDS_FILE', 'models/saved_models/cascade_thresholds.json')
+
+# Run the models in this many worker processes (0 runs them in the app process) and give up on
+# a worker batch after this many seconds
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '0'))
+INFERENCE_WORKER_TIMEOUT = float(os.getenv('INFERENCE_WORKER_TIMEOUT', '60'))
+# Stop restarting a worker after it has crashed this many times in a row (restarts back off
+# exponentially, up to a minute apart)
+INFERENCE_WORKER_MAX_RESTARTS = int(os.getenv('INFERENCE_WORKER_MAX_RESTARTS', '5'))
+
+# Standalone inference server (inference_server.py); set INFERENCE_SERVER_URL to have the app use it
+INFERENCE_SERVER_HOST = os.getenv('INFERENCE_SERVER_HOST', '0.0.0.0')
+INFERENCE_SERVER_PORT = int(os.getenv('INFERENCE_SERVER_PORT', '8000'))
+INFERENCE_SERVER_URL = os.getenv('INFERENCE_SERVER_URL', '')
+INFERENCE_SERVER_TIMEOUT = float(os.getenv('INFERENCE_SERVER_TIMEOUT', '30'))
+
+# Where uploaded images are kept: 'gridfs' (MongoDB), 'local' (IMAGE_STORE_DIR) or 's3' (S3-compatible bucket)
+IMAGE_STORE_BACKEND = os.getenv('IMAGE_STORE_BACKEND', 'gridfs')
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', 'image_store')
+IMAGE_STORE_S3_BUCKET = os.getenv('IMAGE_STORE_S3_BUCKET')
+IMAGE_STORE_S3_PREFIX = os.getenv('IMAGE_STORE_S3_PREFIX', 'images/')
+IMAGE_STORE_S3_ENDPOINT = os.getenv('IMAGE_STORE_S3_ENDPOINT')
+
+# Thumbnails shown in the prediction history: longest side in pixels, format (WEBP or JPEG) and quality
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', '256'))
+THUMBNAIL_FORMAT = os.getenv('THUMBNAIL_FORMAT', 'WEBP')
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '80'))
\ No newline at end of file
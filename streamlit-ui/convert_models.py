@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from utils.prediction_utils import GarbageClassifier, MEAN, STD, MODEL_PATHS, find_model_file
+from utils.tflite_utils import QUANTIZATIONS, convert_model, tflite_model_path
+from utils.onnx_utils import export_model, onnx_model_path
+from utils.evaluation import list_labelled_images, collect_probabilities
+
+def convert_all(quantizations, normalization=None):
+    # Convert every saved Keras model to each requested TFLite variant
+    print("Converting models...")
+
+    for name, path in MODEL_PATHS.items():
+        keras_file = find_model_file(path)
+        if not keras_file:
+            print(f"  {name}: Keras model not found at {path}")
+            continue
+
+        for quantization in quantizations:
+            # Write next to the Keras file so the classifier finds it the same way
+            output_path = os.path.join(
+                os.path.dirname(keras_file),
+                'tflite',
+                os.path.basename(tflite_model_path(name, quantization))
+            )
+            size = convert_model(keras_file, output_path, quantization, normalization)
+            keras_size = os.path.getsize(keras_file)
+            print(f"  {name} ({quantization}): {size / 1e6:.1f} MB (Keras: {keras_size / 1e6:.1f} MB)")
+
+def export_all_onnx(normalization=None):
+    # Export every saved Keras model to ONNX for the onnx backend
+    print("Exporting models to ONNX...")
+
+    for name, path in MODEL_PATHS.items():
+        keras_file = find_model_file(path)
+        if not keras_file:
+            print(f"  {name}: Keras model not found at {path}")
+            continue
+
+        output_path = os.path.join(
+            os.path.dirname(keras_file),
+            'onnx',
+            os.path.basename(onnx_model_path(name))
+        )
+        size = export_model(keras_file, output_path, normalization=normalization)
+        print(f"  {name} (onnx): {size / 1e6:.1f} MB")
+
+def accuracy_report(eval_dir, quantizations, limit=None):
+    # Compare each quantized variant against the float models on labelled images
+    images = list_labelled_images(eval_dir, limit)
+    if not images:
+        raise ValueError(f"No labelled images found in {eval_dir}")
+
+    image_paths = [path for path, _ in images]
+    labels = np.array([label for _, label in images])
+    print(f"\nEvaluating on {len(images)} images...")
+
+    reference = collect_probabilities(GarbageClassifier(backend='tensorflow', cascade=False), image_paths)
+    report = {'images': len(images), 'float32': {}, 'variants': {}}
+
+    for name, probs in reference.items():
+        report['float32'][name] = {'accuracy': float((probs.argmax(axis=1) == labels).mean())}
+
+    for quantization in quantizations:
+        classifier = GarbageClassifier(backend='tflite', quantization=quantization, cascade=False)
+        variant = collect_probabilities(classifier, image_paths)
+        report['variants'][quantization] = {}
+
+        for name, probs in variant.items():
+            float_probs = reference[name]
+            accuracy = float((probs.argmax(axis=1) == labels).mean())
+            report['variants'][quantization][name] = {
+                'accuracy': accuracy,
+                'accuracy_delta': accuracy - report['float32'][name]['accuracy'],
+                'top1_agreement': float((probs.argmax(axis=1) == float_probs.argmax(axis=1)).mean()),
+                'max_abs_diff': float(np.abs(probs - float_probs).max())
+            }
+
+    return report
+
+def print_report(report):
+    # Print the accuracy table
+    print(f"\n=== Accuracy Report ({report['images']} images) ===")
+    print(f"{'model':<12} {'variant':<8} {'accuracy':>9} {'delta':>8} {'agree':>7} {'max diff':>9}")
+    for name, stats in report['float32'].items():
+        print(f"{name:<12} {'float32':<8} {stats['accuracy']:>9.2%}")
+        for quantization, variant in report['variants'].items():
+            if name in variant:
+                v = variant[name]
+                print(f"{name:<12} {quantization:<8} {v['accuracy']:>9.2%} {v['accuracy_delta']:>+8.2%} "
+                      f"{v['top1_agreement']:>7.1%} {v['max_abs_diff']:>9.4f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the saved models to quantized TFLite variants")
+    parser.add_argument('--quantization', nargs='+', choices=QUANTIZATIONS, default=list(QUANTIZATIONS))
+    parser.add_argument('--onnx', action='store_true', help="Also export the models to ONNX")
+    parser.add_argument('--normalize-in-graph', action='store_true',
+                        help="Build the normalization into the converted models so they take uint8 pixels")
+    parser.add_argument('--eval-dir', help="Directory with one folder of images per class for the accuracy report")
+    parser.add_argument('--limit', type=int, help="Maximum number of images per class to evaluate")
+    parser.add_argument('--report', help="Write the accuracy report as JSON to this file")
+    parser.add_argument('--skip-convert', action='store_true', help="Only run the accuracy report")
+    args = parser.parse_args()
+
+    if not args.skip_convert:
+        normalization = (MEAN, STD) if args.normalize_in_graph else None
+        convert_all(args.quantization, normalization)
+        if args.onnx:
+            export_all_onnx(normalization)
+
+    if args.eval_dir:
+        report = accuracy_report(args.eval_dir, args.quantization, args.limit)
+        print_report(report)
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"\nReport written to {args.report}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import io
+import sys
+try:
+    from aiohttp import web # pyright: ignore[reportMissingImports]
+except ImportError:
+    raise ImportError("inference_server.py requires aiohttp (see requirements-optional.txt)") from None
+from config import INFERENCE_SERVER_HOST, INFERENCE_SERVER_PORT, MODEL_LAZY_LOADING
+from utils.prediction_utils import GarbageClassifier, get_recycling_info
+from utils.prediction_cache import create_prediction_cache, result_to_dict
+from utils.batching import MicroBatcher
+
+# Largest accepted request body
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+async def read_images(request):
+    # Collect image bytes from a multipart form (every file part) or a raw request body
+    if request.content_type.startswith('multipart/'):
+        images = []
+        reader = await request.multipart()
+        async for part in reader:
+            if part.filename is not None or part.name in ('image', 'file', 'images', 'files'):
+                images.append(bytes(await part.read()))
+        return images
+
+    body = await request.read()
+    return [body] if body else []
+
+async def classify(request, images):
+    # Queue the images on the shared micro-batcher without blocking the event loop. submit()
+    # looks each image up in the prediction cache first, which can read disk or MongoDB,
+    # so it runs in the default executor too
+    batcher = request.app['batcher']
+    loop = asyncio.get_running_loop()
+    submitted = await asyncio.gather(*(loop.run_in_executor(None, batcher.submit, io.BytesIO(data)) for data in images))
+    futures = [asyncio.wrap_future(future) for future in submitted]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+
+    responses = []
+    for result in results:
+        if isinstance(result, Exception):
+            responses.append({'error': f"Prediction failed: {result}"})
+        elif result is None:
+            responses.append({'error': "Could not read the image"})
+        else:
+            response = result_to_dict(result)
+            response['recycling_info'] = get_recycling_info(result['predicted_class'])
+            responses.append(response)
+    return responses
+
+def models_unavailable(request):
+    if not request.app['classifier'].models:
+        return web.json_response({'error': "Models are still loading"}, status=503)
+    return None
+
+async def predict(request):
+    """POST /predict: classify one image sent as raw bytes or as a multipart file"""
+    images = await read_images(request)
+    if not images:
+        return web.json_response({'error': "No image in request"}, status=400)
+
+    unavailable = models_unavailable(request)
+    if unavailable is not None:
+        return unavailable
+
+    response = (await classify(request, images[:1]))[0]
+    return web.json_response(response, status=422 if 'error' in response else 200)
+
+async def predict_batch(request):
+    """POST /predict/batch: classify every file of a multipart request, in order"""
+    images = await read_images(request)
+    if not images:
+        return web.json_response({'error': "No images in request"}, status=400)
+
+    unavailable = models_unavailable(request)
+    if unavailable is not None:
+        return unavailable
+
+    return web.json_response({'results': await classify(request, images)})
+
+async def health(request):
+    """GET /health: the process is up"""
+    return web.json_response({'status': 'ok'})
+
+async def ready(request):
+    """GET /ready: 200 once at least one model can serve predictions, with loading progress and model version"""
+    classifier = request.app['classifier']
+    progress = dict(classifier.get_loading_progress(), model_version=classifier.model_version)
+    return web.json_response(progress, status=200 if progress['loaded'] > 0 else 503)
+
+async def close_batcher(app):
+    app['batcher'].close()
+
+def create_app(classifier):
+    """Build the aiohttp application around a classifier"""
+    app = web.Application(client_max_size=MAX_BODY_BYTES)
+    app['classifier'] = classifier
+    app['batcher'] = MicroBatcher(classifier)
+    app.on_cleanup.append(close_batcher)
+    app.router.add_post('/predict', predict)
+    app.router.add_post('/predict/batch', predict_batch)
+    app.router.add_get('/health', health)
+    app.router.add_get('/ready', ready)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the garbage classification ensemble over HTTP")
+    parser.add_argument('--host', default=INFERENCE_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=INFERENCE_SERVER_PORT)
+    args = parser.parse_args()
+
+    # Start listening right away; /ready reports when the models have loaded
+    classifier = GarbageClassifier(lazy=MODEL_LAZY_LOADING, cache=create_prediction_cache())
+    web.run_app(create_app(classifier), host=args.host, port=args.port)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
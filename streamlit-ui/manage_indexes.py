@@ -0,0 +1,61 @@
+import argparse
+import sys
+from utils.db_utils import db
+from utils.db_indexes import (
+    INDEXES, ensure_indexes, find_duplicate_emails, missing_indexes, unused_indexes, check_query_plans
+)
+
+def ensure():
+    # Create the indexes and show which ones failed
+    print(f"Ensuring {len(INDEXES)} indexes...")
+    failed = False
+    for collection, name, error in ensure_indexes(db):
+        if error:
+            failed = True
+            print(f"  {collection}.{name}: FAILED ({error})")
+        else:
+            print(f"  {collection}.{name}: ok")
+
+    duplicates = find_duplicate_emails(db)
+    if duplicates:
+        print("\nDuplicate user emails (remove them before the unique email index can be built):")
+        for email, count in duplicates:
+            print(f"  {email}: {count} users")
+
+    return 1 if failed else 0
+
+def report():
+    # Show missing and unused indexes and check the plans of the main queries
+    print("=== Missing Indexes ===")
+    missing = missing_indexes(db)
+    for collection, name, keys in missing:
+        print(f"  {collection}.{name}: {keys}")
+    if not missing:
+        print("  none")
+
+    print("\n=== Unused Indexes (since server start) ===")
+    unused = unused_indexes(db)
+    for collection, name, since in unused:
+        print(f"  {collection}.{name} (no operations since {since})")
+    if not unused:
+        print("  none")
+
+    print("\n=== Query Plans ===")
+    unindexed = 0
+    for description, stages, problems in check_query_plans(db):
+        status = f"NOT INDEX-BACKED ({', '.join(problems)})" if problems else "ok"
+        print(f"  {description}: {status} [{' > '.join(stages)}]")
+        unindexed += bool(problems)
+
+    return 1 if missing or unindexed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and check the MongoDB indexes")
+    parser.add_argument('command', choices=['ensure', 'report'], nargs='?', default='ensure',
+                        help="ensure: create missing indexes (default); report: show missing/unused indexes and query plans")
+    args = parser.parse_args()
+
+    return ensure() if args.command == 'ensure' else report()
+
+if __name__ == "__main__":
+    sys.exit(main())
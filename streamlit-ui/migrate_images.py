@@ -0,0 +1,126 @@
+import argparse
+import base64
+import mimetypes
+import sys
+from datetime import datetime, timedelta, timezone
+from utils.db_utils import db, image_store, store_thumbnail, is_image_referenced
+
+def migrate(batch_size=100, dry_run=False):
+    # Move embedded base64 images into the image store, a batch at a time in _id order
+    failed = []
+    migrated = 0
+    saved_bytes = 0
+    last_id = None
+
+    while True:
+        query = {"image_data": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(
+            db.predictions.find(query, {"image_data": 1, "image_filename": 1}).sort("_id", 1).limit(batch_size)
+        )
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+
+        for pred in batch:
+            try:
+                image_bytes = base64.b64decode(pred['image_data'])
+                content_type = mimetypes.guess_type(pred.get('image_filename') or '')[0]
+                if not dry_run:
+                    image_ref = image_store.put(image_bytes, content_type)
+                    db.predictions.update_one(
+                        {"_id": pred['_id']},
+                        {"$set": {"image_ref": image_ref}, "$unset": {"image_data": ""}}
+                    )
+                migrated += 1
+                saved_bytes += len(pred['image_data'])
+            except Exception as e:
+                print(f"  {pred['_id']}: {e}")
+                failed.append(pred['_id'])
+
+        print(f"  {migrated} migrated, {len(failed)} failed")
+
+    return migrated, failed, saved_bytes
+
+def backfill_thumbnails(batch_size=100):
+    # Make thumbnails for predictions saved before thumbnails existed
+    made = 0
+    failed = 0
+    last_id = None
+
+    while True:
+        query = {"thumbnail_ref": {"$exists": False}, "image_ref": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(db.predictions.find(query, {"image_ref": 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+
+        for pred in batch:
+            try:
+                image_bytes = image_store.get(pred['image_ref']['id'])
+                if image_bytes is None:
+                    raise ValueError("image missing from the image store")
+                store_thumbnail(pred['_id'], image_bytes)
+                made += 1
+            except Exception as e:
+                print(f"  {pred['_id']}: {e}")
+                failed += 1
+
+        print(f"  {made} thumbnails made, {failed} failed")
+
+    return made, failed
+
+def collect_garbage(min_age_hours=24, dry_run=False):
+    # Delete stored images and thumbnails that no prediction references. Recent ones are
+    # skipped, since a prediction may be about to be saved with them.
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=min_age_hours)
+    deleted = 0
+    checked = 0
+
+    for image_id, stored_at in image_store.list_images():
+        checked += 1
+        if stored_at > cutoff or is_image_referenced(image_id):
+            continue
+        if not dry_run:
+            image_store.delete(image_id)
+        deleted += 1
+
+    print(f"  {checked} stored images checked, {deleted} unreferenced")
+    return deleted
+
+def main():
+    parser = argparse.ArgumentParser(description="Move images embedded in prediction documents to the image store")
+    parser.add_argument('--batch-size', type=int, default=100, help="Documents read per query")
+    parser.add_argument('--dry-run', action='store_true', help="Only decode the images and report what would move")
+    parser.add_argument('--thumbnails', action='store_true', help="Also make thumbnails for predictions without one")
+    parser.add_argument('--gc', action='store_true', help="Also delete stored images that no prediction references")
+    parser.add_argument('--gc-min-age', type=float, default=24,
+                        help="Only delete unreferenced images stored at least this many hours ago")
+    args = parser.parse_args()
+
+    print(f"Migrating images to the {image_store.name} image store...")
+    migrated, failed, saved_bytes = migrate(args.batch_size, args.dry_run)
+
+    print(f"\n{migrated} images {'would be ' if args.dry_run else ''}moved, "
+          f"{saved_bytes / 1e6:.1f} MB of base64 removed from predictions")
+    if failed:
+        print(f"{len(failed)} documents could not be migrated")
+
+    thumbnail_failures = 0
+    if args.thumbnails and not args.dry_run:
+        print("\nMaking missing thumbnails...")
+        made, thumbnail_failures = backfill_thumbnails(args.batch_size)
+        print(f"\n{made} thumbnails made")
+
+    if args.gc:
+        print("\nDeleting unreferenced images...")
+        deleted = collect_garbage(args.gc_min_age, args.dry_run)
+        print(f"\n{deleted} images {'would be ' if args.dry_run else ''}deleted")
+
+    return 1 if failed or thumbnail_failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
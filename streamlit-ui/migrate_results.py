@@ -0,0 +1,56 @@
+import argparse
+import sys
+from pymongo import UpdateOne
+from utils.db_utils import db
+from utils.result_codec import RESULT_FIELDS, migrate_fields
+
+def migrate(batch_size=100, dry_run=False):
+    # Convert JSON top_predictions strings to the compact result fields, a batch at a time in _id order
+    failed = []
+    migrated = 0
+    last_id = None
+
+    while True:
+        query = {"top_predictions": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(db.predictions.find(query, RESULT_FIELDS).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]['_id']
+
+        updates = []
+        for pred in batch:
+            update = migrate_fields(pred)
+            if update is None:
+                print(f"  {pred['_id']}: unreadable result")
+                failed.append(pred['_id'])
+                continue
+            fields, removed = update
+            updates.append(UpdateOne({"_id": pred['_id']}, {"$set": fields, "$unset": removed}))
+
+        if updates and not dry_run:
+            db.predictions.bulk_write(updates, ordered=False)
+        migrated += len(updates)
+
+        print(f"  {migrated} migrated, {len(failed)} failed")
+
+    return migrated, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert prediction results to the compact storage format")
+    parser.add_argument('--batch-size', type=int, default=100, help="Documents read per query")
+    parser.add_argument('--dry-run', action='store_true', help="Only decode the results and report what would change")
+    args = parser.parse_args()
+
+    print("Migrating prediction results...")
+    migrated, failed = migrate(args.batch_size, args.dry_run)
+
+    print(f"\n{migrated} predictions {'would be ' if args.dry_run else ''}converted")
+    if failed:
+        print(f"{len(failed)} documents could not be converted")
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
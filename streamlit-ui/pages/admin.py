@@ -1,10 +1,10 @@
 import streamlit as st
 import pandas as pd
-from pymongo import MongoClient
-from datetime import datetime, timedelta
 import plotly.express as px
-from utils.db_utils import get_all_user_predictions
-from config import MONGO_URI, MONGO_DB_NAME
+from utils.db_utils import (
+    get_all_user_predictions, get_users_with_prediction_stats, get_dashboard_statistics, build_user_query,
+    count_users, mark_user_verified, delete_user, start_stats_reconciler
+)
 
 # Page configuration
 st.set_page_config(
@@ -16,9 +16,8 @@ st.set_page_config(
 
 st.title("Admin Panel")
 
-# MongoDB connection
-client = MongoClient(MONGO_URI)
-db = client[MONGO_DB_NAME]
+# The dashboard reads the statistics rollups, which the reconciler keeps correct
+start_stats_reconciler()
 
 # Check if it is admin
 if not st.session_state.get('authenticated') or st.session_state.get('user_type') != 'admin':
@@ -65,16 +64,14 @@ if page == "Dashboard":
   st.header("System Dashboard")
   
   try:
-      # Get database statistics
-      total_users = db.users.count_documents({})
-      verified_users = db.users.count_documents({"is_verified": 1})
-      unverified_users = db.users.count_documents({"is_verified": 0})
-      total_predictions = db.predictions.count_documents({})
-      
-      # Get recent activity (last 7 days)
-      week_ago = datetime.now() - timedelta(days=7)
-      recent_predictions = db.predictions.count_documents({"created_at": {"$gte": week_ago}})
-      recent_users = db.users.count_documents({"created_at": {"$gte": week_ago}})
+      # Get database statistics from the precomputed rollups (recent activity covers the last 7 days)
+      stats = get_dashboard_statistics(days=7)
+      total_users = stats["total_users"]
+      verified_users = stats["verified_users"]
+      unverified_users = stats["unverified_users"]
+      total_predictions = stats["total_predictions"]
+      recent_predictions = stats["recent_predictions"]
+      recent_users = stats["recent_users"]
       
       # Main metrics
       col1, col2, col3, col4 = st.columns(4)
@@ -110,15 +107,11 @@ if page == "Dashboard":
           st.subheader("Prediction Categories")
           try:
               # Get prediction category distribution
-              pipeline = [
-                  {"$group": {"_id": "$predicted_class", "count": {"$sum": 1}}},
-                  {"$sort": {"count": -1}}
-              ]
-              category_data = list(db.predictions.aggregate(pipeline))
+              category_data = sorted(stats["classes"].items(), key=lambda item: item[1], reverse=True)
               
               if category_data:
-                  categories = [item['_id'].title() for item in category_data]
-                  counts = [item['count'] for item in category_data]
+                  categories = [name.title() for name, _ in category_data]
+                  counts = [count for _, count in category_data]
                   
                   fig_bar = px.bar(
                       x=categories,
@@ -137,6 +130,9 @@ if page == "Dashboard":
                   st.info("No prediction data available")
           except Exception as e:
               st.error(f"Error loading prediction data: {e}")
+      
+      if stats["reconciled_at"]:
+          st.caption(f"Statistics are updated live and fully recounted periodically (last recount: {stats['reconciled_at'].strftime('%Y-%m-%d %H:%M:%S')})")
   
   except Exception as e:
       st.error(f"Error accessing database: {e}")
@@ -155,34 +151,26 @@ elif page == "User Management":
           sort_by = st.selectbox("Sort by", ["Registration Date", "Name", "Email"])
       
       # Build query
-      query = {}
-      if search_term:
-          query["$or"] = [
-              {"name": {"$regex": search_term, "$options": "i"}},
-              {"email": {"$regex": search_term, "$options": "i"}}
-          ]
-      
-      if filter_status == "Verified":
-          query["is_verified"] = 1
-      elif filter_status == "Unverified":
-          query["is_verified"] = 0
+      query = build_user_query(search_term, filter_status)
       
-      # Get users with sorting
+      # Count matching users; only the current page is fetched
       sort_field = "created_at" if sort_by == "Registration Date" else sort_by.lower()
-      users = list(db.users.find(query).sort(sort_field, -1))
+      total_users = count_users(query)
       
-      if users:
-          st.success(f"Found {len(users)} users")
+      if total_users:
+          st.success(f"Found {total_users} users")
           
           st.markdown("---")
           st.subheader("User List")
           
           # Pagination
           items_per_page = 10
-          total_pages = (len(users) + items_per_page - 1) // items_per_page
+          total_pages = (total_users + items_per_page - 1) // items_per_page
           
           if 'admin_user_page' not in st.session_state:
               st.session_state['admin_user_page'] = 1
+          # The filters may have left fewer pages than before
+          st.session_state['admin_user_page'] = min(st.session_state['admin_user_page'], total_pages)
           
           if total_pages > 1:
               col1, col2, col3 = st.columns([1, 2, 1])
@@ -197,10 +185,9 @@ elif page == "User Management":
                       st.session_state['admin_user_page'] += 1
                       st.rerun()
           
-          # Display users for current page
+          # Get the users of the current page with their prediction statistics in one query
           start_idx = (st.session_state['admin_user_page'] - 1) * items_per_page
-          end_idx = min(start_idx + items_per_page, len(users))
-          current_users = users[start_idx:end_idx]
+          current_users = get_users_with_prediction_stats(query, sort_field, skip=start_idx, limit=items_per_page)
           
           for i, user in enumerate(current_users, start=start_idx):
               name = user.get("name") if user.get("name") else user.get("email")
@@ -208,27 +195,12 @@ elif page == "User Management":
               status_color = "green" if user.get("is_verified") else "orange"
               user_email = user.get("email")
               
-              # Get user's prediction statistics
-              user_predictions = list(db.predictions.find({"user_email": user_email}))
-              pred_count = len(user_predictions)
-              
-              # Calculate prediction statistics
-              if user_predictions:
-                  # Get most predicted class
-                  class_counts = {}
-                  total_confidence = 0
-                  for pred in user_predictions:
-                      predicted_class = pred.get("predicted_class", "Unknown")
-                      class_counts[predicted_class] = class_counts.get(predicted_class, 0) + 1
-                      total_confidence += pred.get("confidence", 0)
-                  
-                  most_predicted = max(class_counts, key=class_counts.get) if class_counts else "None"
-                  avg_confidence = (total_confidence / pred_count * 100) if pred_count > 0 else 0
-                  last_prediction = max(pred.get("created_at", datetime.min) for pred in user_predictions)
-              else:
-                  most_predicted = "None"
-                  avg_confidence = 0
-                  last_prediction = "Never"
+              # Prediction statistics computed by the aggregation
+              pred_count = user["pred_count"]
+              class_counts = user["class_counts"]
+              most_predicted = next(iter(class_counts), "None")
+              avg_confidence = user["avg_confidence"] * 100
+              last_prediction = user["last_prediction"] or "Never"
               
               with st.expander(f"{name} - {user_email} - :{status_color}[{status_text}] - {pred_count} predictions"):
                   col1, col2 = st.columns([3, 1])
@@ -262,10 +234,7 @@ elif page == "User Management":
                       
                       if not user.get("is_verified"):
                           if st.button(f"Verify User", key=f"verify_{i}"):
-                              db.users.update_one(
-                                  {"email": user_email},
-                                  {"$set": {"is_verified": 1}}
-                              )
+                              mark_user_verified(user_email)
                               st.success(f"User {name} verified!")
                               st.rerun()
                       else:
@@ -283,8 +252,7 @@ elif page == "User Management":
                               st.warning("Click again to confirm deletion")
                               st.session_state[confirm_key] = True
                           else:
-                              db.users.delete_one({"email": user_email})
-                              db.predictions.delete_many({"user_email": user_email})
+                              delete_user(user_email)
                               st.success(f"User {name} deleted!")
                               del st.session_state[confirm_key]
                               st.rerun()
@@ -1,9 +1,10 @@
-import base64
 import io
 import streamlit as st
-import json
 from datetime import datetime
-from utils.db_utils import get_user_predictions, delete_prediction
+from utils.db_utils import (
+    get_user_predictions_page, count_user_predictions, get_user_prediction_classes,
+    get_prediction_image, get_prediction_thumbnail, delete_prediction
+)
 
 st.title("Prediction History")
 
@@ -37,10 +38,10 @@ user_name = st.session_state.get('user_name', st.session_state.get('user'))
 user_email = st.session_state.get('user')
 st.success(f"Welcome, {user_name}!")
 
-# Get user's prediction history
-predictions = get_user_predictions(st.session_state['user'])
+# Check whether the user has any predictions (pages are loaded below)
+total_predictions = count_user_predictions(user_email)
 
-if not predictions:
+if not total_predictions:
   st.info("No prediction history found. Start by uploading an image!")
   col1, col2 = st.columns(2)
   with col1:
@@ -54,61 +55,58 @@ if not predictions:
 # Display prediction history
 st.subheader("Your Recent Predictions")
 
+# Sort options and the matching database sort orders
+SORT_OPTIONS = {
+  "Date (Newest)": 'date_desc',
+  "Date (Oldest)": 'date_asc',
+  "Confidence (High)": 'confidence_desc',
+  "Confidence (Low)": 'confidence_asc'
+}
+
 # Add filter options
 col1, col2 = st.columns([2, 1])
 with col1:
   # Get unique categories for dropdown
-  unique_categories = sorted(list(set([pred[2] for pred in predictions])))
+  unique_categories = get_user_prediction_classes(user_email)
   filter_category = st.selectbox("Filter by waste category", ["All Categories"] + unique_categories)
 with col2:
-  sort_by = st.selectbox("Sort by", ["Date (Newest)", "Date (Oldest)", "Confidence (High)", "Confidence (Low)"])
-
-# Filter and sort predictions
-filtered_predictions = predictions
-if filter_category != "All Categories":
-  filtered_predictions = [p for p in predictions if p[2] == filter_category]
-
-# Sort predictions
-if sort_by == "Date (Oldest)":
-  filtered_predictions = sorted(filtered_predictions, key=lambda x: x[5])
-elif sort_by == "Confidence (High)":
-  filtered_predictions = sorted(filtered_predictions, key=lambda x: x[3], reverse=True)
-elif sort_by == "Confidence (Low)":
-  filtered_predictions = sorted(filtered_predictions, key=lambda x: x[3])
-
-# Display predictions
-# Limit to show only 6 predictions at a time (increased from 4)
+  sort_by = st.selectbox("Sort by", list(SORT_OPTIONS))
+
+category = None if filter_category == "All Categories" else filter_category
+
+# Show 6 predictions per page; filtering, sorting and paging happen in the database
 max_display = 6
-total_filtered = len(filtered_predictions)
+total_filtered = count_user_predictions(user_email, category)
+total_pages = max(1, (total_filtered + max_display - 1) // max_display)
+
+# Go back to the first page whenever the filter or sort order changes
+history_view = (category, sort_by)
+if st.session_state.get('history_view') != history_view:
+  st.session_state['history_view'] = history_view
+  st.session_state['history_cursors'] = [None]
+
+# Cursor where each page visited so far starts, so Next and Previous never skip over documents
+cursors = st.session_state['history_cursors']
+current_page = len(cursors)
+
+predictions_to_show, next_cursor = get_user_predictions_page(
+  user_email, category, SORT_OPTIONS[sort_by], limit=max_display, after=cursors[-1]
+)
 
 # Add pagination controls
 if total_filtered > max_display:
-  # Initialize current page
-  if 'current_page' not in st.session_state:
-      st.session_state['current_page'] = 1
-  
-  current_page = st.session_state['current_page']
-  total_pages = (total_filtered + max_display - 1) // max_display
-  
-  # Simple pagination with buttons
   col1, col2, col3 = st.columns([1, 2, 1])
   with col1:
       if st.button("Previous", disabled=current_page <= 1):
-          st.session_state['current_page'] = current_page - 1
+          cursors.pop()
           st.rerun()
   with col2:
       st.write(f"Page {current_page} of {total_pages}")
   with col3:
-      if st.button("Next", disabled=current_page >= total_pages):
-          st.session_state['current_page'] = current_page + 1
+      if st.button("Next", disabled=next_cursor is None):
+          cursors.append(next_cursor)
           st.rerun()
 
-# Get the predictions to display
-current_page = st.session_state.get('current_page', 1)
-start_idx = (current_page - 1) * max_display
-end_idx = min(start_idx + max_display, total_filtered)
-predictions_to_show = filtered_predictions[start_idx:end_idx]
-
 # Display predictions in a cleaner format
 for pred in predictions_to_show:
   try:
@@ -116,25 +114,33 @@ for pred in predictions_to_show:
       image_filename = pred[1]
       predicted_class = pred[2]
       confidence = pred[3]
-      top_predictions_str = pred[4]
+      top_predictions = pred[4]
       created_at = pred[5]
       user_name = pred[6]
-      image_data = pred[7] if len(pred) > 7 else None
+      thumbnail_ref = pred[8] if len(pred) > 8 else None
 
       with st.expander(f"{predicted_class.title()} - {confidence:.1%} - {created_at}"):
           col1, col2, col3 = st.columns([2, 2, 1])
           
           with col1:
               try:
-                  if image_data:
-                      image_bytes = base64.b64decode(image_data)
+                  thumbnail_bytes = get_prediction_thumbnail(pred_id, user_email, thumbnail_ref)
+                  if thumbnail_bytes:
                       st.image(
-                          io.BytesIO(image_bytes),
+                          io.BytesIO(thumbnail_bytes),
                           caption=f"Prediction: {predicted_class}",
                           use_container_width=True
                       )
                   else:
                       st.error("Image not available")
+                  
+                  # Only download the original when asked for
+                  if thumbnail_bytes and st.toggle("Show full image", key=f"full_{pred_id}"):
+                      image_bytes = get_prediction_image(pred_id, user_email)
+                      if image_bytes:
+                          st.image(io.BytesIO(image_bytes), use_container_width=True)
+                      else:
+                          st.error("Image not available")
               except Exception as e:
                   st.error(f"Error displaying image: {str(e)}")
           
@@ -143,12 +149,11 @@ for pred in predictions_to_show:
               st.write(f"**Confidence:** {confidence:.1%}")
               st.write(f"**Date:** {created_at}")
               
-              try:
-                  top_predictions = json.loads(top_predictions_str)
+              if top_predictions:
                   st.write("**Top Predictions:**")
                   for i, (class_name, prob) in enumerate(top_predictions[:3], 1):
                       st.write(f"{i}. {class_name.title()}: {prob:.1%}")
-              except (json.JSONDecodeError, TypeError):
+              else:
                   st.write("**Top Predictions:** Not available")
           
           with col3:
@@ -180,5 +185,5 @@ with col3:
       st.switch_page("pages/login.py")
 
 # Show total count at bottom
-if filtered_predictions:
+if predictions_to_show:
   st.caption(f"Showing {len(predictions_to_show)} of {total_filtered} predictions")
\ No newline at end of file
@@ -1,8 +1,12 @@
-import base64
+import io
 import streamlit as st
 from datetime import datetime
-from utils.prediction_utils import GarbageClassifier
-from utils.db_utils import save_prediction
+from utils.prediction_utils import get_classifier, get_recycling_info
+from utils.batching import MicroBatcher
+from utils.prediction_cache import image_hash
+from utils.perceptual_hash import NearDuplicateIndex, compute_phash, hash_to_str
+from config import MODEL_STARTUP_BUDGET, PHASH_INDEX_MAX_USERS
+from utils.db_utils import save_prediction, get_prediction_hashes
 
 st.title("Upload Image for Classification")
 
@@ -35,12 +39,40 @@ if st.session_state.get('user'):
             st.session_state['user'] = None
             st.switch_page("pages/login.py")
 
-# Initialize classifier
+# Initialize classifier (models may still be loading in the background)
+classifier = get_classifier()
+
+# Shared scheduler that batches requests from concurrent sessions
 @st.cache_resource
-def load_classifier():
-    return GarbageClassifier()
+def load_batcher():
+    return MicroBatcher(classifier)
+
+batcher = load_batcher()
+
+# Perceptual-hash index of the user's recent predictions, shared by the user's sessions
+# (uploads are never answered with another user's prediction)
+@st.cache_resource(max_entries=PHASH_INDEX_MAX_USERS)
+def load_duplicate_index(user_email):
+    index = NearDuplicateIndex()
+    index.load(get_prediction_hashes(user_email))
+    return index
+
+duplicate_index = load_duplicate_index(st.session_state.get('user'))
+
+# Wait a limited time for the models, then work with whatever has loaded
+if not classifier.is_ready():
+    with st.spinner("Loading classification models..."):
+        classifier.wait_until_ready(timeout=MODEL_STARTUP_BUDGET)
 
-classifier = load_classifier()
+progress = classifier.get_loading_progress()
+if progress['loaded'] == 0 and not progress['ready']:
+    st.info("The classification models are still loading. Please try again in a moment.")
+    st.progress(0.0, text=f"0 of {progress['total']} models loaded")
+    if st.button("Refresh"):
+        st.rerun()
+    st.stop()
+elif not progress['ready']:
+    st.caption(f"Using {progress['loaded']} of {progress['total']} models while the rest finish loading.")
 
 # File upload
 uploaded_file = st.file_uploader(
@@ -55,20 +87,35 @@ if uploaded_file:
     with col2:
         st.image(uploaded_file, caption="Uploaded Image", width=400)
     
-    # Auto-analyze
+    image_bytes = uploaded_file.getvalue()
+    upload_id = getattr(uploaded_file, 'file_id', None) or image_hash(image_bytes)
+    
+    # Look for an earlier prediction of the same item photographed again
+    try:
+        phash = compute_phash(io.BytesIO(image_bytes))
+    except Exception as e:
+        print(f"Error computing image hash: {e}")
+        phash = None
+    # Only reuse results of the models that are serving now
+    model_version = getattr(classifier, 'model_version', None)
+    match = duplicate_index.find(phash, model_version) if phash is not None else None
+    
+    # Auto-analyze (repeated images are answered from the prediction cache)
     with st.spinner("Analyzing image..."):
-        prediction_result = classifier.predict_single(uploaded_file)
+        if match is not None:
+            prediction_result = match[1]
+        else:
+            prediction_result = batcher.predict(io.BytesIO(image_bytes))
         
         if prediction_result:
             predicted_class = prediction_result['predicted_class']
             confidence = prediction_result['confidence']
             top_predictions = prediction_result['top_predictions']
             
-            # Save to database
-            if st.session_state.get('authenticated') and st.session_state.get('user'):
+            # Save to database once per upload, not on every rerun of this page
+            already_saved = st.session_state.get('last_saved_upload') == upload_id
+            if st.session_state.get('authenticated') and st.session_state.get('user') and not already_saved:
                 try:
-                    image_bytes = uploaded_file.getvalue()
-                    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                     file_extension = uploaded_file.name.split('.')[-1] if '.' in uploaded_file.name else 'jpg'
                     image_filename = f"prediction_{timestamp}.{file_extension}"
@@ -79,13 +126,30 @@ if uploaded_file:
                         predicted_class,
                         confidence,
                         top_predictions,
-                        image_base64
+                        image_bytes,
+                        phash=hash_to_str(phash) if phash is not None else None,
+                        content_type=uploaded_file.type,
+                        user_name=st.session_state.get('user_name'),
+                        all_probabilities=prediction_result.get('all_probabilities'),
+                        individual_predictions=prediction_result.get('individual_predictions'),
+                        model_version=model_version
                     )
+                    st.session_state['last_saved_upload'] = upload_id
+                    
+                    # Make this prediction available for near-duplicate lookups
+                    if phash is not None and match is None:
+                        duplicate_index.add(phash, {
+                            'predicted_class': predicted_class,
+                            'confidence': float(confidence),
+                            'top_predictions': [(name, float(prob)) for name, prob in top_predictions],
+                            'all_probabilities': prediction_result.get('all_probabilities'),
+                            'model_version': model_version
+                        })
                 except Exception as e:
                     st.warning(f"Failed to save: {str(e)}")
             
             # Get recycling info
-            recycling_info = classifier.get_recycling_info(predicted_class)
+            recycling_info = get_recycling_info(predicted_class)
             
             # Display results
             st.markdown("---")
@@ -0,0 +1,15 @@
+import sys
+from utils.db_utils import db
+from utils.stats_rollups import reconcile_rollups
+
+def main():
+    # Recount the admin dashboard statistics from the users and predictions collections
+    totals = reconcile_rollups(db)
+    print(f"Users: {totals['users']} ({totals['verified_users']} verified, {totals['unverified_users']} unverified)")
+    print(f"Predictions: {totals['predictions']}")
+    for name, count in sorted(totals['classes'].items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name}: {count}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,38 @@
+import io
 import os
 import sys
 from utils.prediction_utils import GarbageClassifier
 
+def test_preprocessing():
+    # Check the preprocessing engine against the Keras load_img pipeline
+    print("\nTesting preprocessing...")
+    
+    try:
+        import numpy as np
+        from PIL import Image
+        from tensorflow.keras.preprocessing.image import img_to_array, load_img
+        from utils.prediction_utils import MEAN, STD, pytorch_normalize
+        from utils.preprocessing import ImagePreprocessor
+        
+        buffer = io.BytesIO()
+        pixels = np.random.randint(0, 256, (480, 640, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(buffer, format='PNG')
+        
+        buffer.seek(0)
+        expected = pytorch_normalize(img_to_array(load_img(buffer, target_size=(224, 224))))
+        
+        buffer.seek(0)
+        preprocessor = ImagePreprocessor(MEAN, STD, use_draft=False)
+        actual, valid_indices = preprocessor.preprocess_batch([buffer])
+        
+        max_diff = np.abs(actual[0] - expected).max()
+        print(f"Preprocessing matches load_img pipeline: max difference {max_diff:.2e} ({actual.dtype})")
+        return valid_indices == [0] and max_diff < 1e-5
+        
+    except Exception as e:
+        print(f"Error testing preprocessing: {e}")
+        return False
+
 def test_model_loading():
     # Test if all models can be loaded successfully
     print("Testing model loading...")
@@ -44,6 +75,989 @@ def test_prediction_utils():
         print(f"Error testing utilities: {e}")
         return False
 
+def test_inference_modes():
+    # Compare the compiled inference path against model.predict
+    print("\nTesting inference modes...")
+    
+    try:
+        import time
+        import numpy as np
+        
+        img_batch = np.random.rand(4, 224, 224, 3).astype(np.float32)
+        outputs = {}
+        
+        for mode in ['predict', 'compiled']:
+            classifier = GarbageClassifier(inference_mode=mode)
+            if not classifier.models:
+                # Nothing to compare; test_model_loading reports why
+                print("  SKIP: no models loaded")
+                return True
+            for name in classifier.models:
+                classifier.run_model(name, img_batch[:1])
+                start = time.perf_counter()
+                outputs[(mode, name)] = classifier.run_model(name, img_batch)
+                elapsed = (time.perf_counter() - start) * 1000
+                print(f"  {mode:<8} {name:<12} {elapsed:.1f} ms")
+        
+        for (mode, name), output in outputs.items():
+            if mode == 'compiled':
+                max_diff = np.abs(output - outputs[('predict', name)]).max()
+                print(f"  {name}: max difference {max_diff:.2e}")
+                if max_diff > 1e-4:
+                    return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"Error testing inference modes: {e}")
+        return False
+
+def test_backend_parity():
+    # Check that the ONNX Runtime backend matches TensorFlow on all_probabilities
+    print("\nTesting backend parity...")
+    
+    try:
+        import numpy as np
+        from PIL import Image
+        
+        # Two random images, saved so both classifiers preprocess them the same way
+        images = []
+        for i in range(2):
+            buffer = io.BytesIO()
+            pixels = np.random.randint(0, 256, (224, 224, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(buffer, format='PNG')
+            images.append(buffer.getvalue())
+        
+        reference = GarbageClassifier(backend='tensorflow')
+        onnx = GarbageClassifier(backend='onnx')
+        if len(onnx.models) != len(reference.models):
+            print("  SKIP: ONNX models missing, run convert_models.py --onnx first")
+            return True
+        
+        expected = reference.predict_batch([io.BytesIO(b) for b in images])
+        actual = onnx.predict_batch([io.BytesIO(b) for b in images])
+        
+        for tf_result, onnx_result in zip(expected, actual):
+            max_diff = np.abs(tf_result['all_probabilities'] - onnx_result['all_probabilities']).max()
+            print(f"  all_probabilities max difference {max_diff:.2e}")
+            if max_diff > 1e-4 or tf_result['predicted_class'] != onnx_result['predicted_class']:
+                return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"Error testing backend parity: {e}")
+        return False
+
+def test_cascade():
+    # Check that the cascade matches the full ensemble when nothing exits early
+    print("\nTesting cascade...")
+    
+    try:
+        import numpy as np
+        from PIL import Image
+        from utils.cascade import CascadePolicy
+        
+        images = []
+        for i in range(4):
+            buffer = io.BytesIO()
+            pixels = np.random.randint(0, 256, (224, 224, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(buffer, format='PNG')
+            images.append(buffer.getvalue())
+        
+        full = GarbageClassifier(cascade=False)
+        never_exit = GarbageClassifier(cascade=CascadePolicy(min_confidence=None, min_margin=None))
+        always_exit = GarbageClassifier(cascade=CascadePolicy(min_confidence=0.0))
+        
+        expected = full.predict_batch([io.BytesIO(b) for b in images])
+        escalated = never_exit.predict_batch([io.BytesIO(b) for b in images])
+        exited = always_exit.predict_batch([io.BytesIO(b) for b in images])
+        
+        for full_result, cascade_result in zip(expected, escalated):
+            max_diff = np.abs(full_result['all_probabilities'] - cascade_result['all_probabilities']).max()
+            print(f"  escalated max difference {max_diff:.2e}")
+            if max_diff > 1e-5:
+                return False
+        
+        # Early exits only run MobileNetV2
+        for full_result, exited_result in zip(expected, exited):
+            if set(exited_result['individual_predictions']) != {'mobilenetv2'}:
+                return False
+            max_diff = np.abs(full_result['individual_predictions']['mobilenetv2'] - exited_result['all_probabilities']).max()
+            if max_diff > 1e-5:
+                return False
+        
+        metrics = always_exit.get_cascade_metrics()
+        print(f"  early-exit rate {metrics['early_exit_rate']:.0%}")
+        return metrics['early_exit_rate'] == 1.0 and never_exit.get_cascade_metrics()['early_exits'] == 0
+        
+    except Exception as e:
+        print(f"Error testing cascade: {e}")
+        return False
+
+def test_bulk_classification():
+    # Run the bulk pipeline over a small directory and compare with predict_batch
+    print("\nTesting bulk classification...")
+    
+    try:
+        import json
+        import tempfile
+        import numpy as np
+        from PIL import Image
+        from utils.bulk import classify_source
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            image_dir = os.path.join(tmp_dir, 'images')
+            os.makedirs(image_dir)
+            paths = []
+            for i in range(5):
+                path = os.path.join(image_dir, f"image_{i}.png")
+                Image.fromarray(np.random.randint(0, 256, (300, 400, 3), dtype=np.uint8)).save(path)
+                paths.append(path)
+            
+            # A broken file should produce an error record instead of stopping the run
+            with open(os.path.join(image_dir, 'broken.jpg'), 'wb') as f:
+                f.write(b'not an image')
+            
+            classifier = GarbageClassifier(cascade=False)
+            output_path = os.path.join(tmp_dir, 'predictions.jsonl')
+            written, total = classify_source(classifier, image_dir, output_path, batch_size=2, decode_workers=2)
+            
+            with open(output_path) as f:
+                records = {record['image']: record for record in map(json.loads, f)}
+            
+            expected = classifier.predict_batch(paths)
+        
+        print(f"  {written} records written")
+        if written != 6 or total != 6 or records[os.path.join(image_dir, 'broken.jpg')]['error'] is None:
+            return False
+        
+        for path, result in zip(paths, expected):
+            if records[path]['predicted_class'] != result['predicted_class']:
+                return False
+            if abs(records[path]['confidence'] - result['confidence']) > 1e-5:
+                return False
+        
+        return True
+        
+    except Exception as e:
+        print(f"Error testing bulk classification: {e}")
+        return False
+
+def test_worker_pool():
+    # Check that the worker pool matches in-process inference and restarts dead workers
+    print("\nTesting worker pool...")
+    
+    try:
+        import time
+        import numpy as np
+        from PIL import Image
+        
+        images = []
+        for i in range(3):
+            buffer = io.BytesIO()
+            pixels = np.random.randint(0, 256, (224, 224, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(buffer, format='PNG')
+            images.append(buffer.getvalue())
+        
+        reference = GarbageClassifier(cascade=False)
+        pooled = GarbageClassifier(cascade=False, workers=2)
+        try:
+            expected = reference.predict_batch([io.BytesIO(b) for b in images])
+            actual = pooled.predict_batch([io.BytesIO(b) for b in images])
+            for ref_result, pool_result in zip(expected, actual):
+                max_diff = np.abs(ref_result['all_probabilities'] - pool_result['all_probabilities']).max()
+                print(f"  all_probabilities max difference {max_diff:.2e}")
+                if max_diff > 1e-5:
+                    return False
+            
+            # Kill a worker and wait for the monitor to bring it back
+            pool = pooled.backend
+            pool.workers[0].process.kill()
+            deadline = time.time() + 120
+            while time.time() < deadline:
+                metrics = pool.get_metrics()
+                if metrics['restarts'] == 1 and metrics['workers_ready'] == 2:
+                    break
+                time.sleep(1)
+            print(f"  pool after restart: {pool.get_metrics()}")
+            
+            return pool.get_metrics()['workers_ready'] == 2 and pooled.predict_single(io.BytesIO(images[0])) is not None
+        finally:
+            pooled.backend.close()
+        
+    except Exception as e:
+        print(f"Error testing worker pool: {e}")
+        return False
+
+def test_inference_server():
+    # Call the HTTP endpoints in-process and compare with predict_batch
+    print("\nTesting inference server...")
+    
+    try:
+        import asyncio
+        import numpy as np
+        from PIL import Image
+        try:
+            from aiohttp import FormData
+            from aiohttp.test_utils import TestClient, TestServer
+        except ImportError:
+            print("  SKIP: aiohttp is not installed")
+            return True
+        from inference_server import create_app
+        
+        images = []
+        for i in range(2):
+            buffer = io.BytesIO()
+            pixels = np.random.randint(0, 256, (224, 224, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(buffer, format='PNG')
+            images.append(buffer.getvalue())
+        
+        classifier = GarbageClassifier(cascade=False)
+        expected = classifier.predict_batch([io.BytesIO(b) for b in images])
+        
+        async def call_server():
+            async with TestClient(TestServer(create_app(classifier))) as client:
+                ready = await client.get('/ready')
+                single = await client.post('/predict', data=images[0], headers={'Content-Type': 'image/png'})
+                form = FormData()
+                for i, data in enumerate(images):
+                    form.add_field('images', data, filename=f"image_{i}.png", content_type='image/png')
+                batch = await client.post('/predict/batch', data=form)
+                broken = await client.post('/predict', data=b'not an image')
+                return ready.status, await single.json(), (await batch.json())['results'], broken.status
+        
+        ready_status, single, batch, broken_status = asyncio.run(call_server())
+        print(f"  /ready {ready_status}, broken image {broken_status}")
+        if ready_status != 200 or broken_status != 422:
+            return False
+        
+        for result, response in zip(expected, [single] + batch[1:]):
+            if response['predicted_class'] != result['predicted_class']:
+                return False
+            if abs(response['confidence'] - float(result['confidence'])) > 1e-5:
+                return False
+        
+        return batch[0]['predicted_class'] == expected[0]['predicted_class']
+        
+    except Exception as e:
+        print(f"Error testing inference server: {e}")
+        return False
+
+def test_prediction_cache():
+    # Check the in-memory LRU and TTL and the pruning of the disk tier
+    print("\nTesting prediction cache...")
+    
+    try:
+        import tempfile
+        import time
+        import numpy as np
+        from utils.prediction_cache import PredictionCache, DiskCacheTier
+        
+        def make_result(predicted_class):
+            probabilities = np.full(10, 0.1, dtype=np.float32)
+            return {
+                'predicted_class': predicted_class,
+                'confidence': 0.1,
+                'top_predictions': [(predicted_class, 0.1)],
+                'individual_predictions': {'mobilenetv2': probabilities},
+                'all_probabilities': probabilities
+            }
+        
+        # The least recently used entry is evicted first
+        cache = PredictionCache(max_entries=2, ttl=60)
+        cache.put('a', make_result('glass'))
+        cache.put('b', make_result('paper'))
+        cache.get('a')
+        cache.put('c', make_result('metal'))
+        lru_ok = cache.get('b') is None and cache.get('a') is not None and cache.get('c') is not None
+        
+        # Entries older than the TTL are gone
+        cache.entries['a'] = (time.time() - 120, cache.entries['a'][1])
+        ttl_ok = cache.get('a') is None and cache.get('c') is not None
+        print(f"  LRU eviction {'ok' if lru_ok else 'wrong'}, TTL expiry {'ok' if ttl_ok else 'wrong'}")
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tier = DiskCacheTier(tmp_dir, ttl=60, max_entries=3, prune_every=1000)
+            disk_cache = PredictionCache(max_entries=1, ttl=60, persistent=tier)
+            now = time.time()
+            for i in range(6):
+                disk_cache.put(f"key{i}", make_result('glass'))
+                # key0 is expired, the others are one second apart
+                age = 120 if i == 0 else 10 - i
+                os.utime(tier._path(f"key{i}"), (now - age, now - age))
+            
+            removed = tier.prune()
+            kept = sorted(name[:-5] for name in os.listdir(tmp_dir))
+            print(f"  disk tier pruned {removed} files, kept {kept}")
+            prune_ok = removed == 3 and kept == ['key3', 'key4', 'key5']
+            
+            # Results survive a restart through the disk tier
+            restored = PredictionCache(max_entries=1, ttl=60, persistent=DiskCacheTier(tmp_dir, ttl=60)).get('key5')
+            disk_ok = restored is not None and restored['all_probabilities'].dtype == np.float32
+        
+        return lru_ok and ttl_ok and prune_ok and disk_ok
+        
+    except Exception as e:
+        print(f"Error testing prediction cache: {e}")
+        return False
+
+def mock_database():
+    # Point db_utils at an in-memory mongomock database, or return None if mongomock is missing
+    try:
+        import mongomock
+        import mongomock.gridfs
+    except ImportError:
+        print("  SKIP: mongomock is not installed")
+        return None
+    
+    from utils import db_client
+    if not isinstance(db_client._client, mongomock.MongoClient):
+        mongomock.gridfs.enable_gridfs_integration()
+        db_client._client = mongomock.MongoClient()
+        db_client.MONGO_DB_NAME = 'garbage_classification_test'
+    
+    import utils.db_utils as db_utils
+    return db_utils
+
+def test_perceptual_hash():
+    # Compare BK-tree searches with a brute-force scan and check that lookups stay per user
+    print("\nTesting perceptual hash index...")
+    
+    try:
+        import random
+        from datetime import datetime, timedelta
+        from utils.perceptual_hash import BKTree, NearDuplicateIndex, hamming_distance, hash_to_str
+        
+        rng = random.Random(0)
+        values = [rng.getrandbits(64) for _ in range(500)]
+        tree = BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+        
+        for query in values[:20] + [rng.getrandbits(64) for _ in range(20)]:
+            for max_distance in (0, 4, 24):
+                expected = sorted(i for i, value in enumerate(values) if hamming_distance(query, value) <= max_distance)
+                found = sorted(item for _, item in tree.search(query, max_distance))
+                if found != expected:
+                    print(f"  BK-tree search within {max_distance} bits differs from brute force")
+                    return False
+        print(f"  BK-tree matches brute force over {tree.size} hashes")
+        
+        db_utils = mock_database()
+        if db_utils is None:
+            return True
+        
+        # Only the user's own, most recent hashed predictions are loaded
+        db_utils.db.predictions.delete_many({})
+        now = datetime.now()
+        db_utils.db.predictions.insert_many([
+            {"user_email": "a@example.com", "phash": hash_to_str(values[i]), "predicted_class": "glass",
+             "confidence": 0.9, "top": [[4, 0.9]], "created_at": now - timedelta(minutes=i)}
+            for i in range(5)
+        ] + [
+            {"user_email": "b@example.com", "phash": hash_to_str(values[10]), "predicted_class": "paper",
+             "confidence": 0.8, "top": [[6, 0.8]], "created_at": now}
+        ])
+        
+        hashes = db_utils.get_prediction_hashes("a@example.com", limit=3)
+        index = NearDuplicateIndex(max_distance=4, max_entries=3)
+        index.load(hashes)
+        match = index.find(values[0])
+        print(f"  loaded {len(index)} hashes for one user")
+        if not (
+            len(index) == 3
+            and match is not None and match[1]['top_predictions'] == [('glass', 0.9)]
+            and index.find(values[10]) is None
+            and index.find(values[4]) is None
+        ):
+            return False
+        
+        # New uploads evict the oldest entries, and only results of the serving models match
+        for i in range(20, 30):
+            index.add(values[i], {"predicted_class": "metal", "model_version": "v2"})
+        return (
+            len(index) == 3 and index.tree.size < 6
+            and index.find(values[0]) is None
+            and index.find(values[29], "v2") is not None
+            and index.find(values[29], "v1") is None and index.find(values[29]) is None
+            and index.find(values[26], "v2") is None
+        )
+        
+    except Exception as e:
+        print(f"Error testing perceptual hash index: {e}")
+        return False
+
+def test_image_store():
+    # Store images in a local directory and in GridFS, including over chunks of an interrupted upload
+    print("\nTesting image store...")
+    
+    try:
+        import tempfile
+        from bson import ObjectId
+        from datetime import datetime, timedelta
+        from utils.image_store import GridFSImageStore, LocalImageStore, content_id
+        
+        image = b'\x89PNG test image' * 100
+        
+        with tempfile.TemporaryDirectory() as directory:
+            store = LocalImageStore(directory)
+            ref = store.put(image, 'image/png')
+            again = store.put(image, 'image/png')
+            if ref != again or store.get(ref['id']) != image or store.get(content_id(b'other')) is not None:
+                print("  local store did not round-trip the image")
+                return False
+        print("  local store round-trips and deduplicates")
+        
+        db_utils = mock_database()
+        if db_utils is None:
+            return True
+        
+        class ChunkedBucket:
+            # Uploads like GridFS (chunks first, then the files document), as mongomock's
+            # GridFS support does not cover this version of pymongo
+            def __init__(self, db):
+                self.files, self.chunks = db['images.files'], db['images.chunks']
+                self.chunks.create_index([("files_id", 1), ("n", 1)], unique=True)
+            
+            def upload_from_stream_with_id(self, file_id, filename, data, metadata=None):
+                for n in range(0, len(data), 255):
+                    self.chunks.insert_one({"files_id": file_id, "n": n // 255, "data": data[n:n + 255]})
+                self.files.insert_one({"_id": file_id, "filename": filename, "length": len(data), "metadata": metadata})
+            
+            def open_download_stream(self, file_id):
+                from gridfs.errors import NoFile
+                if self.files.find_one({"_id": file_id}) is None:
+                    raise NoFile(file_id)
+                chunks = self.chunks.find({"files_id": file_id}).sort("n", 1)
+                return io.BytesIO(b''.join(chunk["data"] for chunk in chunks))
+        
+        db = db_utils.db
+        db.drop_collection('images.files')
+        db.drop_collection('images.chunks')
+        store = GridFSImageStore(db)
+        store.bucket = ChunkedBucket(db)
+        ref = store.put(image, 'image/png')
+        store.put(image, 'image/png')
+        if store.get(ref['id']) != image or db['images.files'].count_documents({}) != 1:
+            print("  GridFS store did not round-trip the image")
+            return False
+        
+        # A crashed upload leaves chunks but no files document
+        orphan = b'orphaned image'
+        orphan_id = content_id(orphan)
+        old_id = ObjectId.from_datetime(datetime.now() - timedelta(hours=1))
+        db['images.chunks'].insert_one({"_id": old_id, "files_id": orphan_id, "n": 0, "data": b'partial'})
+        store.write(orphan_id, orphan, 'image/png')
+        print(f"  GridFS stored {db['images.files'].count_documents({})} files")
+        return store.get(orphan_id) == orphan
+        
+    except Exception as e:
+        print(f"Error testing image store: {e}")
+        return False
+
+def test_history_pagination():
+    # Walk every history sort page by page and compare with sorting in Python
+    print("\nTesting history pagination...")
+    
+    try:
+        from datetime import datetime, timedelta
+        
+        db_utils = mock_database()
+        if db_utils is None:
+            return True
+        
+        db_utils.db.predictions.delete_many({})
+        now = datetime.now()
+        # Repeated dates and confidences make the _id tie-break matter
+        docs = [
+            {"user_email": "a@example.com", "image_filename": f"image_{i}.jpg",
+             "predicted_class": "glass" if i % 3 else "paper", "confidence": round(0.5 + (i % 4) * 0.1, 1),
+             "top": [[4, 0.9]], "created_at": now - timedelta(minutes=i // 2)}
+            for i in range(15)
+        ] + [
+            {"user_email": "b@example.com", "image_filename": "other.jpg", "predicted_class": "glass",
+             "confidence": 0.9, "top": [[4, 0.9]], "created_at": now}
+        ]
+        db_utils.db.predictions.insert_many(docs)
+        
+        for sort, (field, direction) in db_utils.HISTORY_SORTS.items():
+            for category in (None, "glass"):
+                expected = sorted(
+                    (doc for doc in docs if doc["user_email"] == "a@example.com"
+                     and category in (None, doc["predicted_class"])),
+                    key=lambda doc: (doc[field], doc["_id"]), reverse=direction < 0
+                )
+                
+                seen, cursor = [], None
+                while True:
+                    page, cursor = db_utils.get_user_predictions_page("a@example.com", category, sort, limit=4, after=cursor)
+                    seen.extend(pred[0] for pred in page)
+                    if cursor is None:
+                        break
+                
+                if seen != [str(doc["_id"]) for doc in expected]:
+                    print(f"  keyset pages for {sort} ({category or 'all classes'}) are out of order")
+                    return False
+                if len(seen) != db_utils.count_user_predictions("a@example.com", category):
+                    return False
+        
+        # skip jumps to the same page as following the cursors
+        second, _ = db_utils.get_user_predictions_page("a@example.com", limit=4, skip=4)
+        _, cursor = db_utils.get_user_predictions_page("a@example.com", limit=4)
+        after, _ = db_utils.get_user_predictions_page("a@example.com", limit=4, after=cursor)
+        print(f"  {len(db_utils.HISTORY_SORTS)} sorts paged consistently")
+        return [pred[0] for pred in second] == [pred[0] for pred in after]
+        
+    except Exception as e:
+        print(f"Error testing history pagination: {e}")
+        return False
+
+def test_index_report():
+    # Create the indexes, report what blocks them and read stages out of an explain plan
+    print("\nTesting index report...")
+    
+    try:
+        from utils.db_indexes import INDEXES, ensure_indexes, find_duplicate_emails, missing_indexes, plan_stages
+        
+        plan = {
+            "stage": "LIMIT",
+            "inputStage": {"stage": "FETCH", "inputStage": {"stage": "OR", "inputStages": [
+                {"stage": "IXSCAN", "indexName": "email_unique"},
+                {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}
+            ]}}
+        }
+        if plan_stages(plan) != ["LIMIT", "FETCH", "OR", "IXSCAN", "SORT", "COLLSCAN"]:
+            print(f"  unexpected plan stages: {plan_stages(plan)}")
+            return False
+        
+        db_utils = mock_database()
+        if db_utils is None:
+            return True
+        
+        db = db_utils.db
+        for collection in {collection for collection, _, _ in INDEXES}:
+            db.drop_collection(collection)
+        db.users.insert_many([{"email": "a@example.com"}, {"email": "a@example.com"}, {"email": "b@example.com"}])
+        
+        # Duplicate emails block only the unique index
+        results = ensure_indexes(db)
+        failed = [name for _, name, error in results if error]
+        if failed != ['email_unique'] or find_duplicate_emails(db) != [("a@example.com", 2)]:
+            print(f"  unexpected failures: {failed}")
+            return False
+        if [name for _, name, _ in missing_indexes(db)] != ['email_unique']:
+            return False
+        
+        db.users.delete_one({"email": "a@example.com"})
+        results = ensure_indexes(db) + ensure_indexes(db)
+        print(f"  {len(INDEXES)} indexes created, {len(missing_indexes(db))} missing")
+        return all(error is None for _, _, error in results) and not missing_indexes(db) and not find_duplicate_emails(db)
+        
+    except Exception as e:
+        print(f"Error testing index report: {e}")
+        return False
+
+def test_stats_rollups():
+    # Keep the counters in step with user and prediction changes and compare them with a full recount
+    print("\nTesting statistics rollups...")
+    
+    try:
+        from datetime import datetime, timedelta
+        from utils.stats_rollups import STATS_COLLECTION, TOTALS_ID, get_dashboard_stats, reconcile_rollups
+        
+        db_utils = mock_database()
+        if db_utils is None:
+            return True
+        
+        db = db_utils.db
+        for collection in ('users', 'predictions', STATS_COLLECTION):
+            db.drop_collection(collection)
+        
+        now = datetime.now()
+        yesterday = now - timedelta(days=1)
+        db.users.insert_many([
+            {"email": "a@example.com", "is_verified": 1, "created_at": yesterday},
+            {"email": "b@example.com", "is_verified": 0, "created_at": now}
+        ])
+        db.predictions.insert_many([
+            {"user_email": email, "predicted_class": predicted_class, "created_at": created_at}
+            for email, predicted_class, created_at in [
+                ("a@example.com", "glass", yesterday), ("a@example.com", "glass", now),
+                ("a@example.com", "paper", now), ("b@example.com", "glass", now)
+            ]
+        ])
+        reconcile_rollups(db)
+        
+        stats = get_dashboard_stats(db)
+        if (stats["total_users"], stats["verified_users"], stats["total_predictions"]) != (2, 1, 4):
+            print(f"  unexpected totals: {stats}")
+            return False
+        
+        def counters():
+            # Everything except the reconciliation time, with empty counts left out
+            docs = {}
+            for doc in db[STATS_COLLECTION].find():
+                doc.pop("reconciled_at", None)
+                doc["classes"] = {name: count for name, count in doc.get("classes", {}).items() if count}
+                if doc["_id"] == TOTALS_ID or any(doc.get(key) for key in ("predictions", "new_users")):
+                    docs[doc["_id"]] = {key: value for key, value in doc.items() if key != "date"}
+            return docs
+        
+        # Deleting a user decrements the counters to what a recount gives
+        db_utils.delete_user("a@example.com")
+        decremented = counters()
+        reconcile_rollups(db)
+        recounted = counters()
+        print(f"  {len(recounted)} rollup documents after deleting a user")
+        if decremented != recounted:
+            print(f"  counters {decremented} differ from the recount {recounted}")
+            return False
+        
+        stats = get_dashboard_stats(db)
+        return (stats["total_users"], stats["total_predictions"], stats["classes"]) == (1, 1, {"glass": 1})
+        
+    except Exception as e:
+        print(f"Error testing statistics rollups: {e}")
+        return False
+
+def test_user_prediction_stats():
+    # Check the per-user statistics of the admin user list against the raw predictions
+    print("\nTesting user prediction statistics...")
+    
+    try:
+        from datetime import datetime, timedelta
+        from types import SimpleNamespace
+        
+        db_utils = mock_database()
+        if db_utils is None:
+            return True
+        
+        def bind(value, variables):
+            # Replace $$name references with the values of the current document
+            if isinstance(value, dict):
+                return {key: bind(item, variables) for key, item in value.items()}
+            if isinstance(value, list):
+                return [bind(item, variables) for item in value]
+            return variables.get(value, value) if isinstance(value, str) else value
+        
+        def aggregate(db, collection, pipeline):
+            # mongomock cannot run a $lookup with let and pipeline, so run its pipeline per document
+            index = next(i for i, stage in enumerate(pipeline) if '$lookup' in stage)
+            lookup = pipeline[index]['$lookup']
+            docs = list(db[collection].aggregate(pipeline[:index]))
+            for doc in docs:
+                variables = {f"$${name}": doc.get(field[1:]) for name, field in lookup['let'].items()}
+                doc[lookup['as']] = list(db[lookup['from']].aggregate(bind(lookup['pipeline'], variables)))
+            return docs
+        
+        db = db_utils.db
+        db.drop_collection('users')
+        db.drop_collection('predictions')
+        now = datetime.now()
+        db.users.insert_many([
+            {"name": f"User {i}", "email": f"user{i}@example.com", "password": "x", "is_verified": i % 2,
+             "created_at": now - timedelta(days=i)}
+            for i in range(4)
+        ])
+        db.predictions.insert_many([
+            {"user_email": "user0@example.com", "predicted_class": "glass", "confidence": 0.9, "created_at": now},
+            {"user_email": "user0@example.com", "predicted_class": "glass", "confidence": 0.7,
+             "created_at": now - timedelta(hours=1)},
+            {"user_email": "user0@example.com", "predicted_class": "paper", "confidence": 0.5,
+             "created_at": now - timedelta(hours=2)},
+            {"user_email": "user1@example.com", "confidence": 0.4, "created_at": now - timedelta(days=3)}
+        ])
+        
+        real_db = db_utils.db
+        db_utils.db = SimpleNamespace(users=SimpleNamespace(aggregate=lambda pipeline: aggregate(real_db, 'users', pipeline)))
+        try:
+            first_page = db_utils.get_users_with_prediction_stats({}, limit=2)
+            second_page = db_utils.get_users_with_prediction_stats({}, skip=2, limit=2)
+            verified = db_utils.get_users_with_prediction_stats(db_utils.build_user_query(status="Verified"))
+        finally:
+            db_utils.db = real_db
+        
+        if [user["email"] for user in first_page + second_page] != [f"user{i}@example.com" for i in range(4)]:
+            print("  users are not paged newest first")
+            return False
+        if any("password" in user for user in first_page):
+            return False
+        
+        user0, user1 = first_page
+        print(f"  {user0['email']}: {user0['pred_count']} predictions, {user0['class_counts']}")
+        return (
+            user0["pred_count"] == 3
+            and list(user0["class_counts"].items()) == [("glass", 2), ("paper", 1)]
+            and abs(user0["avg_confidence"] - 0.7) < 1e-9
+            and user0["last_prediction"] == db.predictions.find_one({"confidence": 0.9})["created_at"]
+            and user1["class_counts"] == {"Unknown": 1}
+            and second_page[0]["pred_count"] == 0 and second_page[0]["last_prediction"] is None
+            and [user["email"] for user in verified] == ["user1@example.com", "user3@example.com"]
+        )
+        
+    except Exception as e:
+        print(f"Error testing user prediction statistics: {e}")
+        return False
+
+def test_write_behind():
+    # Retry transient write errors, spill what still fails or overflows and reject records that can never be written
+    print("\nTesting write-behind queue...")
+    
+    try:
+        import os
+        import tempfile
+        import threading
+        import time
+        from pymongo import ReplaceOne
+        from pymongo.errors import AutoReconnect, OperationFailure
+        from utils.write_behind import WriteBehindQueue
+        
+        db_utils = mock_database()
+        if db_utils is None:
+            return True
+        
+        collection = db_utils.db['write_behind_test']
+        collection.drop()
+        failures = {'transient': 0}
+        gate = threading.Event()
+        gate.set()
+        
+        def write_fn(batch):
+            gate.wait()
+            if failures['transient']:
+                failures['transient'] -= 1
+                raise AutoReconnect("connection lost")
+            if any(record.get('poison') for record in batch):
+                raise OperationFailure("document failed validation", code=121)
+            collection.bulk_write([ReplaceOne({"_id": record["_id"]}, record, upsert=True) for record in batch])
+        
+        with tempfile.TemporaryDirectory() as directory:
+            spill_file = os.path.join(directory, 'spill.jsonl')
+            writer = WriteBehindQueue(write_fn, max_batch_size=4, flush_interval_ms=10, max_retries=1,
+                                      max_queue_size=2, spill_file=spill_file, name='write-behind-test')
+            
+            # One transient error is retried
+            failures['transient'] = 1
+            writer.submit({"_id": 0})
+            writer.flush(timeout=10)
+            if collection.count_documents({}) != 1 or writer.get_metrics()['total_retries'] != 1:
+                print("  transient error was not retried")
+                return False
+            
+            # Errors beyond max_retries spill the batch, including a record that will always fail
+            failures['transient'] = 2
+            writer.submit({"_id": 1})
+            writer.submit({"_id": 2, "poison": True})
+            writer.flush(timeout=10)
+            if writer.get_metrics()['spilled_records'] != 2 or not os.path.exists(spill_file):
+                print("  failed batch was not spilled")
+                return False
+            
+            # A full queue spills instead of growing; later batches replay the spill file
+            gate.clear()
+            for i in range(3, 10):
+                writer.submit({"_id": i})
+            gate.set()
+            writer.submit({"_id": 10})
+            writer.flush(timeout=10)
+            writer.submit({"_id": 11})
+            writer.flush(timeout=10)
+            writer.close()
+            
+            metrics = writer.get_metrics()
+            print(f"  metrics: {metrics}")
+            with open(spill_file + '.rejected') as f:
+                rejected = f.read()
+            stored = sorted(doc["_id"] for doc in collection.find())
+            if not (
+                stored == [i for i in range(12) if i != 2]
+                and metrics['overflow_records'] > 0
+                and metrics['rejected_records'] == 1 and '"poison": true' in rejected
+                and metrics['dropped_records'] == 0
+                and not os.path.exists(spill_file)
+            ):
+                return False
+            
+            # Shutting down with a stuck worker and a full queue spills instead of hanging
+            stuck_file = os.path.join(directory, 'stuck', 'spill.jsonl')
+            gate.clear()
+            writer = WriteBehindQueue(write_fn, max_batch_size=1, flush_interval_ms=10, max_queue_size=2,
+                                      spill_file=stuck_file, name='write-behind-stuck')
+            for i in range(20, 25):
+                writer.submit({"_id": i})
+            flushed = writer.flush(timeout=0.2)
+            start = time.perf_counter()
+            writer.close(timeout=0.5)
+            elapsed = time.perf_counter() - start
+            with open(stuck_file) as f:
+                spilled = len(f.readlines())
+            gate.set()
+            print(f"  stuck shutdown took {elapsed:.2f}s, {spilled} records spilled")
+            # One record is held by the stuck write_fn call
+            return not flushed and elapsed < 2 and spilled == 4
+        
+    except Exception as e:
+        print(f"Error testing write-behind queue: {e}")
+        return False
+
+def test_result_codec():
+    # Round-trip results through MongoDB in the compact format and convert documents saved before it
+    print("\nTesting result codec...")
+    
+    try:
+        import json
+        import numpy as np
+        from utils.prediction_utils import CLASS_NAMES
+        from utils.result_codec import (
+            RESULT_FIELDS, decode_all_probabilities, decode_model_probabilities, decode_top_predictions, encode_result
+        )
+        
+        db_utils = mock_database()
+        if db_utils is None:
+            return True
+        
+        collection = db_utils.db.predictions
+        collection.drop()
+        
+        rng = np.random.default_rng(0)
+        probabilities = rng.dirichlet(np.ones(len(CLASS_NAMES))).astype(np.float32)
+        model_probabilities = {"resnet50": rng.dirichlet(np.ones(len(CLASS_NAMES))).astype(np.float32)}
+        order = np.argsort(probabilities)[::-1]
+        top = [(CLASS_NAMES[i], float(probabilities[i])) for i in order[:3]]
+        
+        full_id = collection.insert_one(encode_result(top[0][0], top[0][1], top, probabilities, model_probabilities)).inserted_id
+        top_only_id = collection.insert_one(encode_result(top[0][0], top[0][1], top)).inserted_id
+        full = collection.find_one({"_id": full_id})
+        top_only = collection.find_one({"_id": top_only_id}, RESULT_FIELDS)
+        
+        # float16 keeps about three significant digits
+        if not np.allclose(decode_all_probabilities(full), probabilities, atol=1e-3):
+            print("  probabilities did not survive the round trip")
+            return False
+        if not np.allclose(decode_model_probabilities(full)["resnet50"], model_probabilities["resnet50"], atol=1e-3):
+            return False
+        for doc in (full, top_only):
+            decoded = decode_top_predictions(doc)
+            if [name for name, _ in decoded] != [name for name, _ in top] or not np.allclose(
+                    [prob for _, prob in decoded], [prob for _, prob in top], atol=1e-3):
+                print(f"  top predictions differ: {decoded}")
+                return False
+        if decode_all_probabilities(top_only) is not None:
+            return False
+        
+        # Documents saved before result_version 2 keep a JSON string; migrate_results converts them
+        legacy = [
+            {"predicted_class": top[0][0], "confidence": top[0][1], "top_predictions": json.dumps(top)},
+            {"predicted_class": "not a class", "confidence": 0.5, "top_predictions": json.dumps([["not a class", 0.5]])},
+            {"predicted_class": top[0][0], "confidence": 0.5, "top_predictions": "not json"}
+        ]
+        legacy_ids = collection.insert_many(legacy).inserted_ids
+        if decode_top_predictions(collection.find_one({"_id": legacy_ids[0]})) != top:
+            print("  legacy top predictions were not decoded")
+            return False
+        
+        from migrate_results import migrate
+        migrated, failed = migrate(batch_size=2)
+        converted = collection.find_one({"_id": legacy_ids[0]})
+        print(f"  {migrated} legacy documents converted, {len(failed)} unreadable")
+        return (
+            migrated == 1 and failed == legacy_ids[1:]
+            and "top_predictions" not in converted
+            and converted["class_index"] == CLASS_NAMES.index(top[0][0])
+            and np.allclose([prob for _, prob in decode_top_predictions(converted)], [prob for _, prob in top])
+        )
+        
+    except Exception as e:
+        print(f"Error testing result codec: {e}")
+        return False
+
+def test_image_cleanup():
+    # Deleting predictions and users removes the stored images and thumbnails only they used
+    print("\nTesting stored image cleanup...")
+    
+    try:
+        import tempfile
+        import time
+        import numpy as np
+        from PIL import Image
+        from bson import ObjectId
+        from datetime import datetime
+        from utils.image_store import LocalImageStore, content_id
+        
+        db_utils = mock_database()
+        if db_utils is None:
+            return True
+        
+        import migrate_images
+        db = db_utils.db
+        db.drop_collection('predictions')
+        db.drop_collection('users')
+        
+        def save(email, image_bytes):
+            record = {
+                "prediction": {"_id": ObjectId(), "user_email": email, "image_filename": "image.jpg",
+                               "predicted_class": "glass", "confidence": 0.9, "created_at": datetime.now()},
+                "image": image_bytes,
+                "content_type": "image/jpeg"
+            }
+            db_utils.write_predictions([record])
+            return record["prediction"]["_id"]
+        
+        def jpeg(seed):
+            buffer = io.BytesIO()
+            pixels = np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(buffer, format='JPEG')
+            return buffer.getvalue()
+        
+        shared, private = jpeg(0), jpeg(1)
+        real_store = db_utils.image_store
+        with tempfile.TemporaryDirectory() as directory:
+            store = LocalImageStore(directory)
+            db_utils.image_store = migrate_images.image_store = store
+            try:
+                db.users.insert_many([{"email": "a@example.com", "is_verified": 1}, {"email": "b@example.com", "is_verified": 1}])
+                save("a@example.com", shared)
+                private_id = save("a@example.com", private)
+                shared_id = save("b@example.com", shared)
+                thumbnail = db_utils.store_thumbnail(private_id, private)
+                
+                def stored(image_bytes):
+                    return store.exists(content_id(image_bytes))
+                
+                if not (stored(shared) and stored(private) and stored(thumbnail)):
+                    print("  images were not stored")
+                    return False
+                
+                # The shared image stays while another user's prediction uses it
+                db_utils.delete_user("a@example.com")
+                if stored(private) or stored(thumbnail) or not stored(shared):
+                    print("  deleting a user did not remove exactly their own images")
+                    return False
+                
+                db_utils.delete_prediction(str(shared_id), "b@example.com")
+                if stored(shared):
+                    print("  deleting the last prediction left its image")
+                    return False
+                
+                # Images orphaned some other way are removed by the garbage collection, unless recent
+                orphan, recent, kept = jpeg(2), jpeg(3), jpeg(4)
+                for image_bytes in (orphan, recent):
+                    store.put(image_bytes)
+                save("b@example.com", kept)
+                old = time.time() - 48 * 3600
+                for image_bytes in (orphan, kept):
+                    path = store._path(content_id(image_bytes))
+                    os.utime(path, (old, old))
+                deleted = migrate_images.collect_garbage(min_age_hours=24)
+                return deleted == 1 and not stored(orphan) and stored(recent) and stored(kept)
+            finally:
+                db_utils.image_store = migrate_images.image_store = real_store
+        
+    except Exception as e:
+        print(f"Error testing stored image cleanup: {e}")
+        return False
+
 def main():
     # Main test function
     print("=== Garbage Classification Model Test ===\n")
@@ -51,14 +1065,87 @@ def main():
     # Test utilities
     utils_ok = test_prediction_utils()
     
+    # Test preprocessing engine
+    preprocessing_ok = test_preprocessing()
+    
     # Test model loading
     models_ok = test_model_loading()
     
+    # Test inference modes
+    modes_ok = test_inference_modes()
+    
+    # Test ONNX backend against TensorFlow
+    parity_ok = test_backend_parity()
+    
+    # Test the early-exit cascade
+    cascade_ok = test_cascade()
+    
+    # Test the bulk classification pipeline
+    bulk_ok = test_bulk_classification()
+    
+    # Test the multi-process worker pool
+    pool_ok = test_worker_pool()
+    
+    # Test the HTTP inference server
+    server_ok = test_inference_server()
+    
+    # Test the prediction cache
+    cache_ok = test_prediction_cache()
+    
+    # Test the near-duplicate index
+    phash_ok = test_perceptual_hash()
+    
+    # Test the image stores
+    image_store_ok = test_image_store()
+    
+    # Test keyset pagination of the history
+    pagination_ok = test_history_pagination()
+    
+    # Test index creation and reporting
+    indexes_ok = test_index_report()
+    
+    # Test the dashboard statistics rollups
+    rollups_ok = test_stats_rollups()
+    
+    # Test the admin user list statistics
+    user_stats_ok = test_user_prediction_stats()
+    
+    # Test the write-behind queue
+    write_behind_ok = test_write_behind()
+    
+    # Test the compact result format
+    codec_ok = test_result_codec()
+    
+    # Test deleting stored images with their predictions
+    cleanup_ok = test_image_cleanup()
+    
+    results = [
+        ("Utilities", utils_ok),
+        ("Preprocessing", preprocessing_ok),
+        ("Models", models_ok),
+        ("Inference modes", modes_ok),
+        ("Backend parity", parity_ok),
+        ("Cascade", cascade_ok),
+        ("Bulk classification", bulk_ok),
+        ("Worker pool", pool_ok),
+        ("Inference server", server_ok),
+        ("Prediction cache", cache_ok),
+        ("Perceptual hash index", phash_ok),
+        ("Image store", image_store_ok),
+        ("History pagination", pagination_ok),
+        ("Index report", indexes_ok),
+        ("Statistics rollups", rollups_ok),
+        ("User prediction statistics", user_stats_ok),
+        ("Write-behind queue", write_behind_ok),
+        ("Result codec", codec_ok),
+        ("Stored image cleanup", cleanup_ok)
+    ]
+    
     print("\n=== Test Results ===")
-    print(f"Utilities: {'PASS' if utils_ok else 'FAIL'}")
-    print(f"Models: {'PASS' if models_ok else 'FAIL'}")
+    for label, ok in results:
+        print(f"{label}: {'PASS' if ok else 'FAIL'}")
     
-    if utils_ok and models_ok:
+    if all(ok for _, ok in results):
         print("\nAll tests passed! The prediction system is ready to use.")
         return 0
     else:
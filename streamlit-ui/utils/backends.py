@@ -0,0 +1,338 @@
+import os
+import numpy as np
+
+# Input shape expected by all three models
+INPUT_SHAPE = (224, 224, 3)
+
+# Inference modes: 'compiled' calls a warmed tf.function, 'predict' uses model.predict
+INFERENCE_MODES = ('compiled', 'predict')
+
+# Saved Keras models, relative to the project root
+MODEL_PATHS = {
+    'resnet50': 'models/saved_models/best_resnet50.keras',
+    'custom_cnn': 'models/saved_models/best_custom_cnn.keras',
+    'mobilenetv2': 'models/saved_models/best_mobilenetv2.keras'
+}
+
+def find_model_file(path):
+    """Locate a model file relative to streamlit-ui or the project root"""
+    # Check if path exists relative to streamlit-ui directory
+    if os.path.exists(path):
+        return path
+
+    # Try relative to parent directory
+    parent_path = f"../{path}"
+    if os.path.exists(parent_path):
+        return parent_path
+
+    return None
+
+def configure_threading(inter_op_threads=0, intra_op_threads=0):
+    """Set TensorFlow's inter-op and intra-op thread pool sizes
+
+    This only takes effect before TensorFlow runs its first operation; 0
+    keeps TensorFlow's default for that pool.
+    """
+    import tensorflow as tf
+
+    try:
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    except RuntimeError as e:
+        print(f"Warning: Could not configure TensorFlow threads: {e}")
+
+def add_input_normalization(model, mean, std):
+    """Put the /255, mean and std normalization in front of a Keras model
+
+    The returned model takes raw uint8 pixels, so clients send 4x fewer
+    bytes and skip the host-side normalization.
+    """
+    import tensorflow as tf
+
+    mean = np.asarray(mean) * 255.0
+    std = np.asarray(std) * 255.0
+
+    inputs = tf.keras.Input(shape=INPUT_SHAPE, dtype='uint8', name='image')
+    normalized = tf.keras.layers.Normalization(mean=mean, variance=std ** 2, name='normalize')(inputs)
+    return tf.keras.Model(inputs, model(normalized, training=False), name=model.name)
+
+def compile_model(model, input_dtype='float32'):
+    """Wrap a Keras model in a tf.function with a fixed input signature
+
+    Calling the model directly skips the data adapter and per-call loop that
+    model.predict sets up, which dominates latency for small batches.
+    """
+    import tensorflow as tf
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=(None,) + INPUT_SHAPE, dtype=input_dtype)])
+    def infer(images):
+        return model(images, training=False)
+
+    # Trace the graph once so the first request does not pay for it
+    infer(tf.zeros((1,) + INPUT_SHAPE, dtype=input_dtype))
+    return infer
+
+def build_fused_model(models, input_dtype='float32'):
+    """Combine several models into one Keras graph with a shared input
+
+    The fused model outputs a dict with the averaged probabilities under
+    'ensemble' plus each backbone's probabilities under its own name, so one
+    call runs the whole ensemble and TensorFlow can schedule the backbones
+    in parallel.
+    """
+    import tensorflow as tf
+
+    inputs = tf.keras.Input(shape=INPUT_SHAPE, dtype=input_dtype, name='image')
+    outputs = {}
+
+    for name, model in models.items():
+        # Saved models can share the same default name, which is not allowed
+        # for nested models inside one graph
+        model._name = f"{name}_backbone"
+        outputs[name] = tf.keras.layers.Activation('linear', name=name)(model(inputs, training=False))
+
+    branches = list(outputs.values())
+    if len(branches) > 1:
+        ensemble = tf.keras.layers.Average(name='ensemble')(branches)
+    else:
+        ensemble = tf.keras.layers.Activation('linear', name='ensemble')(branches[0])
+
+    return tf.keras.Model(inputs, {'ensemble': ensemble, **outputs}, name='garbage_ensemble')
+
+class InferenceBackend:
+    """Base class for the runtimes that can run the ensemble models
+
+    A backend loads the models it can find into self.models and runs one
+    model at a time over a preprocessed batch of shape (batch, 224, 224, 3),
+    returning NumPy probabilities. Models are only added to self.models once
+    they are ready to run, so a backend can serve requests while the
+    remaining models are still loading.
+
+    The batch is normally normalized float32. When the classifier normalizes
+    in the graph it is raw uint8 pixels instead, and models that only accept
+    float input get it normalized through self.normalizer. Models that only
+    accept uint8 input are refused unless normalize_in_graph is set.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.models = {}
+        self.normalizer = None
+        self.normalize_in_graph = False
+
+    def prepare_input(self, img_batch, accepts_uint8):
+        """Normalize a uint8 batch on the host for models that need float input"""
+        if img_batch.dtype == np.uint8 and not accepts_uint8:
+            return self.normalizer(img_batch)
+        return img_batch
+
+    def check_input_dtype(self, name, accepts_uint8):
+        """Refuse a model that takes uint8 pixels when the batch holds normalized floats"""
+        if accepts_uint8 and not self.normalize_in_graph:
+            raise ValueError(
+                f"model {name} expects uint8 pixels but images are normalized on the host; "
+                "set NORMALIZE_IN_GRAPH=true or convert the model with float input"
+            )
+
+    def load_models(self, model_names):
+        """Load every model that is available for this backend"""
+        for name in model_names:
+            self.add_model(name)
+        self.finish_loading()
+
+    def add_model(self, name):
+        """Load one model and make it available, returning whether it loaded"""
+        try:
+            model = self.load_model(name)
+            if model is None:
+                return False
+            self.prepare_model(name, model)
+            self.models[name] = model
+            return True
+        except Exception as e:
+            print(f"Error loading model {name}: {e}")
+            return False
+
+    def load_model(self, name):
+        """Load one model, or return None if it is not available"""
+        raise NotImplementedError
+
+    def prepare_model(self, name, model):
+        """Get a freshly loaded model ready to run (e.g. compile or warm up)"""
+        pass
+
+    def finish_loading(self):
+        """Called once all models have been loaded"""
+        pass
+
+    def predict(self, name, img_batch):
+        """Return one model's probabilities for a batch"""
+        raise NotImplementedError
+
+    def predict_ensemble(self, img_batch):
+        """Run the whole ensemble in one call if the backend supports it
+
+        Returns (averaged probabilities, per-model probabilities), or None
+        when the caller should run and average the models itself.
+        """
+        return None
+
+class TensorFlowBackend(InferenceBackend):
+    """Run the saved Keras models with TensorFlow"""
+
+    name = 'tensorflow'
+
+    def __init__(self, inference_mode='compiled', fused=False, inter_op_threads=0, intra_op_threads=0,
+                 normalization=None):
+        """normalization is an optional (mean, std) pair to build into each model's graph"""
+        super().__init__()
+        if inference_mode not in INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode: {inference_mode}")
+
+        self.inter_op_threads = inter_op_threads
+        self.intra_op_threads = intra_op_threads
+        self.threads_configured = False
+        self.inference_mode = inference_mode
+        self.fused = fused
+        self.normalization = normalization
+        self.input_dtype = 'uint8' if normalization is not None else 'float32'
+        self.compiled_models = {}
+        self.fused_model = None
+        self.compiled_fused_model = None
+
+    def prepare_model(self, name, model):
+        # Build the compiled inference function for the model
+        if self.inference_mode == 'compiled':
+            try:
+                self.compiled_models[name] = compile_model(model, self.input_dtype)
+            except Exception as e:
+                print(f"Error compiling model {name}: {e}")
+
+    def finish_loading(self):
+        # Combine the loaded models into one graph
+        if self.fused and self.models:
+            try:
+                fused_model = build_fused_model(self.models, self.input_dtype)
+                if self.inference_mode == 'compiled':
+                    self.compiled_fused_model = compile_model(fused_model, self.input_dtype)
+                self.fused_model = fused_model
+            except Exception as e:
+                print(f"Error building fused model, using separate models: {e}")
+
+    def load_model(self, name):
+        from tensorflow.keras.models import load_model # pyright: ignore[reportMissingImports]
+
+        # Thread pools must be sized before TensorFlow runs anything
+        if not self.threads_configured:
+            configure_threading(self.inter_op_threads, self.intra_op_threads)
+            self.threads_configured = True
+
+        model_file = find_model_file(MODEL_PATHS[name])
+        if not model_file:
+            print(f"Warning: Could not load model {name} from {MODEL_PATHS[name]}")
+            return None
+
+        model = load_model(model_file)
+        if self.normalization is not None:
+            model = add_input_normalization(model, *self.normalization)
+        return model
+
+    def predict(self, name, img_batch):
+        if self.inference_mode == 'compiled' and name in self.compiled_models:
+            import tensorflow as tf
+            images = tf.convert_to_tensor(img_batch, dtype=self.input_dtype)
+            return self.compiled_models[name](images).numpy()
+
+        return self.models[name].predict(img_batch, batch_size=len(img_batch), verbose=0)
+
+    def predict_ensemble(self, img_batch):
+        if self.fused_model is None:
+            return None
+
+        if self.compiled_fused_model is not None:
+            import tensorflow as tf
+            images = tf.convert_to_tensor(img_batch, dtype=self.input_dtype)
+            outputs = {key: value.numpy() for key, value in self.compiled_fused_model(images).items()}
+        else:
+            outputs = self.fused_model.predict(img_batch, batch_size=len(img_batch), verbose=0)
+
+        ensemble_predictions = outputs.pop('ensemble')
+        return ensemble_predictions, outputs
+
+class TFLiteBackend(InferenceBackend):
+    """Run the quantized TFLite conversions (see convert_models.py)"""
+
+    name = 'tflite'
+
+    def __init__(self, quantization='int8', num_threads=None):
+        super().__init__()
+        self.quantization = quantization
+        self.num_threads = num_threads
+
+    def load_model(self, name):
+        from utils.tflite_utils import TFLiteModel, tflite_model_path
+
+        path = tflite_model_path(name, self.quantization)
+        model_file = find_model_file(path)
+        if not model_file:
+            print(f"Warning: Could not load model {name} from {path}, run convert_models.py first")
+            return None
+        return TFLiteModel(model_file, num_threads=self.num_threads)
+
+    def prepare_model(self, name, model):
+        self.check_input_dtype(name, model.input_dtype == np.uint8)
+
+    def predict(self, name, img_batch):
+        model = self.models[name]
+        return model.predict(self.prepare_input(img_batch, model.input_dtype == np.uint8))
+
+class ONNXBackend(InferenceBackend):
+    """Run the ONNX exports of the models with ONNX Runtime on CPU"""
+
+    name = 'onnx'
+
+    def __init__(self, num_threads=0):
+        super().__init__()
+        self.num_threads = num_threads
+
+    def load_model(self, name):
+        try:
+            import onnxruntime as ort # pyright: ignore[reportMissingImports]
+        except ImportError:
+            raise ImportError("INFERENCE_BACKEND=onnx requires onnxruntime (see requirements-optional.txt)") from None
+        from utils.onnx_utils import onnx_model_path
+
+        path = onnx_model_path(name)
+        model_file = find_model_file(path)
+        if not model_file:
+            print(f"Warning: Could not load model {name} from {path}, run convert_models.py --onnx first")
+            return None
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+
+        return ort.InferenceSession(model_file, sess_options=options, providers=['CPUExecutionProvider'])
+
+    def prepare_model(self, name, model):
+        self.check_input_dtype(name, model.get_inputs()[0].type == 'tensor(uint8)')
+
+    def predict(self, name, img_batch):
+        session = self.models[name]
+        model_input = session.get_inputs()[0]
+        if model_input.type == 'tensor(uint8)':
+            img_batch = np.asarray(img_batch, dtype=np.uint8)
+        else:
+            img_batch = np.asarray(self.prepare_input(img_batch, False), dtype=np.float32)
+        return session.run(None, {model_input.name: img_batch})[0]
+
+# Runtimes the ensemble can run on
+BACKENDS = {
+    'tensorflow': TensorFlowBackend,
+    'tflite': TFLiteBackend,
+    'onnx': ONNXBackend
+}
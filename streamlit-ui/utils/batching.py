@@ -0,0 +1,127 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+
+# Marker put on the queue to stop the worker thread
+_STOP = object()
+
+class MicroBatcher:
+    """Collect concurrent prediction requests into batched ensemble passes
+
+    Requests submitted from any thread are queued. A single worker thread
+    takes the first waiting request, keeps collecting more until the batch is
+    full or max_wait_ms has passed, then runs one predict_batch call and
+    hands each result back through its future.
+    """
+
+    def __init__(self, classifier, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.classifier = classifier
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+
+        # Metrics
+        self.lock = threading.Lock()
+        self.total_requests = 0
+        self.total_batches = 0
+        self.max_queue_depth = 0
+        self.total_wait_time = 0.0
+        self.total_batch_time = 0.0
+
+        self.worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self.worker.start()
+
+    def submit(self, image_file):
+        """Queue an image for prediction and return a Future for its result
+
+        Cache hits are answered right away, so this can block on the cache's
+        disk or MongoDB tier; async callers should run it in an executor.
+        """
+        future = Future()
+
+        # Answer repeated images straight from the cache without queueing
+        cached = self.classifier.get_cached_prediction(image_file)
+        if cached is not None:
+            future.set_result(cached)
+            return future
+
+        self.requests.put((image_file, future, time.perf_counter()))
+
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth, self.requests.qsize())
+
+        return future
+
+    def predict(self, image_file, timeout=None):
+        """Queue an image and wait for its result (same format as predict_single)"""
+        return self.submit(image_file).result(timeout=timeout)
+
+    def close(self):
+        """Stop the worker thread once the queued requests are done"""
+        self.requests.put(_STOP)
+        self.worker.join()
+
+    def get_metrics(self):
+        """Return queue depth and batching statistics"""
+        with self.lock:
+            return {
+                'queue_depth': self.requests.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'total_requests': self.total_requests,
+                'total_batches': self.total_batches,
+                'avg_batch_size': self.total_requests / self.total_batches if self.total_batches else 0.0,
+                'avg_wait_ms': self.total_wait_time / self.total_requests * 1000 if self.total_requests else 0.0,
+                'avg_batch_ms': self.total_batch_time / self.total_batches * 1000 if self.total_batches else 0.0
+            }
+
+    def _collect_batch(self):
+        """Block for the first request, then gather more until full or timed out"""
+        first = self.requests.get()
+        if first is _STOP:
+            return None
+
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Finish this batch first, then stop
+                self.requests.put(_STOP)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _run(self):
+        """Worker loop that runs one ensemble pass per collected batch"""
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            image_files = [image_file for image_file, _, _ in batch]
+            start = time.perf_counter()
+            try:
+                results = self.classifier.predict_batch(image_files)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for (_, future, queued_at), result in zip(batch, results):
+                future.set_result(result)
+
+            with self.lock:
+                self.total_batches += 1
+                self.total_requests += len(batch)
+                self.total_batch_time += finished - start
+                self.total_wait_time += sum(start - queued_at for _, _, queued_at in batch)
@@ -0,0 +1,424 @@
+import csv
+import functools
+import glob
+import io
+import json
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+from utils.evaluation import IMAGE_EXTENSIONS
+from utils.prediction_utils import CLASS_NAMES
+
+# Marker passed down the pipeline when a stage has no more items
+_STOP = object()
+
+# Columns of every output record
+OUTPUT_FIELDS = ['image', 'predicted_class', 'confidence', 'error'] + [f"prob_{name}" for name in CLASS_NAMES]
+
+OUTPUT_FORMATS = ('jsonl', 'csv', 'parquet')
+
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+def is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def read_tar_member(archive, member):
+    return archive.extractfile(member).read()
+
+def iter_directory(root):
+    """Yield (path, read) for every image under a directory, in sorted order"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Sorting in place makes os.walk visit subdirectories in a stable order
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if is_image_name(filename):
+                path = os.path.join(dirpath, filename)
+                yield path, functools.partial(read_file, path)
+
+def iter_glob(pattern):
+    """Yield (path, read) for every image file matching a glob pattern, in sorted order"""
+    # Resuming skips inputs by count, so the order has to be the same on every run
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        if is_image_name(path) and os.path.isfile(path):
+            yield path, functools.partial(read_file, path)
+
+def iter_tar(path):
+    """Yield (key, read) for every image in a tar archive, reading it as a stream"""
+    with tarfile.open(path, 'r|*') as archive:
+        for member in archive:
+            if member.isfile() and is_image_name(member.name):
+                # Streamed archives can only read the current member, so read is
+                # called before moving on or not at all
+                yield f"{path}::{member.name}", functools.partial(read_tar_member, archive, member)
+
+def iter_zip(path):
+    """Yield (key, read) for every image in a zip archive"""
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and is_image_name(info.filename):
+                yield f"{path}::{info.filename}", functools.partial(archive.read, info)
+
+def open_source(spec):
+    """Pick the image source for a directory, tar or zip archive, glob pattern or single file"""
+    if os.path.isdir(spec):
+        return iter_directory(spec)
+    if spec.lower().endswith(TAR_EXTENSIONS):
+        return iter_tar(spec)
+    if spec.lower().endswith('.zip'):
+        return iter_zip(spec)
+    if glob.has_magic(spec):
+        return iter_glob(spec)
+    if os.path.isfile(spec) and is_image_name(spec):
+        return iter([(spec, functools.partial(read_file, spec))])
+    raise ValueError(f"Not a directory, archive, glob pattern or image: {spec}")
+
+def format_from_path(path):
+    """Guess the output format from a file extension"""
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('parquet', 'pq'):
+        return 'parquet'
+    if extension == 'csv':
+        return 'csv'
+    return 'jsonl'
+
+class JSONLinesWriter:
+    """Append records to a JSON Lines file
+
+    commit() flushes to disk and returns the file offset, which a resumed
+    run truncates back to so records after the last checkpoint are not
+    written twice.
+    """
+
+    def __init__(self, path, state=None):
+        self.path = path
+        if state:
+            self.file = open(path, 'r+b')
+            self.file.truncate(state['offset'])
+            self.file.seek(state['offset'])
+        else:
+            self.file = open(path, 'wb')
+            self.write_header()
+
+    def write_header(self):
+        pass
+
+    def encode(self, record):
+        return (json.dumps(record) + '\n').encode('utf-8')
+
+    def write(self, record):
+        self.file.write(self.encode(record))
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {'offset': self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+class CSVWriter(JSONLinesWriter):
+    """Append records to a CSV file with one column per OUTPUT_FIELDS entry"""
+
+    def write_header(self):
+        self.file.write(self.encode(dict(zip(OUTPUT_FIELDS, OUTPUT_FIELDS))))
+
+    def encode(self, record):
+        line = io.StringIO()
+        csv.writer(line).writerow([record.get(field, '') for field in OUTPUT_FIELDS])
+        return line.getvalue().encode('utf-8')
+
+class ParquetWriter:
+    """Write records as numbered Parquet part files inside a directory
+
+    Parquet files cannot be appended to, so every commit() writes the rows
+    since the previous one as a new part. A resumed run deletes any parts
+    written after the last checkpoint. Requires pyarrow.
+    """
+
+    def __init__(self, path, state=None):
+        try:
+            import pyarrow # pyright: ignore[reportMissingImports]
+            import pyarrow.parquet # pyright: ignore[reportMissingImports]
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow (see requirements-optional.txt)") from None
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.parts = state['parts'] if state else 0
+        self.rows = []
+        # One schema for every part: columns that are all None in a part would
+        # otherwise get the null type, and the parts could not be read together
+        self.schema = pyarrow.schema(
+            [(field, pyarrow.string()) for field in ('image', 'predicted_class')]
+            + [('confidence', pyarrow.float64()), ('error', pyarrow.string())]
+            + [(f"prob_{name}", pyarrow.float64()) for name in CLASS_NAMES]
+        )
+        os.makedirs(path, exist_ok=True)
+
+        for filename in os.listdir(path):
+            if filename.startswith('part-') and filename.endswith('.parquet'):
+                if int(filename[5:10]) >= self.parts:
+                    os.remove(os.path.join(path, filename))
+
+    def write(self, record):
+        self.rows.append(record)
+
+    def commit(self):
+        if self.rows:
+            columns = {field: [row.get(field) for row in self.rows] for field in OUTPUT_FIELDS}
+            table = self.pa.table(columns, schema=self.schema)
+            self.pq.write_table(table, os.path.join(self.path, f"part-{self.parts:05d}.parquet"))
+            self.parts += 1
+            self.rows = []
+        return {'parts': self.parts}
+
+    def close(self):
+        pass
+
+WRITERS = {
+    'jsonl': JSONLinesWriter,
+    'csv': CSVWriter,
+    'parquet': ParquetWriter
+}
+
+def load_checkpoint(path):
+    """Return the saved checkpoint, or None if there is none"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_checkpoint(path, checkpoint):
+    # Write to a temporary file first so a crash never leaves a partial checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+class BulkPipeline:
+    """Stream images through decode workers, batched inference and a writer
+
+    A producer thread reads images from the source, decode_workers threads
+    decode and resize them, one inference thread groups them into batches
+    for the classifier, and the calling thread writes the results in source
+    order. Every queue is bounded and at most max_in_flight images are
+    between the producer and the writer at any time, so memory stays
+    constant however large the input is.
+    """
+
+    def __init__(self, classifier, batch_size=32, decode_workers=4, max_in_flight=None):
+        self.classifier = classifier
+        self.batch_size = max(1, batch_size)
+        self.decode_workers = max(1, decode_workers)
+        self.max_in_flight = max_in_flight or self.batch_size * 4
+        self.decode_queue = queue.Queue(maxsize=self.max_in_flight)
+        self.inference_queue = queue.Queue(maxsize=self.max_in_flight)
+        self.results = queue.Queue()
+        self.in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        self.stopping = threading.Event()
+        self.source_error = None
+
+    def _produce(self, source, start):
+        """Read images from the source, skipping the first start items"""
+        try:
+            for index, (key, read) in enumerate(source):
+                if index < start:
+                    continue
+                self.in_flight.acquire()
+                if self.stopping.is_set():
+                    break
+                try:
+                    data, error = read(), None
+                except Exception as e:
+                    data, error = None, f"Could not read image: {e}"
+                self.decode_queue.put((index, key, data, error))
+        except Exception as e:
+            self.source_error = e
+        finally:
+            for _ in range(self.decode_workers):
+                self.decode_queue.put(_STOP)
+
+    def _decode(self):
+        """Decode images into uint8 pixels at the model input size"""
+        preprocessor = self.classifier.preprocessor
+        while True:
+            item = self.decode_queue.get()
+            if item is _STOP:
+                self.inference_queue.put(_STOP)
+                return
+
+            index, key, data, error = item
+            pixels = None
+            if error is None:
+                try:
+                    pixels = preprocessor.decode(io.BytesIO(data))
+                except Exception as e:
+                    error = f"Could not decode image: {e}"
+            self.inference_queue.put((index, key, pixels, error))
+
+    def _infer(self):
+        """Group decoded images into batches and run the ensemble on them"""
+        running_decoders = self.decode_workers
+        while running_decoders:
+            batch = []
+            item = self.inference_queue.get()
+            while True:
+                if item is _STOP:
+                    running_decoders -= 1
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size or not running_decoders:
+                    break
+                try:
+                    item = self.inference_queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+        self.results.put(_STOP)
+
+    def _run_batch(self, batch):
+        decoded = [item for item in batch if item[2] is not None]
+        probabilities = {}
+        if decoded:
+            try:
+                img_batch = self.classifier.preprocessor.stack([pixels for _, _, pixels, _ in decoded])
+                ensemble_predictions, _ = self.classifier.predict_probabilities(img_batch)
+                probabilities = {index: ensemble_predictions[row] for row, (index, _, _, _) in enumerate(decoded)}
+            except Exception as e:
+                batch = [(index, key, None, f"Prediction failed: {e}") for index, key, _, _ in batch]
+
+        for index, key, _, error in batch:
+            record = {'image': key, 'predicted_class': None, 'confidence': None, 'error': error}
+            if index in probabilities:
+                probs = probabilities[index]
+                predicted_idx = int(probs.argmax())
+                record['predicted_class'] = CLASS_NAMES[predicted_idx]
+                record['confidence'] = float(probs[predicted_idx])
+                record.update({f"prob_{name}": float(prob) for name, prob in zip(CLASS_NAMES, probs)})
+            self.results.put((index, record))
+
+    def run(self, source, writer, start=0, on_checkpoint=None, checkpoint_every=1000, on_progress=None):
+        """Classify every image from source and write the records in source order
+
+        start skips images already written by an earlier run. After every
+        checkpoint_every records the writer is committed and
+        on_checkpoint(completed, writer_state) is called, where completed is
+        the number of source items fully written. Returns the number of
+        records written by this run.
+        """
+        threads = [threading.Thread(target=self._produce, args=(source, start), name='bulk-reader', daemon=True)]
+        threads += [
+            threading.Thread(target=self._decode, name=f"bulk-decode-{i}", daemon=True)
+            for i in range(self.decode_workers)
+        ]
+        threads.append(threading.Thread(target=self._infer, name='bulk-inference', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        # Records can finish out of order; hold them until the earlier ones arrive
+        pending = {}
+        next_index = start
+        written = 0
+        try:
+            while True:
+                item = self.results.get()
+                if item is _STOP:
+                    break
+                index, record = item
+                pending[index] = record
+                while next_index in pending:
+                    writer.write(pending.pop(next_index))
+                    next_index += 1
+                    written += 1
+                    self.in_flight.release()
+                    if written % checkpoint_every == 0:
+                        state = writer.commit()
+                        if on_checkpoint:
+                            on_checkpoint(next_index, state)
+                    if on_progress:
+                        on_progress(written)
+        finally:
+            # Let the reader finish if we stopped early
+            self.stopping.set()
+            try:
+                self.in_flight.release()
+            except ValueError:
+                pass
+
+        state = writer.commit()
+        if on_checkpoint:
+            on_checkpoint(next_index, state, done=self.source_error is None)
+
+        if self.source_error is not None:
+            raise self.source_error
+        return written
+
+def classify_source(classifier, input_spec, output_path, output_format=None, batch_size=32, decode_workers=4,
+                    checkpoint_path=None, checkpoint_every=1000, resume=False, on_progress=None):
+    """Classify all images from input_spec into output_path, resuming from the checkpoint if asked
+
+    Returns (records written by this run, total records in the output).
+    """
+    output_format = output_format or format_from_path(output_path)
+    if output_format not in WRITERS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    checkpoint_path = checkpoint_path or f"{output_path}.checkpoint.json"
+
+    checkpoint = load_checkpoint(checkpoint_path) if resume else None
+    if checkpoint is not None:
+        if checkpoint['input'] != input_spec or checkpoint['format'] != output_format:
+            raise ValueError(f"Checkpoint {checkpoint_path} belongs to a different input or output format")
+        if checkpoint.get('done'):
+            print(f"Checkpoint {checkpoint_path} says this input is already done")
+            return 0, checkpoint['completed']
+        print(f"Resuming after {checkpoint['completed']} images")
+
+    start = checkpoint['completed'] if checkpoint else 0
+    writer = WRITERS[output_format](output_path, checkpoint['writer'] if checkpoint else None)
+
+    def on_checkpoint(completed, state, done=False):
+        save_checkpoint(checkpoint_path, {
+            'input': input_spec,
+            'output': output_path,
+            'format': output_format,
+            'completed': completed,
+            'writer': state,
+            'done': done,
+            'updated_at': datetime.now().isoformat()
+        })
+
+    pipeline = BulkPipeline(classifier, batch_size=batch_size, decode_workers=decode_workers)
+    try:
+        written = pipeline.run(
+            open_source(input_spec), writer, start=start,
+            on_checkpoint=on_checkpoint, checkpoint_every=checkpoint_every, on_progress=on_progress
+        )
+    finally:
+        writer.close()
+
+    return written, start + written
+
+class ProgressPrinter:
+    """Print throughput every few seconds"""
+
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_print = self.started
+
+    def __call__(self, written):
+        now = time.perf_counter()
+        if now - self.last_print >= self.interval:
+            self.last_print = now
+            print(f"  {written} images, {written / (now - self.started):.1f} images/s")
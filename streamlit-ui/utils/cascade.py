@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+import numpy as np
+
+# Cheapest model first; the other models only run for images it is unsure about
+CASCADE_FIRST_MODEL = 'mobilenetv2'
+
+# Used until calibrate_cascade.py has written a thresholds file
+DEFAULT_MIN_CONFIDENCE = 0.9
+DEFAULT_MIN_MARGIN = None
+
+def top_two_margin(probs):
+    """Difference between the highest and second highest probability of each row"""
+    top_two = np.partition(probs, -2, axis=1)[:, -2:]
+    return top_two[:, 1] - top_two[:, 0]
+
+def exit_mask(probs, min_confidence=None, min_margin=None):
+    """Rows whose top-1 probability or top-2 margin reaches its threshold
+
+    A threshold of None disables that test, so with both None nothing exits.
+    """
+    exits = np.zeros(len(probs), dtype=bool)
+    if min_confidence is not None:
+        exits |= probs.max(axis=1) >= min_confidence
+    if min_margin is not None:
+        exits |= top_two_margin(probs) >= min_margin
+    return exits
+
+class CascadePolicy:
+    """Early-exit thresholds for the first cascade stage, plus exit counters"""
+
+    def __init__(self, first_model=CASCADE_FIRST_MODEL, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                 min_margin=DEFAULT_MIN_MARGIN):
+        self.first_model = first_model
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+
+        self.lock = threading.Lock()
+        self.total_images = 0
+        self.early_exits = 0
+
+    @classmethod
+    def load(cls, path):
+        """Read thresholds written by calibrate_cascade.py, falling back to the defaults"""
+        from utils.backends import find_model_file
+
+        thresholds_file = find_model_file(path)
+        if not thresholds_file:
+            print(f"Warning: No cascade thresholds at {path}, using defaults")
+            return cls()
+
+        with open(thresholds_file) as f:
+            data = json.load(f)
+        return cls(
+            first_model=data.get('first_model', CASCADE_FIRST_MODEL),
+            min_confidence=data.get('min_confidence'),
+            min_margin=data.get('min_margin')
+        )
+
+    def save(self, path, **extra):
+        """Write the thresholds (and any calibration details in extra) as JSON"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        data = {
+            'first_model': self.first_model,
+            'min_confidence': self.min_confidence,
+            'min_margin': self.min_margin,
+            **extra
+        }
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+    @property
+    def version(self):
+        """Short description of the thresholds, used in prediction cache keys"""
+        return f"cascade:{self.first_model}:{self.min_confidence}:{self.min_margin}"
+
+    def should_exit(self, probs):
+        """Return a boolean mask of the rows the first model is confident enough about"""
+        return exit_mask(probs, self.min_confidence, self.min_margin)
+
+    def record(self, total_images, early_exits):
+        """Count one cascade pass"""
+        with self.lock:
+            self.total_images += total_images
+            self.early_exits += early_exits
+
+    def get_metrics(self):
+        """Return how many images exited after the first model"""
+        with self.lock:
+            return {
+                'total_images': self.total_images,
+                'early_exits': self.early_exits,
+                'escalations': self.total_images - self.early_exits,
+                'early_exit_rate': self.early_exits / self.total_images if self.total_images else 0.0
+            }
+
+def calibrate_thresholds(first_probs, ensemble_probs, labels, target_accuracy, confidences=None, margins=None):
+    """Pick the thresholds that exit most often while keeping the target accuracy
+
+    first_probs are the first model's probabilities and ensemble_probs the
+    full ensemble average for the same labelled images. Every combination of
+    the candidate confidence and margin thresholds (each also tried as
+    None) is scored, and the one with the highest early-exit rate whose
+    cascade accuracy is at least target_accuracy wins. Returns a dict with
+    min_confidence, min_margin, accuracy and early_exit_rate; if no
+    combination reaches the target, both thresholds are None.
+    """
+    if confidences is None:
+        confidences = np.round(np.arange(0.50, 1.0, 0.01), 2)
+    if margins is None:
+        margins = np.round(np.arange(0.05, 1.0, 0.01), 2)
+
+    # Exit masks for each threshold on its own, combined per candidate pair below
+    confidence_exits = {None: np.zeros(len(labels), dtype=bool)}
+    for t in confidences:
+        confidence_exits[float(t)] = exit_mask(first_probs, min_confidence=t)
+    margin_exits = {None: np.zeros(len(labels), dtype=bool)}
+    for t in margins:
+        margin_exits[float(t)] = exit_mask(first_probs, min_margin=t)
+
+    first_correct = first_probs.argmax(axis=1) == labels
+    ensemble_correct = ensemble_probs.argmax(axis=1) == labels
+
+    best = None
+    for min_confidence, by_confidence in confidence_exits.items():
+        for min_margin, by_margin in margin_exits.items():
+            exits = by_confidence | by_margin
+            accuracy = float(np.where(exits, first_correct, ensemble_correct).mean())
+            if accuracy < target_accuracy:
+                continue
+            candidate = {
+                'min_confidence': min_confidence,
+                'min_margin': min_margin,
+                'accuracy': accuracy,
+                'early_exit_rate': float(exits.mean())
+            }
+            if best is None or (candidate['early_exit_rate'], accuracy) > (best['early_exit_rate'], best['accuracy']):
+                best = candidate
+
+    if best is None:
+        best = {
+            'min_confidence': None,
+            'min_margin': None,
+            'accuracy': float(ensemble_correct.mean()),
+            'early_exit_rate': 0.0
+        }
+    return best
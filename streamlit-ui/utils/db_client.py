@@ -0,0 +1,49 @@
+import threading
+from pymongo import MongoClient, ReadPreference
+from config import (
+    MONGO_URI, MONGO_DB_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS,
+    MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS
+)
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST
+}
+
+_client = None
+_lock = threading.Lock()
+
+def get_client():
+    """The process-wide MongoClient, created on first use
+
+    Every page and module shares its connection pool, so a process holds at
+    most MONGO_MAX_POOL_SIZE connections per server.
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            _client = MongoClient(
+                MONGO_URI,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS or None,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS or None,
+                appname='garbage-classification'
+            )
+        return _client
+
+def get_db(read_preference='primary'):
+    """The application database on the shared client
+
+    read_preference is a READ_PREFERENCES key; reads that can be slightly
+    stale (dashboards) can use 'secondaryPreferred' to move load off the
+    primary. Writes always go to the primary.
+    """
+    if read_preference not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference {read_preference!r}, expected one of {sorted(READ_PREFERENCES)}")
+    return get_client().get_database(MONGO_DB_NAME, read_preference=READ_PREFERENCES[read_preference])
@@ -0,0 +1,132 @@
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from config import PREDICTION_CACHE_BACKEND, PREDICTION_CACHE_TTL
+
+# Indexes the application's queries rely on: (collection, keys, options)
+INDEXES = [
+    # Login, registration and verification look users up by email
+    ('users', [("email", ASCENDING)], {'name': 'email_unique', 'unique': True}),
+    # Admin user list pages, newest registrations first
+    ('users', [("created_at", DESCENDING), ("_id", DESCENDING)], {'name': 'created_at'}),
+    # History pages: one user's predictions by date, with _id for keyset pagination
+    ('predictions', [("user_email", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+     {'name': 'user_email_created_at'}),
+    # History sorted by confidence
+    ('predictions', [("user_email", ASCENDING), ("confidence", DESCENDING), ("_id", DESCENDING)],
+     {'name': 'user_email_confidence'}),
+    # Admin dashboard date ranges
+    ('predictions', [("created_at", ASCENDING)], {'name': 'created_at'}),
+    # Admin category statistics over time
+    ('predictions', [("predicted_class", ASCENDING), ("created_at", DESCENDING)],
+     {'name': 'predicted_class_created_at'}),
+    # Near-duplicate index loading only reads predictions that have a perceptual hash
+    ('predictions', [("phash", ASCENDING)], {'name': 'phash', 'sparse': True}),
+    # Deleting predictions checks whether anything else still references their stored images
+    ('predictions', [("image_ref.id", ASCENDING)], {'name': 'image_ref_id', 'sparse': True}),
+    ('predictions', [("thumbnail_ref.id", ASCENDING)], {'name': 'thumbnail_ref_id', 'sparse': True}),
+]
+
+def cache_ttl_index(ttl):
+    """TTL index that expires persistent prediction cache entries (see MongoCacheTier)"""
+    return ('prediction_cache', [("created_at", ASCENDING)], {'expireAfterSeconds': int(ttl)})
+
+if PREDICTION_CACHE_BACKEND == 'mongo' and PREDICTION_CACHE_TTL:
+    INDEXES.append(cache_ttl_index(PREDICTION_CACHE_TTL))
+
+# Representative queries whose plans should use an index: (description, collection, filter, sort)
+CHECKED_QUERIES = [
+    ('login by email', 'users', {"email": "user@example.com", "password": "x"}, None),
+    ('history page', 'predictions', {"user_email": "user@example.com"}, [("created_at", -1), ("_id", -1)]),
+    ('history by category', 'predictions', {"user_email": "user@example.com", "predicted_class": "glass"},
+     [("created_at", -1), ("_id", -1)]),
+    ('recent predictions', 'predictions', {"created_at": {"$gte": datetime(2000, 1, 1)}}, None),
+]
+
+def ensure_indexes(db):
+    """Create every index in INDEXES that does not exist yet
+
+    Safe to run repeatedly: existing indexes with the same keys and options
+    are left alone. Returns (collection, index name, error or None) for
+    each index.
+    """
+    results = []
+    for collection, keys, options in INDEXES:
+        try:
+            name = create_index(db, collection, keys, options)
+            results.append((collection, name, None))
+        except OperationFailure as e:
+            # e.g. duplicate emails prevent the unique index
+            results.append((collection, options.get('name', str(keys)), str(e)))
+    return results
+
+def create_index(db, collection, keys, options):
+    """Create one index, updating the expiry of an existing TTL index when expireAfterSeconds changed"""
+    try:
+        return db[collection].create_index(keys, **options)
+    except OperationFailure as e:
+        # IndexOptionsConflict: same keys, different options
+        if 'expireAfterSeconds' not in options or e.code != 85:
+            raise
+        db.command('collMod', collection, index={
+            'keyPattern': dict(keys), 'expireAfterSeconds': options['expireAfterSeconds']
+        })
+        for name, info in db[collection].index_information().items():
+            if [tuple(key) for key in info['key']] == [tuple(key) for key in keys]:
+                return name
+        return options.get('name', str(keys))
+
+def find_duplicate_emails(db):
+    """Emails used by more than one user, which block the unique email index"""
+    pipeline = [
+        {"$group": {"_id": "$email", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    return [(doc['_id'], doc['count']) for doc in db.users.aggregate(pipeline)]
+
+def missing_indexes(db):
+    """Indexes from INDEXES whose key pattern does not exist in the database"""
+    missing = []
+    for collection, keys, options in INDEXES:
+        existing = [list(info['key']) for info in db[collection].index_information().values()]
+        if [tuple(key) for key in keys] not in [[tuple(key) for key in index] for index in existing]:
+            missing.append((collection, options.get('name'), keys))
+    return missing
+
+def index_usage(db, collection):
+    """Operations served by each index of a collection since the server started"""
+    stats = db[collection].aggregate([{"$indexStats": {}}])
+    return {doc['name']: (doc['accesses']['ops'], doc['accesses']['since']) for doc in stats}
+
+def unused_indexes(db):
+    """Indexes (other than _id) that no query has used since the server started"""
+    unused = []
+    for collection in sorted({collection for collection, _, _ in INDEXES}):
+        for name, (ops, since) in index_usage(db, collection).items():
+            if name != '_id_' and ops == 0:
+                unused.append((collection, name, since))
+    return unused
+
+def plan_stages(plan):
+    """All stage names in an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for key in ('inputStage', 'queryPlan'):
+            stages.extend(plan_stages(plan.get(key)))
+        for child in plan.get('inputStages', []):
+            stages.extend(plan_stages(child))
+    return stages
+
+def check_query_plans(db):
+    """Explain CHECKED_QUERIES and flag the ones that scan the collection or sort in memory"""
+    results = []
+    for description, collection, query, sort in CHECKED_QUERIES:
+        cursor = db[collection].find(query).limit(10)
+        if sort:
+            cursor = cursor.sort(sort)
+        stages = plan_stages(cursor.explain()['queryPlanner']['winningPlan'])
+        problems = [stage for stage in stages if stage in ('COLLSCAN', 'SORT')]
+        results.append((description, stages, problems))
+    return results
@@ -1,20 +1,59 @@
+import base64
 import random
 import string
-import json
+import threading
 from datetime import datetime
-from pymongo import MongoClient
 from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
 from utils.auth_utils import send_verification_email
-from config import ADMIN_EMAIL, ADMIN_PASSWORD, MONGO_URI, MONGO_DB_NAME
+from utils.db_client import get_db
+from utils.image_store import create_image_store
+from utils.db_indexes import ensure_indexes
+from utils.stats_rollups import (
+    record_user_created, record_user_verified, record_user_deleted, record_prediction, prediction_counts,
+    get_dashboard_stats, start_reconciler
+)
+from utils.thumbnails import make_thumbnail, run_in_background
+from utils.write_behind import WriteBehindQueue
+from utils.result_codec import RESULT_FIELDS, encode_result, decode_top_predictions, decode_all_probabilities
+from config import (
+    ADMIN_EMAIL, ADMIN_PASSWORD, DB_ENSURE_INDEXES, STATS_RECONCILE_INTERVAL, MONGO_DASHBOARD_READ_PREFERENCE,
+    PREDICTION_WRITE_BEHIND, PHASH_INDEX_MAX_ENTRIES
+)
 
-# MongoDB connection
-client = MongoClient(MONGO_URI)
-db = client[MONGO_DB_NAME]
+# MongoDB connection (one pooled client per process)
+db = get_db()
+# Dashboard statistics can be read from secondaries (MONGO_DASHBOARD_READ_PREFERENCE)
+dashboard_db = get_db(MONGO_DASHBOARD_READ_PREFERENCE)
 
 # Collections
 users_collection = db['users']
 predictions_collection = db['predictions']
 
+# Uploaded images live outside the prediction documents
+image_store = create_image_store(db)
+
+# Write-behind queue for save_prediction (see get_prediction_writer)
+_prediction_writer = None
+_prediction_writer_lock = threading.Lock()
+
+# Predictions whose missing thumbnail is being made in the background (see get_prediction_thumbnail)
+_thumbnails_queued = set()
+_thumbnails_queued_lock = threading.Lock()
+
+# Thread that recounts the dashboard statistics (see start_stats_reconciler)
+_reconciler = None
+_reconciler_lock = threading.Lock()
+
+# Create any missing indexes once per process
+if DB_ENSURE_INDEXES:
+    try:
+        for collection, name, error in ensure_indexes(db):
+            if error:
+                print(f"Warning: Could not create index {collection}.{name}: {error}")
+    except Exception as e:
+        print(f"Warning: Could not ensure indexes: {e}")
+
 def generate_code(length=6):
     # Generate a verification code
     return ''.join(random.choices(string.digits, k=length))
@@ -41,6 +80,7 @@ def register_user(name, email, password, code):
             "created_at": datetime.now()
         }
         users_collection.insert_one(user)
+        record_user_created(db, user["created_at"])
         return True
     except Exception as e:
         print("Registration error:", e)
@@ -66,11 +106,14 @@ def update_verification_code(email, code):
             "code": code,
             "is_verified": 0
         })
+        record_user_created(db)
     else:
         users_collection.update_one(
             {"email": email},
             {"$set": {"code": code, "is_verified": 0}}
         )
+        if user.get("is_verified") == 1:
+            record_user_verified(db, verified=False)
 
 def verify_user(email, input_code):
     # Verify user's email with input code
@@ -83,10 +126,12 @@ def verify_user(email, input_code):
     print("Query result:", user)
 
     if user and user.get("code") == input_code:
-        users_collection.update_one(
+        result = users_collection.update_one(
             {"email": email},
             {"$set": {"is_verified": 1}}
         )
+        if result.modified_count:
+            record_user_verified(db)
         return True
     return False
 
@@ -111,60 +156,328 @@ def login_user(email, password):
             return {"role": "unverified"}
     return {"role": "invalid"}
 
-def save_prediction(user_email, image_filename, predicted_class, confidence, top_predictions, image_data):
-    """Save prediction with image data to MongoDB"""
+def save_prediction(user_email, image_filename, predicted_class, confidence, top_predictions, image_bytes,
+                    phash=None, content_type=None, user_name=None, all_probabilities=None,
+                    individual_predictions=None, model_version=None):
+    """Save prediction to MongoDB, storing the raw image bytes in the image store
+
+    The prediction document only keeps a reference to the image (and the
+    optional perceptual hash, with the model_version that made the result). The result is stored in the compact form of
+    result_codec.encode_result, including the full ensemble and per-model
+    probabilities when they are given. With PREDICTION_WRITE_BEHIND the prediction
+    is queued and written in the background, so this returns before it is
+    stored.
+    """
     try:
-        # Get user information
-        user = db.users.find_one({"email": user_email})
-        user_name = user.get('name') if user else None
-
-        # Create prediction document
-        prediction = {
-            "user_email": user_email,
-            "user_name": user_name,
-            "image_filename": image_filename,
-            "image_data": image_data,
-            "predicted_class": predicted_class,
-            "confidence": confidence,
-            "top_predictions": json.dumps(top_predictions),
-            "created_at": datetime.now()
+        record = {
+            "prediction": {
+                # Assigned here so that retried writes do not store it twice
+                "_id": ObjectId(),
+                "user_email": user_email,
+                "user_name": user_name,
+                "image_filename": image_filename,
+                **encode_result(predicted_class, confidence, top_predictions, all_probabilities, individual_predictions),
+                "created_at": datetime.now()
+            },
+            "image": image_bytes,
+            "content_type": content_type
         }
+        if phash is not None:
+            record["prediction"]["phash"] = phash
+            record["prediction"]["model_version"] = model_version
         
-        # Insert into predictions collection
-        result = db.predictions.insert_one(prediction)
-        return result.inserted_id is not None
+        if PREDICTION_WRITE_BEHIND:
+            get_prediction_writer().submit(record)
+        else:
+            write_predictions([record])
+        return True
         
     except Exception as e:
         print(f"Error saving prediction: {str(e)}")
         return False
 
-def get_user_predictions(user_email):
-    """Get predictions for a specific user from MongoDB"""
+def write_predictions(records):
+    """Store a batch of predictions queued by save_prediction with one insert_many
+
+    Safe to repeat: images are content-addressed and predictions keep their
+    _id, so ones that were already stored are skipped.
+    """
+    documents = []
+    for record in records:
+        # Identical images are only stored once
+        prediction = dict(record["prediction"])
+        prediction["image_ref"] = image_store.put(record["image"], record.get("content_type"))
+        documents.append(prediction)
+    
+    already_stored = set()
+    try:
+        predictions_collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in errors):
+            raise
+        already_stored = {error["index"] for error in errors}
+    
+    for index, (record, prediction) in enumerate(zip(records, documents)):
+        if index in already_stored:
+            continue
+        record_prediction(db, prediction["predicted_class"], prediction["created_at"])
+        # The thumbnail is added to the document once it has been made
+        run_in_background(store_thumbnail, prediction["_id"], record["image"])
+
+def get_prediction_writer():
+    """The background queue that writes saved predictions, started on first use"""
+    global _prediction_writer
+    with _prediction_writer_lock:
+        if _prediction_writer is None:
+            _prediction_writer = WriteBehindQueue(write_predictions, name='prediction-writer')
+        return _prediction_writer
+
+def store_thumbnail(prediction_id, image_bytes):
+    """Make a prediction's thumbnail, store it and reference it from the prediction"""
+    thumbnail_bytes, content_type = make_thumbnail(image_bytes)
+    thumbnail_ref = image_store.put(thumbnail_bytes, content_type)
+    db.predictions.update_one({"_id": prediction_id}, {"$set": {"thumbnail_ref": thumbnail_ref}})
+    return thumbnail_bytes
+
+def start_stats_reconciler():
+    """Periodically recount the dashboard statistics to correct any drift in the counters
+
+    Started by the Streamlit app (once per process) rather than on import,
+    so command-line tools do not run it.
+    """
+    global _reconciler
+    with _reconciler_lock:
+        if _reconciler is None and STATS_RECONCILE_INTERVAL > 0:
+            _reconciler = start_reconciler(db, STATS_RECONCILE_INTERVAL)
+        return _reconciler
+
+def image_refs(prediction):
+    # Stored images a prediction document references
+    return [ref for ref in (prediction.get('image_ref'), prediction.get('thumbnail_ref')) if ref]
+
+def is_image_referenced(image_id):
+    """Whether any prediction still uses a stored image as its image or thumbnail"""
+    query = {"$or": [{"image_ref.id": image_id}, {"thumbnail_ref.id": image_id}]}
+    return db.predictions.find_one(query, {"_id": 1}) is not None
+
+def release_images(refs):
+    """Delete the stored images of deleted predictions that no other prediction references
+
+    Identical uploads share one stored image, so an image is only removed
+    once its last prediction is gone. Images in another store than the
+    configured one are left alone; migrate_images.py --gc removes any that
+    are missed here.
+    """
+    for image_id in {ref['id'] for ref in refs if ref.get('store') == image_store.name}:
+        try:
+            if not is_image_referenced(image_id):
+                image_store.delete(image_id)
+        except Exception as e:
+            print(f"Warning: Could not delete stored image {image_id}: {e}")
+
+def get_prediction_hashes(user_email, limit=PHASH_INDEX_MAX_ENTRIES):
+    """Get the perceptual hash and result of a user's most recent hashed predictions"""
     try:
-        predictions = list(db.predictions.find(
-            {"user_email": user_email}
-        ).sort("created_at", -1))
+        predictions = db.predictions.find(
+            {"user_email": user_email, "phash": {"$exists": True}},
+            ["phash", "model_version", *RESULT_FIELDS]
+        ).sort("created_at", -1).limit(limit)
         
-        # Convert MongoDB documents to the expected format
-        formatted_predictions = []
+        hashes = []
         for pred in predictions:
-            formatted_predictions.append([
-                str(pred['_id']),          # prediction ID (0)
-                pred['image_filename'],     # image filename (1)
-                pred['predicted_class'],    # predicted class (2)
-                pred['confidence'],         # confidence (3)
-                pred['top_predictions'],    # top predictions (4)
-                pred['created_at'],         # creation date (5)
-                pred.get('user_name', ''),  # user name (6)
-                pred.get('image_data', '')  # image data (7)
-            ])
+            entry = {
+                "phash": pred['phash'],
+                "model_version": pred.get('model_version'),
+                "predicted_class": pred['predicted_class'],
+                "confidence": pred['confidence'],
+                "top_predictions": decode_top_predictions(pred)
+            }
+            probabilities = decode_all_probabilities(pred)
+            if probabilities is not None:
+                entry["all_probabilities"] = probabilities
+            hashes.append(entry)
         
-        return formatted_predictions
+        return hashes
+        
+    except Exception as e:
+        print(f"Error getting prediction hashes: {e}")
+        return []
+
+# Fields shown in the prediction history (never the image itself)
+HISTORY_PROJECTION = {
+    "image_filename": 1,
+    "predicted_class": 1,
+    "confidence": 1,
+    "class_index": 1,
+    "probabilities": 1,
+    "top": 1,
+    "top_predictions": 1,
+    "created_at": 1,
+    "user_name": 1,
+    "image_ref": 1,
+    "thumbnail_ref": 1
+}
+
+# History sort orders: field and direction, with _id breaking ties
+HISTORY_SORTS = {
+    'date_desc': ("created_at", -1),
+    'date_asc': ("created_at", 1),
+    'confidence_desc': ("confidence", -1),
+    'confidence_asc': ("confidence", 1)
+}
+
+def format_prediction(pred):
+    # Convert a MongoDB document to the list format used by the pages
+    return [
+        str(pred['_id']),          # prediction ID (0)
+        pred['image_filename'],     # image filename (1)
+        pred['predicted_class'],    # predicted class (2)
+        pred['confidence'],         # confidence (3)
+        decode_top_predictions(pred),  # top predictions (4)
+        pred['created_at'],         # creation date (5)
+        pred.get('user_name', ''),  # user name (6)
+        pred.get('image_ref'),      # image reference (7)
+        pred.get('thumbnail_ref')   # thumbnail reference (8)
+    ]
+
+def get_user_predictions(user_email):
+    """Get predictions for a specific user from MongoDB"""
+    try:
+        predictions = db.predictions.find(
+            {"user_email": user_email},
+            HISTORY_PROJECTION
+        ).sort("created_at", -1)
+        
+        return [format_prediction(pred) for pred in predictions]
         
     except Exception as e:
         print(f"Error getting predictions: {e}")
         return []
 
+def history_query(user_email, category=None):
+    # Filter for a user's predictions, optionally of one class
+    query = {"user_email": user_email}
+    if category:
+        query["predicted_class"] = category
+    return query
+
+def get_user_predictions_page(user_email, category=None, sort='date_desc', limit=6, after=None, skip=0):
+    """Get one page of a user's predictions, filtered, sorted and limited by MongoDB
+
+    sort is a HISTORY_SORTS key. For keyset pagination pass the cursor
+    returned with the previous page as after; skip jumps over whole pages
+    instead. Returns (predictions, cursor of the next page or None).
+    """
+    try:
+        field, direction = HISTORY_SORTS[sort]
+        query = history_query(user_email, category)
+        
+        # Continue right after the last prediction of the previous page
+        if after is not None:
+            value, last_id = after
+            operator = "$lt" if direction < 0 else "$gt"
+            query["$or"] = [
+                {field: {operator: value}},
+                {field: value, "_id": {operator: ObjectId(last_id)}}
+            ]
+        
+        predictions = list(
+            db.predictions.find(query, HISTORY_PROJECTION)
+            .sort([(field, direction), ("_id", direction)])
+            .skip(skip)
+            .limit(limit + 1)
+        )
+        
+        # One extra document tells whether there is a next page
+        next_cursor = None
+        if len(predictions) > limit:
+            predictions = predictions[:limit]
+            next_cursor = (predictions[-1][field], str(predictions[-1]['_id']))
+        
+        return [format_prediction(pred) for pred in predictions], next_cursor
+        
+    except Exception as e:
+        print(f"Error getting prediction page: {e}")
+        return [], None
+
+def count_user_predictions(user_email, category=None):
+    """Count a user's predictions, optionally of one class"""
+    try:
+        return db.predictions.count_documents(history_query(user_email, category))
+    except Exception as e:
+        print(f"Error counting predictions: {e}")
+        return 0
+
+def get_user_prediction_classes(user_email):
+    """Get the classes that appear in a user's predictions"""
+    try:
+        return sorted(db.predictions.distinct("predicted_class", {"user_email": user_email}))
+    except Exception as e:
+        print(f"Error getting prediction classes: {e}")
+        return []
+
+def get_prediction_image(prediction_id, user_email):
+    """Get the original image bytes of one of the user's predictions, or None"""
+    try:
+        pred = db.predictions.find_one(
+            {"_id": ObjectId(prediction_id), "user_email": user_email},
+            {"image_ref": 1, "image_data": 1}
+        )
+        if not pred:
+            return None
+        
+        if pred.get('image_ref'):
+            return image_store.get(pred['image_ref']['id'])
+        
+        # Documents saved before the image store embedded the image as base64
+        if pred.get('image_data'):
+            return base64.b64decode(pred['image_data'])
+        
+        return None
+        
+    except Exception as e:
+        print(f"Error getting prediction image: {e}")
+        return None
+
+def queue_thumbnail(prediction_id, image_bytes):
+    """Make a missing thumbnail on the background threads, once per prediction at a time"""
+    with _thumbnails_queued_lock:
+        if prediction_id in _thumbnails_queued:
+            return
+        _thumbnails_queued.add(prediction_id)
+    
+    def job():
+        try:
+            store_thumbnail(prediction_id, image_bytes)
+        finally:
+            with _thumbnails_queued_lock:
+                _thumbnails_queued.discard(prediction_id)
+    
+    run_in_background(job)
+
+def get_prediction_thumbnail(prediction_id, user_email, thumbnail_ref=None):
+    """Get the thumbnail of one of the user's predictions
+
+    Predictions without one (older ones, or ones whose thumbnail is still
+    being made) get the full image this time while the thumbnail is made in
+    the background.
+    """
+    try:
+        if thumbnail_ref:
+            thumbnail_bytes = image_store.get(thumbnail_ref['id'])
+            if thumbnail_bytes:
+                return thumbnail_bytes
+        
+        image_bytes = get_prediction_image(prediction_id, user_email)
+        if image_bytes:
+            queue_thumbnail(ObjectId(prediction_id), image_bytes)
+        return image_bytes
+        
+    except Exception as e:
+        print(f"Error getting prediction thumbnail: {e}")
+        return None
+
 def delete_prediction(prediction_id, user_email):
     # Delete a prediction from MongoDB
     try:
@@ -189,6 +502,10 @@ def delete_prediction(prediction_id, user_email):
                 "user_email": user_email
             })
             print(f"Delete result: {result.deleted_count}")
+            if result.deleted_count and prediction.get('created_at'):
+                record_prediction(db, prediction.get('predicted_class'), prediction['created_at'], count=-1)
+            if result.deleted_count:
+                release_images(image_refs(prediction))
             return result.deleted_count > 0
         else:
             print("Prediction not found")
@@ -201,7 +518,9 @@ def delete_prediction(prediction_id, user_email):
 def get_all_user_predictions():
     # Get all predictions for admin view
     try:
-        predictions = list(db.predictions.find().sort("created_at", -1))
+        predictions = list(
+            db.predictions.find({}, {"image_data": 0, "model_probabilities": 0}).sort("created_at", -1)
+        )
         
         # Convert MongoDB documents to the expected format
         formatted_predictions = []
@@ -211,7 +530,7 @@ def get_all_user_predictions():
                 pred['image_filename'],
                 pred['predicted_class'],
                 pred['confidence'],
-                pred['top_predictions'],
+                decode_top_predictions(pred),
                 pred['created_at'],
                 pred['user_name'],
                 pred['user_email']
@@ -221,4 +540,102 @@ def get_all_user_predictions():
         
     except Exception as e:
         print(f"Error getting all predictions: {e}")
-        return []
\ No newline at end of file
+        return []
+
+def get_users_with_prediction_stats(query, sort_field="created_at", skip=0, limit=10):
+    """Get one page of users with their prediction statistics in a single aggregation
+
+    Each user gets pred_count, avg_confidence (0-1), last_prediction and
+    class_counts (class -> count, most predicted first). Only the fields
+    needed for the statistics are read from the predictions.
+    """
+    try:
+        pipeline = [
+            {"$match": query},
+            {"$sort": {sort_field: -1, "_id": -1}},
+            {"$skip": skip},
+            {"$limit": limit},
+            {"$project": {"name": 1, "email": 1, "is_verified": 1, "created_at": 1}},
+            {"$lookup": {
+                "from": "predictions",
+                "let": {"email": "$email"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$user_email", "$$email"]}}},
+                    {"$group": {
+                        "_id": "$predicted_class",
+                        "count": {"$sum": 1},
+                        "confidence": {"$sum": "$confidence"},
+                        "last": {"$max": "$created_at"}
+                    }},
+                    {"$sort": {"count": -1}}
+                ],
+                "as": "prediction_classes"
+            }}
+        ]
+        
+        users = []
+        for user in db.users.aggregate(pipeline):
+            classes = user.pop("prediction_classes")
+            pred_count = sum(item["count"] for item in classes)
+            user["pred_count"] = pred_count
+            user["class_counts"] = {(item["_id"] or "Unknown"): item["count"] for item in classes}
+            user["avg_confidence"] = sum(item["confidence"] for item in classes) / pred_count if pred_count else 0
+            user["last_prediction"] = max((item["last"] for item in classes if item["last"]), default=None)
+            users.append(user)
+        
+        return users
+        
+    except Exception as e:
+        print(f"Error getting users: {e}")
+        return []
+
+def get_dashboard_statistics(days=7):
+    """Get the admin dashboard numbers from the statistics rollups (see stats_rollups.get_dashboard_stats)"""
+    return get_dashboard_stats(dashboard_db, days=days)
+
+def build_user_query(search_term=None, status=None):
+    # Filter for the admin user list: name/email search and 'Verified'/'Unverified' status
+    query = {}
+    if search_term:
+        query["$or"] = [
+            {"name": {"$regex": search_term, "$options": "i"}},
+            {"email": {"$regex": search_term, "$options": "i"}}
+        ]
+    
+    if status == "Verified":
+        query["is_verified"] = 1
+    elif status == "Unverified":
+        query["is_verified"] = 0
+    
+    return query
+
+def count_users(query):
+    """Count the users matching a build_user_query filter"""
+    try:
+        return db.users.count_documents(query)
+    except Exception as e:
+        print(f"Error counting users: {e}")
+        return 0
+
+def mark_user_verified(email):
+    """Verify a user without a code (admin action); returns True if the user was unverified"""
+    result = users_collection.update_one({"email": email}, {"$set": {"is_verified": 1}})
+    if result.modified_count:
+        record_user_verified(db)
+        return True
+    return False
+
+def delete_user(email):
+    """Delete a user, all of their predictions and the stored images only they used"""
+    user = users_collection.find_one({"email": email}, {"is_verified": 1, "created_at": 1})
+    # Count the predictions per day and class and collect their images while they still exist
+    counts = prediction_counts(db, {"user_email": email})
+    refs = [
+        ref for pred in predictions_collection.find({"user_email": email}, {"image_ref": 1, "thumbnail_ref": 1})
+        for ref in image_refs(pred)
+    ]
+    users_collection.delete_one({"email": email})
+    predictions_collection.delete_many({"user_email": email})
+    if user:
+        record_user_deleted(db, user, counts)
+    release_images(refs)
@@ -0,0 +1,33 @@
+import os
+import numpy as np
+from utils.prediction_utils import CLASS_NAMES
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def list_labelled_images(eval_dir, limit=None):
+    """Collect (path, class index) pairs from a directory with one folder per class"""
+    images = []
+    for class_idx, class_name in enumerate(CLASS_NAMES):
+        class_dir = os.path.join(eval_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        if limit:
+            files = files[:limit]
+        images.extend((os.path.join(class_dir, f), class_idx) for f in files)
+    return images
+
+def collect_probabilities(classifier, image_paths, batch_size=32):
+    """Run the ensemble over all images and keep ensemble and per-model outputs"""
+    outputs = {}
+    for start in range(0, len(image_paths), batch_size):
+        img_batch, valid_indices = classifier.preprocess_batch(image_paths[start:start + batch_size])
+        if len(valid_indices) != len(image_paths[start:start + batch_size]):
+            raise ValueError(f"Could not preprocess all images in batch starting at {start}")
+
+        ensemble, predictions = classifier.predict_probabilities(img_batch)
+        outputs.setdefault('ensemble', []).append(ensemble)
+        for name, pred in predictions.items():
+            outputs.setdefault(name, []).append(pred)
+
+    return {name: np.concatenate(chunks) for name, chunks in outputs.items()}
@@ -0,0 +1,227 @@
+import hashlib
+import os
+import threading
+from datetime import datetime, timezone
+from config import (
+    IMAGE_STORE_BACKEND, IMAGE_STORE_DIR, IMAGE_STORE_S3_BUCKET, IMAGE_STORE_S3_PREFIX, IMAGE_STORE_S3_ENDPOINT
+)
+
+# Chunks without a files document that are older than this were left by an interrupted
+# GridFS upload; younger ones may belong to an upload that is still running
+ORPHAN_CHUNK_SECONDS = 60
+
+def content_id(image_bytes):
+    """Content hash used as the storage key, so identical uploads are stored once"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+class ImageStore:
+    """Base class for the places uploaded images can be kept
+
+    Images are stored under the sha256 of their bytes. put() skips the write
+    when the image is already stored and returns a reference to keep in the
+    prediction document instead of the image itself. Since identical uploads
+    share one stored image, only delete an image once nothing references it.
+    """
+
+    name = None
+
+    def put(self, image_bytes, content_type=None):
+        """Store an image (once per content hash) and return its reference"""
+        image_id = content_id(image_bytes)
+        if not self.exists(image_id):
+            self.write(image_id, image_bytes, content_type)
+        return {
+            'store': self.name,
+            'id': image_id,
+            'size': len(image_bytes),
+            'content_type': content_type
+        }
+
+    def exists(self, image_id):
+        raise NotImplementedError
+
+    def write(self, image_id, image_bytes, content_type):
+        raise NotImplementedError
+
+    def get(self, image_id):
+        """Return the stored bytes, or None if there is no such image"""
+        raise NotImplementedError
+
+    def delete(self, image_id):
+        """Remove a stored image; images that do not exist are ignored"""
+        raise NotImplementedError
+
+    def list_images(self):
+        """Yield (image id, time stored as an aware datetime) for every stored image"""
+        raise NotImplementedError
+
+class GridFSImageStore(ImageStore):
+    """Keep images in a MongoDB GridFS bucket, with the content hash as file id"""
+
+    name = 'gridfs'
+
+    def __init__(self, db, bucket_name='images'):
+        import gridfs
+
+        self.files = db[f"{bucket_name}.files"]
+        self.chunks = db[f"{bucket_name}.chunks"]
+        self.bucket = gridfs.GridFSBucket(db, bucket_name=bucket_name)
+
+    def exists(self, image_id):
+        return self.files.find_one({"_id": image_id}, {"_id": 1}) is not None
+
+    def _upload(self, image_id, image_bytes, content_type):
+        self.bucket.upload_from_stream_with_id(
+            image_id, image_id, image_bytes,
+            metadata={"content_type": content_type}
+        )
+
+    def _remove_orphan_chunks(self, image_id):
+        """Delete the chunks of an interrupted upload, returning False if they may still be in use"""
+        newest = self.chunks.find_one({"files_id": image_id}, {"_id": 1}, sort=[("_id", -1)])
+        if newest is None:
+            return True
+        age = datetime.now(timezone.utc) - newest["_id"].generation_time
+        if age.total_seconds() < ORPHAN_CHUNK_SECONDS:
+            return False
+        self.chunks.delete_many({"files_id": image_id})
+        return True
+
+    def write(self, image_id, image_bytes, content_type):
+        from gridfs.errors import FileExists
+        from pymongo.errors import DuplicateKeyError
+
+        try:
+            self._upload(image_id, image_bytes, content_type)
+        except (FileExists, DuplicateKeyError):
+            if self.exists(image_id):
+                # Another request stored the same image first
+                return
+            # The files document is written last, so chunks without one come from an
+            # upload that is still running or was interrupted
+            if self._remove_orphan_chunks(image_id):
+                self._upload(image_id, image_bytes, content_type)
+
+    def get(self, image_id):
+        from gridfs.errors import NoFile
+
+        try:
+            return self.bucket.open_download_stream(image_id).read()
+        except NoFile:
+            return None
+
+    def delete(self, image_id):
+        from gridfs.errors import NoFile
+
+        try:
+            self.bucket.delete(image_id)
+        except NoFile:
+            # Still remove chunks an interrupted upload may have left
+            self.chunks.delete_many({"files_id": image_id})
+
+    def list_images(self):
+        for doc in self.files.find({}, {"uploadDate": 1}):
+            yield doc["_id"], doc["uploadDate"].replace(tzinfo=timezone.utc)
+
+class LocalImageStore(ImageStore):
+    """Keep images as files in a local (or mounted) directory"""
+
+    name = 'local'
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, image_id):
+        # Spread files over subdirectories so no single directory gets huge
+        return os.path.join(self.directory, image_id[:2], image_id)
+
+    def exists(self, image_id):
+        return os.path.exists(self._path(image_id))
+
+    def write(self, image_id, image_bytes, content_type):
+        # Write to a temporary file first so readers never see a partial image
+        path = self._path(image_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, path)
+
+    def get(self, image_id):
+        try:
+            with open(self._path(image_id), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, image_id):
+        try:
+            os.remove(self._path(image_id))
+        except FileNotFoundError:
+            pass
+
+    def list_images(self):
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                # Skip temporary files of writes in progress
+                if not filename.endswith('.tmp'):
+                    mtime = os.path.getmtime(os.path.join(dirpath, filename))
+                    yield filename, datetime.fromtimestamp(mtime, timezone.utc)
+
+class S3ImageStore(ImageStore):
+    """Keep images in an S3-compatible bucket (requires boto3)"""
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None):
+        try:
+            import boto3 # pyright: ignore[reportMissingImports]
+        except ImportError:
+            raise ImportError("IMAGE_STORE_BACKEND=s3 requires boto3 (see requirements-optional.txt)") from None
+
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None)
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, image_id):
+        return f"{self.prefix}{image_id}"
+
+    def exists(self, image_id):
+        from botocore.exceptions import ClientError # pyright: ignore[reportMissingImports]
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(image_id))
+            return True
+        except ClientError:
+            return False
+
+    def write(self, image_id, image_bytes, content_type):
+        extra = {'ContentType': content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self._key(image_id), Body=image_bytes, **extra)
+
+    def get(self, image_id):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(image_id))['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def delete(self, image_id):
+        # Deleting a missing key succeeds in S3
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(image_id))
+
+    def list_images(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):], item['LastModified']
+
+def create_image_store(db):
+    """Build the store configured by IMAGE_STORE_BACKEND ('gridfs', 'local' or 's3')"""
+    if IMAGE_STORE_BACKEND == 'gridfs':
+        return GridFSImageStore(db)
+    if IMAGE_STORE_BACKEND == 'local':
+        return LocalImageStore(IMAGE_STORE_DIR)
+    if IMAGE_STORE_BACKEND == 's3':
+        return S3ImageStore(IMAGE_STORE_S3_BUCKET, IMAGE_STORE_S3_PREFIX, IMAGE_STORE_S3_ENDPOINT)
+    raise ValueError(f"Unknown image store: {IMAGE_STORE_BACKEND}")
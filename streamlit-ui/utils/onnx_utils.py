@@ -0,0 +1,35 @@
+import os
+from utils.backends import INPUT_SHAPE, add_input_normalization
+
+# Directory for exported models, relative to the project root
+ONNX_DIR = 'models/saved_models/onnx'
+
+# Opset supported by every onnxruntime release we deploy
+ONNX_OPSET = 13
+
+def onnx_model_path(name):
+    """Path of the exported ONNX file for a model"""
+    return f"{ONNX_DIR}/best_{name}.onnx"
+
+def export_model(keras_path, output_path, opset=ONNX_OPSET, normalization=None):
+    """Export a saved Keras model to ONNX with a (None, 224, 224, 3) input
+
+    With a (mean, std) normalization the exported model takes uint8 pixels.
+    """
+    import tensorflow as tf
+    try:
+        import tf2onnx # pyright: ignore[reportMissingImports]
+    except ImportError:
+        raise ImportError("ONNX export requires tf2onnx (see requirements-optional.txt)") from None
+
+    model = tf.keras.models.load_model(keras_path)
+    input_dtype = tf.float32
+    if normalization is not None:
+        model = add_input_normalization(model, *normalization)
+        input_dtype = tf.uint8
+    input_signature = (tf.TensorSpec((None,) + INPUT_SHAPE, input_dtype, name='image'),)
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=opset, output_path=output_path)
+
+    return os.path.getsize(output_path)
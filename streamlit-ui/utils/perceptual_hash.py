@@ -0,0 +1,153 @@
+import threading
+from collections import deque
+import numpy as np
+from PIL import Image
+from config import PHASH_MAX_DISTANCE, PHASH_INDEX_MAX_ENTRIES
+
+# Size of the DCT low-frequency block kept by the perceptual hash (8x8 = 64 bits)
+HASH_SIZE = 8
+
+# The image is shrunk to HASH_SIZE * HIGHFREQ_FACTOR before the DCT
+HIGHFREQ_FACTOR = 4
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis matrix of size n x n"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+_DCT = _dct_matrix(HASH_SIZE * HIGHFREQ_FACTOR)
+
+def compute_phash(image_file):
+    """Compute a 64-bit perceptual hash (pHash) of an image
+
+    The image is shrunk to 32x32 grayscale and transformed with a 2D DCT.
+    Each bit of the hash says whether one of the 8x8 lowest frequencies is
+    above their median, so recompressed or resized copies of a photo end up
+    within a few bits of each other.
+    """
+    size = HASH_SIZE * HIGHFREQ_FACTOR
+    with Image.open(image_file) as img:
+        if img.format == 'JPEG':
+            img.draft('L', (size, size))
+        pixels = np.asarray(img.convert('L').resize((size, size), Image.LANCZOS), dtype=np.float64)
+
+    dct = _DCT @ pixels @ _DCT.T
+    low_freq = dct[:HASH_SIZE, :HASH_SIZE]
+    bits = (low_freq > np.median(low_freq)).flatten()
+
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def hash_to_str(value):
+    """Store hashes as fixed-width hex strings (they do not fit in a signed BSON int64)"""
+    return f"{value:016x}"
+
+def hash_from_str(text):
+    return int(text, 16)
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    """Burkhard-Keller tree for Hamming-distance lookups over hashes
+
+    Each node's children are keyed by their distance to the node, so a
+    search only descends into children whose key is within max_distance of
+    the query's distance to the node (triangle inequality).
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        node = [value, item, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming_distance(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value, max_distance):
+        """Return (distance, item) pairs within max_distance, closest first"""
+        matches = []
+        if self.root is None:
+            return matches
+
+        candidates = [self.root]
+        while candidates:
+            node_value, item, children = candidates.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                matches.append((distance, item))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    candidates.append(child)
+
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+class NearDuplicateIndex:
+    """Thread-safe index of past predictions by perceptual hash
+
+    Holds at most max_entries predictions, evicting the oldest. A BK-tree
+    cannot remove nodes, so evicted entries are skipped by find() and the
+    tree is rebuilt from the live entries once it holds twice max_entries.
+    """
+
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE, max_entries=PHASH_INDEX_MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.max_entries = max(1, max_entries)
+        self.tree = BKTree()
+        # (sequence number, phash, result) of the live entries, oldest first
+        self.entries = deque()
+        self.next_seq = 0
+        self.lock = threading.Lock()
+
+    def load(self, records):
+        """Add stored predictions given as dicts with a 'phash' hex string, newest first"""
+        for record in reversed(list(records)):
+            self.add(hash_from_str(record['phash']), record)
+
+    def add(self, phash, result):
+        """Add a prediction result (a dict, optionally with its 'model_version')"""
+        with self.lock:
+            entry = (self.next_seq, phash, result)
+            self.next_seq += 1
+            self.entries.append(entry)
+            self.tree.add(phash, entry)
+            if len(self.entries) > self.max_entries:
+                self.entries.popleft()
+            if self.tree.size >= 2 * self.max_entries:
+                self.tree = BKTree()
+                for live in self.entries:
+                    self.tree.add(live[1], live)
+
+    def find(self, phash, model_version=None):
+        """Return (distance, stored result) of the closest match made by model_version, or None"""
+        if self.max_distance < 0:
+            return None
+        with self.lock:
+            matches = self.tree.search(phash, self.max_distance)
+            oldest = self.entries[0][0] if self.entries else self.next_seq
+        for distance, (seq, _, result) in matches:
+            if seq >= oldest and result.get('model_version') == model_version:
+                return distance, result
+        return None
+
+    def __len__(self):
+        return len(self.entries)
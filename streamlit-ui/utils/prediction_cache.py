@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from config import (
+    PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_BACKEND, PREDICTION_CACHE_DIR,
+    PREDICTION_CACHE_DIR_MAX_ENTRIES
+)
+
+def image_hash(image_bytes):
+    """Content hash of an uploaded image"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def read_image_bytes(image_file):
+    """Return the raw bytes of a path, bytes object or file-like upload"""
+    if isinstance(image_file, (bytes, bytearray)):
+        return bytes(image_file)
+    if isinstance(image_file, (str, os.PathLike)):
+        with open(image_file, 'rb') as f:
+            return f.read()
+    if hasattr(image_file, 'getvalue'):
+        return image_file.getvalue()
+
+    # Generic file object: read it and rewind for whoever reads it next
+    position = image_file.tell()
+    data = image_file.read()
+    image_file.seek(position)
+    return data
+
+def result_to_dict(result):
+    """Convert a prediction result to plain JSON/BSON-serializable types"""
+    return {
+        'predicted_class': result['predicted_class'],
+        'confidence': float(result['confidence']),
+        'top_predictions': [[class_name, float(prob)] for class_name, prob in result['top_predictions']],
+        'individual_predictions': {
+            name: np.asarray(pred).tolist() for name, pred in result['individual_predictions'].items()
+        },
+        'all_probabilities': np.asarray(result['all_probabilities']).tolist()
+    }
+
+def result_from_dict(data):
+    """Rebuild a prediction result from result_to_dict output"""
+    return {
+        'predicted_class': data['predicted_class'],
+        'confidence': data['confidence'],
+        'top_predictions': [(class_name, prob) for class_name, prob in data['top_predictions']],
+        'individual_predictions': {
+            name: np.asarray(pred, dtype=np.float32) for name, pred in data['individual_predictions'].items()
+        },
+        'all_probabilities': np.asarray(data['all_probabilities'], dtype=np.float32)
+    }
+
+class DiskCacheTier:
+    """Persistent cache tier storing one JSON file per key in a directory
+
+    Expired files and the oldest files beyond max_entries are pruned when
+    the tier is created and after every prune_every writes.
+    """
+
+    def __init__(self, directory, ttl=PREDICTION_CACHE_TTL, max_entries=PREDICTION_CACHE_DIR_MAX_ENTRIES,
+                 prune_every=100):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prune_every = max(1, prune_every)
+        self.writes = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.prune()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, data):
+        # Write to a temporary file first so readers never see a partial file
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.writes += 1
+            prune = self.writes % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Remove expired entries and the oldest ones beyond max_entries; returns how many were removed"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        entries.sort()
+
+        # Oldest first, so expired files come before the rest
+        now = time.time()
+        expired = [path for mtime, path in entries if self.ttl and now - mtime > self.ttl]
+        remaining = [path for _, path in entries[len(expired):]]
+        excess = []
+        if self.max_entries and len(remaining) > self.max_entries:
+            excess = remaining[:len(remaining) - self.max_entries]
+
+        removed = 0
+        for path in expired + excess:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+class MongoCacheTier:
+    """Persistent cache tier backed by a MongoDB collection with a TTL index"""
+
+    def __init__(self, collection, ttl=PREDICTION_CACHE_TTL):
+        self.collection = collection
+        self.ttl = ttl
+        if ttl:
+            from pymongo.errors import OperationFailure
+            from utils.db_indexes import cache_ttl_index, create_index
+
+            _, keys, options = cache_ttl_index(ttl)
+            try:
+                create_index(collection.database, collection.name, keys, options)
+            except OperationFailure as e:
+                # Expired entries are still ignored by get()
+                print(f"Warning: Could not create the prediction cache TTL index: {e}")
+
+    def get(self, key):
+        doc = self.collection.find_one({"_id": key})
+        if not doc:
+            return None
+        # The TTL monitor only runs once a minute, so check expiry here too
+        if self.ttl and doc['created_at'] < datetime.now() - timedelta(seconds=self.ttl):
+            return None
+        return doc['result']
+
+    def put(self, key, data):
+        self.collection.replace_one(
+            {"_id": key},
+            {"_id": key, "result": data, "created_at": datetime.now()},
+            upsert=True
+        )
+
+class PredictionCache:
+    """Two-tier cache of prediction results keyed by image hash and model version
+
+    The in-memory tier is an LRU limited to max_entries, with entries expiring
+    after ttl seconds. An optional persistent tier (DiskCacheTier or
+    MongoCacheTier) holds serialized results across restarts and processes.
+    """
+
+    def __init__(self, max_entries=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL, persistent=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_bytes, model_version):
+        """Cache key for an image under a specific set of models"""
+        return f"{image_hash(image_bytes)}:{model_version}"
+
+    def get(self, key):
+        """Return the cached result for a key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                stored_at, result = entry
+                if not self.ttl or time.time() - stored_at <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self.entries[key]
+
+        if self.persistent is not None:
+            try:
+                data = self.persistent.get(key)
+            except Exception as e:
+                print(f"Error reading prediction cache: {e}")
+                data = None
+            if data is not None:
+                result = result_from_dict(data)
+                self._remember(key, result)
+                with self.lock:
+                    self.hits += 1
+                return result
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """Store a result in memory and in the persistent tier"""
+        self._remember(key, result)
+
+        if self.persistent is not None:
+            try:
+                self.persistent.put(key, result_to_dict(result))
+            except Exception as e:
+                print(f"Error writing prediction cache: {e}")
+
+    def _remember(self, key, result):
+        with self.lock:
+            self.entries[key] = (time.time(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_stats(self):
+        """Return hit/miss counts and the in-memory size"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+            }
+
+def create_prediction_cache():
+    """Build the cache configured by the PREDICTION_CACHE_* settings
+
+    Returns None when caching is disabled (PREDICTION_CACHE_SIZE=0).
+    """
+    if PREDICTION_CACHE_SIZE <= 0:
+        return None
+
+    persistent = None
+    if PREDICTION_CACHE_BACKEND == 'disk':
+        persistent = DiskCacheTier(PREDICTION_CACHE_DIR)
+    elif PREDICTION_CACHE_BACKEND == 'mongo':
+        from utils.db_utils import db
+        persistent = MongoCacheTier(db['prediction_cache'])
+
+    return PredictionCache(persistent=persistent)
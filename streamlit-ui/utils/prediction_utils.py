@@ -1,15 +1,36 @@
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import load_model # pyright: ignore[reportMissingImports]
-from tensorflow.keras.preprocessing.image import img_to_array, load_img # pyright: ignore[reportMissingImports]
-from PIL import Image
 import io
+from config import (
+    INFERENCE_INTER_OP_THREADS, INFERENCE_INTRA_OP_THREADS, INFERENCE_CONCURRENT,
+    INFERENCE_BACKEND, TFLITE_QUANTIZATION, TFLITE_NUM_THREADS, ONNX_NUM_THREADS,
+    MODEL_LAZY_LOADING, NORMALIZE_IN_GRAPH, CASCADE_ENABLED, CASCADE_THRESHOLDS_FILE, INFERENCE_WORKERS,
+    INFERENCE_SERVER_URL
+)
+from utils.preprocessing import ImagePreprocessor
+from utils.cascade import CascadePolicy
+from utils.worker_pool import WorkerPoolBackend
+from utils.prediction_cache import (
+    create_prediction_cache, read_image_bytes
+)
+from utils.backends import (
+    INPUT_SHAPE, MODEL_PATHS, InferenceBackend,
+    TensorFlowBackend, TFLiteBackend, ONNXBackend, find_model_file
+)
 
-# Set TensorFlow logging level to reduce warnings
+# Set TensorFlow logging level to reduce warnings (TensorFlow itself is only
+# imported once models are loaded, so pages without inference start quickly)
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 os.environ['ABSL_LOG_LEVEL'] = 'FATAL'
 
+# Process-wide classifier shared by all pages
+_classifier = None
+_classifier_lock = threading.Lock()
+
 # Class names for garbage classification
 CLASS_NAMES = [
     'battery', 'biological', 'cardboard', 'clothes', 'glass',
@@ -25,70 +46,332 @@ def pytorch_normalize(img):
     img = img / 255.0
     return (img - MEAN) / STD
 
+# Recycling guidance for each class
+RECYCLING_INFO = {
+    'battery': {
+        'category': 'Hazardous Waste',
+        'instructions': 'Do not throw in regular trash. Take to battery recycling centers or electronics stores.',
+        'impact': 'High (contains toxic chemicals)',
+        'color': 'red'
+    },
+    'biological': {
+        'category': 'Organic Waste',
+        'instructions': 'Compost if possible, or dispose in green waste bin.',
+        'impact': 'Low (biodegradable)',
+        'color': 'green'
+    },
+    'cardboard': {
+        'category': 'Recyclable',
+        'instructions': 'Flatten and place in blue recycling bin.',
+        'impact': 'Low (easily recyclable)',
+        'color': 'blue'
+    },
+    'clothes': {
+        'category': 'Textile Waste',
+        'instructions': 'Donate if in good condition, otherwise take to textile recycling centers.',
+        'impact': 'Medium (can be recycled)',
+        'color': 'yellow'
+    },
+    'glass': {
+        'category': 'Recyclable',
+        'instructions': 'Rinse and place in glass recycling bin.',
+        'impact': 'Low (infinitely recyclable)',
+        'color': 'blue'
+    },
+    'metal': {
+        'category': 'Recyclable',
+        'instructions': 'Rinse and place in metal recycling bin.',
+        'impact': 'Low (highly recyclable)',
+        'color': 'blue'
+    },
+    'paper': {
+        'category': 'Recyclable',
+        'instructions': 'Place in paper recycling bin. Keep dry and clean.',
+        'impact': 'Low (easily recyclable)',
+        'color': 'blue'
+    },
+    'plastic': {
+        'category': 'Recyclable',
+        'instructions': 'Check recycling number. Rinse and place in appropriate recycling bin.',
+        'impact': 'Medium (depends on type)',
+        'color': 'blue'
+    },
+    'shoes': {
+        'category': 'Textile Waste',
+        'instructions': 'Donate if wearable, otherwise take to shoe recycling programs.',
+        'impact': 'Medium (can be recycled)',
+        'color': 'yellow'
+    },
+    'trash': {
+        'category': 'General Waste',
+        'instructions': 'Place in general waste bin. Consider if items can be recycled.',
+        'impact': 'High (goes to landfill)',
+        'color': 'red'
+    }
+}
+
+def get_recycling_info(predicted_class):
+    """Get recycling information for the predicted class"""
+    return RECYCLING_INFO.get(predicted_class, {
+        'category': 'Unknown',
+        'instructions': 'Please check local recycling guidelines.',
+        'impact': 'Unknown',
+        'color': 'gray'
+    })
+
 class GarbageClassifier:
-    def __init__(self):
-        """Initialize the garbage classifier with three models"""
-        self.models = {}
+    def __init__(self, inference_mode='compiled', fused=False, concurrent=INFERENCE_CONCURRENT,
+                 inter_op_threads=INFERENCE_INTER_OP_THREADS, intra_op_threads=INFERENCE_INTRA_OP_THREADS,
+                 backend=INFERENCE_BACKEND, quantization=TFLITE_QUANTIZATION, tflite_threads=TFLITE_NUM_THREADS,
+                 onnx_threads=ONNX_NUM_THREADS, lazy=False, normalize_in_graph=NORMALIZE_IN_GRAPH,
+                 cache=None, cascade=CASCADE_ENABLED, workers=INFERENCE_WORKERS):
+        """Initialize the garbage classifier with three models
+
+        backend selects the runtime: 'tensorflow' (default), 'tflite' for the
+        quantized conversions, 'onnx' for ONNX Runtime, or an
+        InferenceBackend instance.
+        
+        For TensorFlow, inference_mode selects how models are run: 'compiled'
+        (default) calls a warmed tf.function per model, 'predict' uses the
+        original model.predict path for comparison. With fused=True the three
+        models are combined into a single graph that also does the averaging.
+        inter_op_threads and intra_op_threads set TensorFlow's thread budgets
+        (0 keeps the default).
+        
+        For TFLite, quantization is 'int8' or 'float16' and tflite_threads is
+        the number of interpreter threads per model. For ONNX Runtime,
+        onnx_threads is the intra-op thread count per model.
+        
+        With concurrent=True the separate models run at the same time on a
+        thread pool.
+        
+        With normalize_in_graph=True images are sent to the backend as uint8
+        pixels and the TensorFlow models normalize them inside their graph.
+        TFLite and ONNX models do the same when they were converted with
+        convert_models.py --normalize-in-graph, otherwise the backend
+        normalizes on the host.
+        
+        cache is an optional PredictionCache. Images already in it skip the
+        ensemble entirely.
+        
+        With cascade=True (or a CascadePolicy) MobileNetV2 runs first and the
+        other models only run for images where its confidence or margin is
+        below the thresholds from calibrate_cascade.py. The cascade runs the
+        models separately, so it takes precedence over fused=True.
+        
+        With workers > 0 the models are loaded and run in that many worker
+        processes instead of this one (see WorkerPoolBackend); the other
+        options configure the classifier inside each worker.
+        
+        With lazy=True the models load in a background thread and the
+        constructor returns immediately. Predictions use whichever models
+        have finished loading; see is_ready and get_loading_progress.
+        """
+        normalization = (MEAN, STD) if normalize_in_graph else None
+        
+        if isinstance(backend, InferenceBackend):
+            self.backend = backend
+        elif workers > 0:
+            # Split the cores between the workers unless told otherwise
+            if not intra_op_threads:
+                intra_op_threads = max(1, (os.cpu_count() or 1) // workers)
+            self.backend = WorkerPoolBackend(workers, {
+                'inference_mode': inference_mode,
+                'fused': fused,
+                'concurrent': concurrent,
+                'inter_op_threads': inter_op_threads,
+                'intra_op_threads': intra_op_threads,
+                'backend': backend,
+                'quantization': quantization,
+                'tflite_threads': tflite_threads,
+                'onnx_threads': onnx_threads,
+                'normalize_in_graph': normalize_in_graph
+            })
+        elif backend == 'tensorflow':
+            self.backend = TensorFlowBackend(inference_mode, fused, inter_op_threads, intra_op_threads, normalization)
+        elif backend == 'tflite':
+            self.backend = TFLiteBackend(quantization, tflite_threads)
+        elif backend == 'onnx':
+            self.backend = ONNXBackend(onnx_threads)
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+        
         self.model_names = ['resnet50', 'custom_cnn', 'mobilenetv2']
-        self.load_models()
+        self.normalize_in_graph = normalize_in_graph
+        self.preprocessor = ImagePreprocessor(MEAN, STD, size=INPUT_SHAPE[:2], normalize=not normalize_in_graph)
+        self.backend.normalizer = self.preprocessor.normalize
+        self.backend.normalize_in_graph = normalize_in_graph
+        self.concurrent = concurrent
+        self.executor = None
+        self.cache = cache
+        self._model_versions = {}
+        
+        if isinstance(cascade, CascadePolicy):
+            self.cascade = cascade
+        elif cascade:
+            self.cascade = CascadePolicy.load(CASCADE_THRESHOLDS_FILE)
+        else:
+            self.cascade = None
+        
+        # One worker per model so every backbone can run at the same time
+        if self.concurrent:
+            self.executor = ThreadPoolExecutor(
+                max_workers=len(self.model_names),
+                thread_name_prefix='ensemble'
+            )
+        
+        # Loading state
+        self.loading_status = {name: 'pending' for name in self.model_names}
+        self.loading_started = None
+        self.loading_finished = None
+        self.ready_event = threading.Event()
+        
+        if lazy:
+            self.loading_thread = threading.Thread(target=self.load_models, name='model-loader', daemon=True)
+            self.loading_thread.start()
+        else:
+            self.load_models()
+    
+    @property
+    def models(self):
+        """Loaded models by name"""
+        return self.backend.models
     
     def load_models(self):
-        """Load the three best models"""
-        model_paths = {
-            'resnet50': 'models/saved_models/best_resnet50.keras',
-            'custom_cnn': 'models/saved_models/best_custom_cnn.keras',
-            'mobilenetv2': 'models/saved_models/best_mobilenetv2.keras'
-        }
+        """Load the three best models one after another"""
+        self.loading_started = time.time()
         
-        for name, path in model_paths.items():
-            try:
-                # Check if path exists relative to streamlit-ui directory
-                if os.path.exists(path):
-                    self.models[name] = load_model(path)
-                else:
-                    # Try relative to parent directory
-                    parent_path = f"../{path}"
-                    if os.path.exists(parent_path):
-                        self.models[name] = load_model(parent_path)
-                    else:
-                        print(f"Warning: Could not load model {name} from {path}")
-            except Exception as e:
-                print(f"Error loading model {name}: {e}")
+        for name in self.model_names:
+            self.loading_status[name] = 'loading'
+            loaded = self.backend.add_model(name)
+            self.loading_status[name] = 'loaded' if loaded else 'failed'
+        
+        self.backend.finish_loading()
+        self.loading_finished = time.time()
+        self.ready_event.set()
     
-    def preprocess_image(self, image_file):
-        """Preprocess uploaded image for prediction"""
-        try:
-            # Load and resize image
-            img = load_img(image_file, target_size=(224, 224))
-            img_array = img_to_array(img)
-            
-            # Normalize image
-            img_normalized = pytorch_normalize(img_array)
-            
-            # Add batch dimension
-            img_batch = np.expand_dims(img_normalized, axis=0)
-            
-            return img_batch
-        except Exception as e:
-            print(f"Error preprocessing image: {e}")
-            return None
+    def is_ready(self):
+        """Return True once every model has finished loading (or failed)"""
+        return self.ready_event.is_set()
     
-    def predict_single(self, image_file):
-        """Make prediction using all three models and return ensemble result"""
-        # Preprocess image
-        img_batch = self.preprocess_image(image_file)
-        if img_batch is None:
+    def wait_until_ready(self, timeout=None):
+        """Block until loading finishes or the timeout passes, returning is_ready()"""
+        return self.ready_event.wait(timeout)
+    
+    def get_loading_progress(self):
+        """Return the loading state of each model and overall progress"""
+        status = dict(self.loading_status)
+        finished = self.loading_finished or time.time()
+        return {
+            'ready': self.is_ready(),
+            'loaded': sum(1 for state in status.values() if state == 'loaded'),
+            'total': len(status),
+            'status': status,
+            'elapsed': finished - self.loading_started if self.loading_started else 0.0
+        }
+    
+    @property
+    def model_version(self):
+        """Identifier of the models currently serving, used in cache keys
+
+        Changes when the backend, quantization, set of loaded models or any
+        model file changes, so stale results are never returned.
+        """
+        loaded = tuple(sorted(self.models))
+        if loaded not in self._model_versions:
+            parts = [self.backend.name or type(self.backend).__name__, str(getattr(self.backend, 'quantization', ''))]
+            if self.cascade is not None:
+                parts.append(self.cascade.version)
+            for name in loaded:
+                model_file = find_model_file(MODEL_PATHS[name])
+                stat = os.stat(model_file) if model_file else None
+                parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}" if stat else name)
+            self._model_versions[loaded] = hashlib.sha1('|'.join(parts).encode()).hexdigest()[:12]
+        return self._model_versions[loaded]
+    
+    def get_cached_prediction(self, image_file):
+        """Return the cached result for an image, or None on a miss"""
+        if self.cache is None or not self.models:
             return None
+        return self.cache.get(self.cache.make_key(read_image_bytes(image_file), self.model_version))
+    
+    def run_model(self, name, img_batch):
+        """Run one model over a preprocessed batch and return its probabilities"""
+        return self.backend.predict(name, img_batch)
+    
+    def predict_probabilities(self, img_batch):
+        """Run the ensemble over a preprocessed batch
+
+        Returns the averaged probabilities with shape (batch, classes) and a
+        dict of each model's probabilities. In cascade mode, rows of models
+        that were skipped for an image are NaN.
+        """
+        # Models that have finished loading so far
+        model_names = list(self.models)
+        
+        if self.cascade is not None and self.cascade.first_model in model_names and len(model_names) > 1:
+            return self.predict_cascade(img_batch, model_names)
+        
+        fused_result = self.backend.predict_ensemble(img_batch)
+        if fused_result is not None:
+            return fused_result
         
+        return self.run_models(img_batch, model_names)
+    
+    def predict_cascade(self, img_batch, model_names):
+        """Run the first model on the whole batch and the rest only where it is unsure"""
+        first_model = self.cascade.first_model
+        first_pred = self.run_model(first_model, img_batch)
+        exits = self.cascade.should_exit(first_pred)
+        escalated = np.flatnonzero(~exits)
+        self.cascade.record(len(img_batch), len(img_batch) - len(escalated))
+        
+        ensemble_predictions = np.array(first_pred, dtype=np.float64)
+        predictions = {first_model: first_pred}
+        if len(escalated) == 0:
+            return ensemble_predictions, predictions
+        
+        # Average all models for the escalated images, as without the cascade
+        other_names = [name for name in model_names if name != first_model]
+        other_ensemble, other_predictions = self.run_models(img_batch[escalated], other_names)
+        if other_predictions:
+            ensemble_predictions[escalated] = (
+                first_pred[escalated] + other_ensemble * len(other_predictions)
+            ) / (len(other_predictions) + 1)
+        
+        for name, pred in other_predictions.items():
+            full_pred = np.full((len(img_batch), pred.shape[1]), np.nan, dtype=pred.dtype)
+            full_pred[escalated] = pred
+            predictions[name] = full_pred
+        
+        return ensemble_predictions, predictions
+    
+    def get_cascade_metrics(self):
+        """Return early-exit statistics, or None when the cascade is off"""
+        if self.cascade is None:
+            return None
+        return self.cascade.get_metrics()
+    
+    def run_models(self, img_batch, model_names):
+        """Run the given models over a batch and average their probabilities"""
         predictions = {}
-        ensemble_predictions = np.zeros(len(CLASS_NAMES))
+        ensemble_predictions = np.zeros((len(img_batch), len(CLASS_NAMES)))
+        
+        # Dispatch all models at once when running concurrently
+        futures = {}
+        if self.executor is not None and len(model_names) > 1:
+            for name in model_names:
+                futures[name] = self.executor.submit(self.run_model, name, img_batch)
         
         # Get predictions from each model
-        for name, model in self.models.items():
+        for name in model_names:
             try:
-                pred = model.predict(img_batch, verbose=0)
-                predictions[name] = pred[0]
-                ensemble_predictions += pred[0]
+                if name in futures:
+                    pred = futures[name].result()
+                else:
+                    pred = self.run_model(name, img_batch)
+                predictions[name] = pred
+                ensemble_predictions += pred
             except Exception as e:
                 print(f"Error predicting with {name}: {e}")
         
@@ -96,6 +379,28 @@ class GarbageClassifier:
         if len(predictions) > 0:
             ensemble_predictions /= len(predictions)
         
+        return ensemble_predictions, predictions
+    
+    def preprocess_image(self, image_file):
+        """Preprocess uploaded image for prediction"""
+        img_batch, _ = self.preprocessor.preprocess_batch([image_file])
+        if img_batch is None:
+            return None
+        
+        # Copy out of the reusable batch buffer
+        return img_batch.copy()
+    
+    def preprocess_batch(self, image_files):
+        """Preprocess several images into one batch tensor
+
+        Returns the batch together with the positions of the images that
+        could be preprocessed, so failed images can be reported as None. The
+        batch reuses a per-thread buffer and is only valid until the next call.
+        """
+        return self.preprocessor.preprocess_batch(image_files)
+    
+    def _format_result(self, ensemble_predictions, predictions):
+        """Build the result dict for one image from its probabilities"""
         # Get final prediction
         predicted_class_idx = np.argmax(ensemble_predictions)
         predicted_class = CLASS_NAMES[predicted_class_idx]
@@ -113,74 +418,86 @@ class GarbageClassifier:
             'all_probabilities': ensemble_predictions
         }
     
+    def predict_single(self, image_file):
+        """Make prediction using all three models and return ensemble result"""
+        return self.predict_batch([image_file])[0]
+    
+    def predict_batch(self, image_files):
+        """Make ensemble predictions for several images at once
+
+        Each model runs once over the whole batch. Returns one result dict
+        per input image (same format as predict_single), or None for images
+        that could not be preprocessed.
+        """
+        # Nothing to predict with until at least one model has loaded
+        if not self.models:
+            return [None] * len(image_files)
+        
+        if self.cache is None:
+            return self._predict_uncached(image_files)
+        
+        # Look every image up in the cache and only run the misses
+        model_version = self.model_version
+        image_bytes = [read_image_bytes(image_file) for image_file in image_files]
+        keys = [self.cache.make_key(data, model_version) for data in image_bytes]
+        results = [self.cache.get(key) for key in keys]
+        
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            computed = self._predict_uncached([io.BytesIO(image_bytes[i]) for i in misses])
+            for i, result in zip(misses, computed):
+                if result is not None:
+                    self.cache.put(keys[i], result)
+                results[i] = result
+        
+        return results
+    
+    def _predict_uncached(self, image_files):
+        """Run the ensemble over images without consulting the cache"""
+        results = [None] * len(image_files)
+        
+        # Preprocess all images into one tensor
+        img_batch, valid_indices = self.preprocess_batch(image_files)
+        if img_batch is None:
+            return results
+        
+        ensemble_predictions, predictions = self.predict_probabilities(img_batch)
+        
+        # Split the batch back into one result per image
+        for row, index in enumerate(valid_indices):
+            # Skip models the cascade did not run for this image
+            individual = {name: pred[row] for name, pred in predictions.items() if not np.isnan(pred[row]).any()}
+            results[index] = self._format_result(ensemble_predictions[row], individual)
+        
+        return results
+    
     def get_recycling_info(self, predicted_class):
         """Get recycling information for the predicted class"""
-        recycling_info = {
-            'battery': {
-                'category': 'Hazardous Waste',
-                'instructions': 'Do not throw in regular trash. Take to battery recycling centers or electronics stores.',
-                'impact': 'High (contains toxic chemicals)',
-                'color': 'red'
-            },
-            'biological': {
-                'category': 'Organic Waste',
-                'instructions': 'Compost if possible, or dispose in green waste bin.',
-                'impact': 'Low (biodegradable)',
-                'color': 'green'
-            },
-            'cardboard': {
-                'category': 'Recyclable',
-                'instructions': 'Flatten and place in blue recycling bin.',
-                'impact': 'Low (easily recyclable)',
-                'color': 'blue'
-            },
-            'clothes': {
-                'category': 'Textile Waste',
-                'instructions': 'Donate if in good condition, otherwise take to textile recycling centers.',
-                'impact': 'Medium (can be recycled)',
-                'color': 'yellow'
-            },
-            'glass': {
-                'category': 'Recyclable',
-                'instructions': 'Rinse and place in glass recycling bin.',
-                'impact': 'Low (infinitely recyclable)',
-                'color': 'blue'
-            },
-            'metal': {
-                'category': 'Recyclable',
-                'instructions': 'Rinse and place in metal recycling bin.',
-                'impact': 'Low (highly recyclable)',
-                'color': 'blue'
-            },
-            'paper': {
-                'category': 'Recyclable',
-                'instructions': 'Place in paper recycling bin. Keep dry and clean.',
-                'impact': 'Low (easily recyclable)',
-                'color': 'blue'
-            },
-            'plastic': {
-                'category': 'Recyclable',
-                'instructions': 'Check recycling number. Rinse and place in appropriate recycling bin.',
-                'impact': 'Medium (depends on type)',
-                'color': 'blue'
-            },
-            'shoes': {
-                'category': 'Textile Waste',
-                'instructions': 'Donate if wearable, otherwise take to shoe recycling programs.',
-                'impact': 'Medium (can be recycled)',
-                'color': 'yellow'
-            },
-            'trash': {
-                'category': 'General Waste',
-                'instructions': 'Place in general waste bin. Consider if items can be recycled.',
-                'impact': 'High (goes to landfill)',
-                'color': 'red'
-            }
-        }
-        
-        return recycling_info.get(predicted_class, {
-            'category': 'Unknown',
-            'instructions': 'Please check local recycling guidelines.',
-            'impact': 'Unknown',
-            'color': 'gray'
-        }) 
\ No newline at end of file
+        return get_recycling_info(predicted_class)
+
+def get_classifier():
+    """Return the process-wide classifier, creating it on first use
+
+    With MODEL_LAZY_LOADING the models load in the background; otherwise
+    the first call blocks until they are loaded. With INFERENCE_SERVER_URL
+    set this is a RemoteClassifier for inference_server.py instead.
+    """
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            if INFERENCE_SERVER_URL:
+                from utils.remote_client import RemoteClassifier
+                _classifier = RemoteClassifier(INFERENCE_SERVER_URL)
+            else:
+                _classifier = GarbageClassifier(lazy=MODEL_LAZY_LOADING, cache=create_prediction_cache())
+    return _classifier
+
+def warm_up_classifier():
+    """Start creating the classifier in the background so the upload page finds it ready
+
+    Only done with MODEL_LAZY_LOADING in the app process: a blocking model
+    load or a worker pool should not be started by a page that may never
+    classify anything.
+    """
+    if _classifier is None and MODEL_LAZY_LOADING and not INFERENCE_WORKERS and not INFERENCE_SERVER_URL:
+        threading.Thread(target=get_classifier, name='classifier-warm-up', daemon=True).start()
@@ -0,0 +1,100 @@
+import threading
+import numpy as np
+from PIL import Image
+
+class ImagePreprocessor:
+    """Decode, resize and normalize images straight into a float32 batch
+
+    Normalization (x / 255 - mean) / std is folded into a single
+    x * scale + bias in float32, written into a per-thread batch buffer
+    that is reused between calls instead of allocating float64 temporaries
+    for every image. JPEGs are decoded with Pillow's draft mode, which lets
+    the decoder downscale by up to 8x while decoding large photos.
+
+    With normalize=False the batch holds the raw uint8 pixels, for models
+    that normalize inside their graph.
+    """
+
+    def __init__(self, mean, std, size=(224, 224), use_draft=True, resample=Image.NEAREST, normalize=True):
+        self.size = size
+        self.normalize_pixels = normalize
+        self.use_draft = use_draft
+        self.resample = resample
+        self.scale = (1.0 / (255.0 * np.asarray(std))).astype(np.float32)
+        self.bias = (-np.asarray(mean) / np.asarray(std)).astype(np.float32)
+
+        # Each thread gets its own buffer so concurrent callers never share one
+        self.local = threading.local()
+
+    def decode(self, image_file):
+        """Decode an image file to a (height, width, 3) uint8 array at the target size"""
+        with Image.open(image_file) as img:
+            if self.use_draft and img.format == 'JPEG':
+                # Decode at the smallest DCT scale that is still >= the target size
+                img.draft('RGB', self.size)
+            img = img.convert('RGB')
+            if img.size != self.size:
+                img = img.resize(self.size, self.resample)
+            return np.asarray(img, dtype=np.uint8)
+
+    def get_buffer(self, batch_size):
+        """Return this thread's batch buffer, growing it if needed"""
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None or len(buffer) < batch_size:
+            height, width = self.size[1], self.size[0]
+            dtype = np.float32 if self.normalize_pixels else np.uint8
+            buffer = np.empty((batch_size, height, width, 3), dtype=dtype)
+            self.local.buffer = buffer
+        return buffer[:batch_size]
+
+    def normalize_into(self, pixels, out):
+        """Normalize uint8 pixels into a float32 array in place"""
+        np.multiply(pixels, self.scale, out=out)
+        out += self.bias
+
+    def normalize(self, pixels):
+        """Return a normalized float32 copy of a uint8 batch"""
+        out = np.empty(pixels.shape, dtype=np.float32)
+        self.normalize_into(pixels, out)
+        return out
+
+    def stack(self, pixel_arrays):
+        """Copy already decoded images into this thread's batch buffer
+
+        Used when decoding happens elsewhere (e.g. on worker threads). The
+        result is normalized like preprocess_batch and shares its buffer.
+        """
+        buffer = self.get_buffer(len(pixel_arrays))
+        for i, pixels in enumerate(pixel_arrays):
+            if self.normalize_pixels:
+                self.normalize_into(pixels, buffer[i])
+            else:
+                buffer[i] = pixels
+        return buffer
+
+    def preprocess_batch(self, image_files):
+        """Preprocess images into one float32 (or uint8) batch
+
+        Returns the batch and the positions of the images that could be
+        decoded. The batch is a view of this thread's reusable buffer, so it
+        is only valid until the same thread preprocesses the next batch.
+        """
+        buffer = self.get_buffer(len(image_files))
+        valid_indices = []
+
+        for i, image_file in enumerate(image_files):
+            try:
+                pixels = self.decode(image_file)
+            except Exception as e:
+                print(f"Error preprocessing image: {e}")
+                continue
+            if self.normalize_pixels:
+                self.normalize_into(pixels, buffer[len(valid_indices)])
+            else:
+                buffer[len(valid_indices)] = pixels
+            valid_indices.append(i)
+
+        if not valid_indices:
+            return None, []
+
+        return buffer[:len(valid_indices)], valid_indices
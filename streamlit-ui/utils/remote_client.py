@@ -0,0 +1,78 @@
+import time
+import requests
+from config import INFERENCE_SERVER_TIMEOUT
+from utils.prediction_cache import read_image_bytes, result_from_dict
+from utils.prediction_utils import get_recycling_info
+
+class RemoteClassifier:
+    """Client for inference_server.py with the same interface as GarbageClassifier
+
+    Lets the Streamlit pages classify images on a separate inference tier
+    (set INFERENCE_SERVER_URL) without loading any models themselves.
+    """
+
+    def __init__(self, base_url, timeout=INFERENCE_SERVER_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.model_names = ['resnet50', 'custom_cnn', 'mobilenetv2']
+        self.session = requests.Session()
+
+    def get_loading_progress(self):
+        """Return the server's loading progress, or nothing loaded if it is unreachable"""
+        try:
+            response = self.session.get(f"{self.base_url}/ready", timeout=self.timeout)
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error contacting inference server: {e}")
+            return {
+                'ready': False,
+                'loaded': 0,
+                'total': len(self.model_names),
+                'status': {name: 'pending' for name in self.model_names},
+                'elapsed': 0.0
+            }
+
+    def is_ready(self):
+        return self.get_loading_progress()['ready']
+
+    def wait_until_ready(self, timeout=None):
+        """Poll the server until its models have loaded or the timeout passes"""
+        deadline = time.time() + timeout if timeout is not None else None
+        while not self.is_ready():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.5)
+        return True
+
+    @property
+    def model_version(self):
+        """Identifier of the models the server is running, or None if it is unreachable"""
+        return self.get_loading_progress().get('model_version')
+
+    def get_cached_prediction(self, image_file):
+        # The server keeps the prediction cache
+        return None
+
+    def predict_single(self, image_file):
+        """Predict the class of one image on the server"""
+        return self.predict_batch([image_file])[0]
+
+    def predict_batch(self, image_files):
+        """Predict several images in one request, with None for images that failed"""
+        files = [
+            ('images', (f"image_{i}", read_image_bytes(image_file), 'application/octet-stream'))
+            for i, image_file in enumerate(image_files)
+        ]
+        try:
+            response = self.session.post(f"{self.base_url}/predict/batch", files=files, timeout=self.timeout)
+            response.raise_for_status()
+            results = response.json()['results']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Error calling inference server: {e}")
+            return [None] * len(image_files)
+
+        return [None if 'error' in result else result_from_dict(result) for result in results]
+
+    def get_recycling_info(self, predicted_class):
+        """Get recycling information for the predicted class"""
+        return get_recycling_info(predicted_class)
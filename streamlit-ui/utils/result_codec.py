@@ -0,0 +1,84 @@
+import json
+import numpy as np
+from bson.binary import Binary
+from utils.prediction_utils import CLASS_NAMES
+
+# Version of the prediction result fields written by encode_result. Documents
+# without it keep their top predictions as a JSON string in top_predictions.
+RESULT_VERSION = 2
+
+# Probability vectors are stored as little-endian float16 (2 bytes per class)
+PROBABILITY_DTYPE = np.dtype('<f2')
+
+# Fields read by decode_top_predictions
+RESULT_FIELDS = ["predicted_class", "class_index", "confidence", "probabilities", "top", "top_predictions"]
+
+def encode_probabilities(probabilities):
+    """Pack a probability vector into BSON binary"""
+    return Binary(np.asarray(probabilities, dtype=np.float32).reshape(-1).astype(PROBABILITY_DTYPE).tobytes())
+
+def decode_probabilities(data):
+    """Unpack a probability vector stored by encode_probabilities"""
+    return np.frombuffer(bytes(data), dtype=PROBABILITY_DTYPE).astype(np.float32)
+
+def encode_result(predicted_class, confidence, top_predictions, all_probabilities=None, individual_predictions=None):
+    """Prediction document fields for a classification result
+
+    The class is stored by index and the ensemble and per-model
+    probabilities as packed float16 vectors. Results that come without
+    the full distribution (e.g. reused from a near-duplicate) keep their
+    top predictions as [class index, probability] pairs instead.
+    """
+    fields = {
+        "result_version": RESULT_VERSION,
+        "predicted_class": predicted_class,
+        "class_index": CLASS_NAMES.index(predicted_class),
+        "confidence": float(confidence)
+    }
+    if all_probabilities is not None:
+        fields["probabilities"] = encode_probabilities(all_probabilities)
+    else:
+        fields["top"] = [[CLASS_NAMES.index(name), float(prob)] for name, prob in top_predictions]
+    if individual_predictions:
+        fields["model_probabilities"] = {
+            name: encode_probabilities(pred) for name, pred in individual_predictions.items()
+        }
+    return fields
+
+def decode_all_probabilities(doc):
+    """The ensemble probability vector of a prediction document, or None if it was not stored"""
+    if doc.get("probabilities") is None:
+        return None
+    return decode_probabilities(doc["probabilities"])
+
+def decode_model_probabilities(doc):
+    """The per-model probability vectors of a prediction document (empty if not stored)"""
+    return {name: decode_probabilities(data) for name, data in (doc.get("model_probabilities") or {}).items()}
+
+def decode_top_predictions(doc, k=3):
+    """The top k (class name, probability) pairs of a prediction document in any stored format"""
+    probabilities = decode_all_probabilities(doc)
+    if probabilities is not None:
+        top_indices = np.argsort(probabilities)[::-1][:k]
+        return [(CLASS_NAMES[i], float(probabilities[i])) for i in top_indices]
+
+    if doc.get("top") is not None:
+        return [(CLASS_NAMES[index], prob) for index, prob in doc["top"][:k]]
+
+    # Documents saved before RESULT_VERSION 2
+    try:
+        return [(name, float(prob)) for name, prob in json.loads(doc["top_predictions"])[:k]]
+    except (KeyError, TypeError, ValueError):
+        return []
+
+def migrate_fields(doc):
+    """$set and $unset updates that convert a pre-RESULT_VERSION 2 document, or None if it cannot be converted"""
+    top_predictions = decode_top_predictions(doc)
+    if not top_predictions:
+        return None
+    try:
+        fields = encode_result(doc["predicted_class"], doc.get("confidence", top_predictions[0][1]), top_predictions)
+    except (KeyError, ValueError):
+        # Unknown class name
+        return None
+    return fields, {"top_predictions": ""}
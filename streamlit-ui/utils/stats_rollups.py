@@ -0,0 +1,178 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ReplaceOne
+
+# Rollup documents live in this collection:
+#   {"_id": "totals", "users", "verified_users", "unverified_users", "predictions", "classes": {class: count}}
+#   {"_id": "day:YYYY-MM-DD", "date", "predictions", "new_users", "classes": {class: count}}
+STATS_COLLECTION = 'stats'
+TOTALS_ID = 'totals'
+
+# Day of a document's created_at, as used in the rollup ids
+DAY_FORMAT = {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}
+
+def day_key(created_at):
+    # Rollup id of the day a document was created on
+    return f"day:{created_at.strftime('%Y-%m-%d')}"
+
+def _apply(db, updates):
+    # Apply counter updates; drift from a failed update is fixed by the next reconciliation
+    try:
+        db[STATS_COLLECTION].bulk_write(updates, ordered=False)
+    except Exception as e:
+        print(f"Warning: Could not update statistics rollups: {e}")
+
+def _inc_day(created_at, inc):
+    return UpdateOne(
+        {"_id": day_key(created_at)},
+        {"$inc": inc, "$setOnInsert": {"date": created_at.strftime('%Y-%m-%d')}},
+        upsert=True
+    )
+
+def record_user_created(db, created_at=None, verified=False):
+    """Count a new user; users without created_at are not counted as new on any day"""
+    state = "verified_users" if verified else "unverified_users"
+    updates = [UpdateOne({"_id": TOTALS_ID}, {"$inc": {"users": 1, state: 1}}, upsert=True)]
+    if created_at is not None:
+        updates.append(_inc_day(created_at, {"new_users": 1}))
+    _apply(db, updates)
+
+def record_user_verified(db, verified=True):
+    """Move a user between the verified and unverified counters"""
+    change = 1 if verified else -1
+    _apply(db, [UpdateOne(
+        {"_id": TOTALS_ID},
+        {"$inc": {"verified_users": change, "unverified_users": -change}},
+        upsert=True
+    )])
+
+def record_prediction(db, predicted_class, created_at, count=1):
+    """Count a saved prediction (or a deleted one with count=-1)"""
+    inc = {"predictions": count, f"classes.{predicted_class}": count}
+    _apply(db, [
+        UpdateOne({"_id": TOTALS_ID}, {"$inc": inc}, upsert=True),
+        _inc_day(created_at, inc)
+    ])
+
+def prediction_counts(db, query=None):
+    """Count predictions by day and class as (date or None, class, count)
+
+    Predictions without a creation date have no day; ones without a class
+    count as 'unknown'.
+    """
+    pipeline = [
+        {"$match": query or {}},
+        {"$group": {"_id": {"date": DAY_FORMAT, "class": "$predicted_class"}, "count": {"$sum": 1}}}
+    ]
+    return [
+        (doc['_id'].get('date'), doc['_id'].get('class') or 'unknown', doc['count'])
+        for doc in db.predictions.aggregate(pipeline)
+    ]
+
+def record_user_deleted(db, user, counts):
+    """Take a deleted user and their predictions out of the counters
+
+    counts are the user's prediction_counts, read before the predictions
+    were deleted.
+    """
+    totals = {"users": -1}
+    state = {1: "verified_users", 0: "unverified_users"}.get(user.get("is_verified"))
+    if state:
+        totals[state] = -1
+
+    days = {}
+    if isinstance(user.get("created_at"), datetime):
+        days[user["created_at"].strftime('%Y-%m-%d')] = {"new_users": -1}
+    for date, predicted_class, count in counts:
+        targets = [totals, days.setdefault(date, {})] if date else [totals]
+        for inc in targets:
+            inc["predictions"] = inc.get("predictions", 0) - count
+            inc[f"classes.{predicted_class}"] = inc.get(f"classes.{predicted_class}", 0) - count
+
+    # Days without a rollup document are left for the next reconciliation
+    _apply(db, [UpdateOne({"_id": TOTALS_ID}, {"$inc": totals}, upsert=True)] + [
+        UpdateOne({"_id": f"day:{date}"}, {"$inc": inc}) for date, inc in days.items()
+    ])
+
+def reconcile_rollups(db):
+    """Recompute every rollup document from the users and predictions collections
+
+    Counter updates made while this runs can be overwritten; the next
+    reconciliation picks them up again.
+    """
+    totals = {
+        "_id": TOTALS_ID,
+        "users": db.users.count_documents({}),
+        "verified_users": db.users.count_documents({"is_verified": 1}),
+        "unverified_users": db.users.count_documents({"is_verified": 0}),
+        "predictions": 0,
+        "classes": {},
+        "reconciled_at": datetime.now()
+    }
+    days = {}
+
+    def day(date):
+        return days.setdefault(date, {"_id": f"day:{date}", "date": date, "predictions": 0, "new_users": 0, "classes": {}})
+
+    # Predictions without a creation date only count towards the totals
+    for date, predicted_class, count in prediction_counts(db):
+        if date:
+            day(date)["predictions"] += count
+            classes = day(date)["classes"]
+            classes[predicted_class] = classes.get(predicted_class, 0) + count
+        totals["predictions"] += count
+        totals["classes"][predicted_class] = totals["classes"].get(predicted_class, 0) + count
+
+    pipeline = [
+        {"$match": {"created_at": {"$type": "date"}}},
+        {"$group": {"_id": DAY_FORMAT, "count": {"$sum": 1}}}
+    ]
+    for doc in db.users.aggregate(pipeline):
+        day(doc['_id'])["new_users"] = doc['count']
+
+    collection = db[STATS_COLLECTION]
+    replacements = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in [totals, *days.values()]]
+    collection.bulk_write(replacements, ordered=False)
+    # Days that no longer have any users or predictions
+    collection.delete_many({"_id": {"$regex": "^day:", "$nin": [doc["_id"] for doc in days.values()]}})
+    return totals
+
+def get_dashboard_stats(db, days=7):
+    """Read the dashboard numbers from the rollups: the totals and the last `days` calendar days
+
+    Reconciles first if the rollups have never been built.
+    """
+    collection = db[STATS_COLLECTION]
+    totals = collection.find_one({"_id": TOTALS_ID})
+    if not totals or 'reconciled_at' not in totals:
+        totals = reconcile_rollups(db)
+
+    today = datetime.now()
+    keys = [day_key(today - timedelta(days=offset)) for offset in range(days)]
+    recent = list(collection.find({"_id": {"$in": keys}}, {"predictions": 1, "new_users": 1}))
+
+    return {
+        "total_users": totals.get("users", 0),
+        "verified_users": totals.get("verified_users", 0),
+        "unverified_users": totals.get("unverified_users", 0),
+        "total_predictions": totals.get("predictions", 0),
+        "recent_predictions": sum(doc.get("predictions", 0) for doc in recent),
+        "recent_users": sum(doc.get("new_users", 0) for doc in recent),
+        "classes": {name: count for name, count in totals.get("classes", {}).items() if count > 0},
+        "reconciled_at": totals.get("reconciled_at")
+    }
+
+def start_reconciler(db, interval):
+    """Reconcile the rollups every `interval` seconds on a daemon thread"""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                reconcile_rollups(db)
+            except Exception as e:
+                print(f"Warning: Could not reconcile statistics rollups: {e}")
+
+    thread = threading.Thread(target=run, name='stats-reconciler', daemon=True)
+    thread.start()
+    return thread
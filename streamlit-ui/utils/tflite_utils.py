@@ -0,0 +1,83 @@
+import os
+import threading
+import numpy as np
+
+# Supported post-training quantization schemes
+QUANTIZATIONS = ('int8', 'float16')
+
+# Directory for converted models, relative to the project root
+TFLITE_DIR = 'models/saved_models/tflite'
+
+def get_interpreter_class():
+    """Return the TFLite interpreter class, preferring the standalone runtime"""
+    try:
+        # The standalone runtime is much lighter than full TensorFlow when installed
+        from tflite_runtime.interpreter import Interpreter # pyright: ignore[reportMissingImports]
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+def tflite_model_path(name, quantization):
+    """Path of the converted TFLite file for a model and quantization"""
+    return f"{TFLITE_DIR}/best_{name}_{quantization}.tflite"
+
+def convert_model(keras_path, output_path, quantization, normalization=None):
+    """Convert a saved Keras model to a post-training quantized TFLite file
+
+    'int8' applies dynamic-range quantization (int8 weights, float
+    activations), 'float16' stores the weights as float16. With a
+    (mean, std) normalization the converted model takes uint8 pixels.
+    """
+    import tensorflow as tf
+    from utils.backends import add_input_normalization
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}")
+
+    model = tf.keras.models.load_model(keras_path)
+    if normalization is not None:
+        model = add_input_normalization(model, *normalization)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+
+    tflite_model = converter.convert()
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+
+    return len(tflite_model)
+
+class TFLiteModel:
+    """Run a converted TFLite model on batches of preprocessed images"""
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = get_interpreter_class()(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        input_details = self.interpreter.get_input_details()[0]
+        self.input_index = input_details['index']
+        self.input_dtype = input_details['dtype']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = 1
+
+        # An interpreter can only run one invocation at a time
+        self.lock = threading.Lock()
+
+    def predict(self, img_batch):
+        """Return the model's probabilities for a batch of images"""
+        img_batch = np.asarray(img_batch, dtype=self.input_dtype)
+
+        with self.lock:
+            # Resize the input tensor when the batch size changes
+            if len(img_batch) != self.batch_size:
+                self.interpreter.resize_tensor_input(self.input_index, img_batch.shape)
+                self.interpreter.allocate_tensors()
+                self.batch_size = len(img_batch)
+
+            self.interpreter.set_tensor(self.input_index, img_batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).copy()
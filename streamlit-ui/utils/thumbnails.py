@@ -0,0 +1,43 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from config import THUMBNAIL_SIZE, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY
+
+# Thumbnails are made on these threads instead of on the request path
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumbnails')
+
+CONTENT_TYPES = {
+    'WEBP': 'image/webp',
+    'JPEG': 'image/jpeg'
+}
+
+def make_thumbnail(image_bytes, size=THUMBNAIL_SIZE, image_format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY):
+    """Return (thumbnail bytes, content type) for an image scaled to fit in size x size"""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        # Let the JPEG decoder downscale while decoding large photos
+        img.draft('RGB', (size, size))
+        img = img.convert('RGB')
+    img.thumbnail((size, size))
+
+    image_format = image_format.upper()
+    output = io.BytesIO()
+    try:
+        img.save(output, format=image_format, quality=quality)
+    except (KeyError, OSError):
+        # Pillow was built without support for the format
+        image_format = 'JPEG'
+        output = io.BytesIO()
+        img.save(output, format=image_format, quality=quality)
+
+    return output.getvalue(), CONTENT_TYPES.get(image_format, f"image/{image_format.lower()}")
+
+def run_in_background(fn, *args):
+    """Run a thumbnail job on the background threads, logging any error"""
+    def job():
+        try:
+            return fn(*args)
+        except Exception as e:
+            print(f"Error creating thumbnail: {e}")
+            return None
+
+    return _executor.submit(job)
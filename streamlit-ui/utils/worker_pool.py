@@ -0,0 +1,344 @@
+import atexit
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing import shared_memory
+import numpy as np
+from config import BATCH_MAX_SIZE, INFERENCE_WORKER_TIMEOUT, INFERENCE_WORKER_MAX_RESTARTS
+from utils.backends import INPUT_SHAPE, InferenceBackend
+
+# Bytes of one float32 image; uint8 batches only use a quarter of a slot
+IMAGE_BYTES = int(np.prod(INPUT_SHAPE)) * 4
+
+# Seconds between worker liveness checks
+HEALTH_CHECK_INTERVAL = 1.0
+
+# Longest wait in seconds before restarting a crashed worker
+MAX_RESTART_DELAY = 60.0
+
+def attach_shared_memory(name):
+    """Open an existing shared memory block without taking ownership of it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block with the resource
+        # tracker again. Spawned workers share the parent's tracker, which keeps
+        # one entry per name, so this is harmless; unregistering here would drop
+        # the parent's own registration. Only the parent unlinks the block.
+        return shared_memory.SharedMemory(name=name)
+
+def _worker_main(worker_id, task_queue, result_queue, shm_name, slot_bytes, classifier_options):
+    """Worker process: load the ensemble once, then run batches read from shared memory"""
+    from utils.prediction_utils import GarbageClassifier
+
+    shm = attach_shared_memory(shm_name)
+    classifier = GarbageClassifier(workers=0, lazy=False, cache=None, cascade=False, **classifier_options)
+    result_queue.put(('ready', worker_id, list(classifier.models)))
+
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                return
+
+            task_id, slot, shape, dtype, model_names = task
+            try:
+                img_batch = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=slot * slot_bytes)
+                if model_names is None:
+                    result = classifier.predict_probabilities(img_batch)
+                else:
+                    result = classifier.run_models(img_batch, model_names)
+                img_batch = None
+                result_queue.put(('result', task_id, result))
+            except Exception as e:
+                img_batch = None
+                result_queue.put(('error', task_id, f"{type(e).__name__}: {e}"))
+    finally:
+        shm.close()
+
+class WorkerProcess:
+    """A worker process with its task queue and the tasks it is running"""
+
+    def __init__(self, worker_id, process, task_queue, crashes=0):
+        self.worker_id = worker_id
+        self.process = process
+        self.task_queue = task_queue
+        self.tasks = set()
+        self.ready = False
+        # Crashes of this worker since it last finished a batch, and when to restart it
+        self.crashes = crashes
+        self.restart_at = None
+
+class WorkerPoolBackend(InferenceBackend):
+    """Run the ensemble in a pool of worker processes
+
+    Each worker process loads its own GarbageClassifier with the given
+    options, so inference is not limited by this process's GIL and the
+    Streamlit process holds no models itself. Batches are copied into a
+    ring of shared memory slots and only the slot index travels through the
+    worker's task queue; the small probability arrays come back through one
+    result queue.
+
+    When all slots are busy, callers wait up to timeout seconds for one
+    before a TimeoutError is raised. A monitor thread restarts workers that
+    die and fails their pending batches, and a worker that does not answer
+    within timeout is terminated so it gets restarted too. Restarts back off
+    exponentially, and a worker that crashes max_restarts times in a row
+    without finishing a batch is given up on.
+    """
+
+    def __init__(self, num_workers, classifier_options, max_batch_size=BATCH_MAX_SIZE, slots=None,
+                 timeout=INFERENCE_WORKER_TIMEOUT, max_restarts=INFERENCE_WORKER_MAX_RESTARTS):
+        super().__init__()
+        self.num_workers = max(1, num_workers)
+        self.classifier_options = classifier_options
+        self.max_batch_size = max(1, max_batch_size)
+        self.slot_bytes = self.max_batch_size * IMAGE_BYTES
+        self.num_slots = slots or 2 * self.num_workers
+        self.timeout = timeout
+        self.max_restarts = max_restarts
+
+        # Cache keys should change with the runtime the workers use
+        self.name = f"pool:{classifier_options.get('backend', 'tensorflow')}"
+        if classifier_options.get('backend') == 'tflite':
+            self.quantization = classifier_options.get('quantization')
+
+        # TensorFlow is not fork-safe, so workers always start fresh interpreters
+        self.context = multiprocessing.get_context('spawn')
+        self.shm = None
+        self.free_slots = queue.Queue()
+        self.result_queue = None
+        self.workers = {}
+        self.pending = {}
+        self.task_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.ready_event = threading.Event()
+        self.started = False
+        self.closed = False
+        self.restarts = 0
+        self.startup_failures = 0
+
+    def start(self):
+        """Create the shared memory ring and start the workers"""
+        self.shm = shared_memory.SharedMemory(create=True, size=self.num_slots * self.slot_bytes)
+        for slot in range(self.num_slots):
+            self.free_slots.put(slot)
+
+        self.result_queue = self.context.Queue()
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+
+        threading.Thread(target=self._collect_results, name='pool-results', daemon=True).start()
+        threading.Thread(target=self._monitor, name='pool-monitor', daemon=True).start()
+        atexit.register(self.close)
+        self.started = True
+
+    def _spawn(self, worker_id, crashes=0):
+        task_queue = self.context.Queue()
+        process = self.context.Process(
+            target=_worker_main,
+            args=(worker_id, task_queue, self.result_queue, self.shm.name, self.slot_bytes, self.classifier_options),
+            name=f"inference-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        with self.lock:
+            self.workers[worker_id] = WorkerProcess(worker_id, process, task_queue, crashes)
+
+    def add_model(self, name):
+        # Every worker loads all models; wait for the first one to report which it has
+        if not self.started:
+            self.start()
+        self.ready_event.wait()
+        return name in self.models
+
+    def load_model(self, name):
+        # Never called: add_model is overridden because the worker processes load the models
+        return None
+
+    def _collect_results(self):
+        """Hand results from the workers back to the waiting callers"""
+        while True:
+            message = self.result_queue.get()
+            if message is None:
+                return
+
+            kind, key, payload = message
+            if kind == 'ready':
+                with self.lock:
+                    if key in self.workers:
+                        self.workers[key].ready = True
+                    if not self.models:
+                        self.models = {name: None for name in payload}
+                self.ready_event.set()
+                continue
+
+            with self.lock:
+                entry = self.pending.pop(key, None)
+                if entry is not None:
+                    future, worker_id, slot = entry
+                    self.workers[worker_id].tasks.discard(key)
+                    if kind == 'result':
+                        self.workers[worker_id].crashes = 0
+            if entry is None:
+                # The worker was already declared dead and the caller was told
+                continue
+
+            self.free_slots.put(slot)
+            if kind == 'result':
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"Inference worker failed: {payload}"))
+
+    def _monitor(self):
+        """Restart workers that have exited once their backoff delay has passed"""
+        while not self.closed:
+            time.sleep(HEALTH_CHECK_INTERVAL)
+            with self.lock:
+                workers = list(self.workers.values())
+            for worker in workers:
+                if self.closed or worker.process.is_alive():
+                    continue
+                if worker.restart_at is None:
+                    self._replace_worker(worker)
+                elif time.monotonic() >= worker.restart_at:
+                    self.restarts += 1
+                    self._spawn(worker.worker_id, worker.crashes)
+
+    def _replace_worker(self, worker):
+        """Fail the batches of a worker that exited and schedule its restart"""
+        exitcode = worker.process.exitcode
+        with self.lock:
+            failed = [self.pending.pop(task_id) for task_id in worker.tasks if task_id in self.pending]
+            worker.tasks.clear()
+
+        error = RuntimeError(f"Inference worker {worker.worker_id} exited with code {exitcode}")
+        for future, _, slot in failed:
+            self.free_slots.put(slot)
+            future.set_exception(error)
+
+        if not worker.ready:
+            # Don't keep restarting workers that can never load the models
+            self.startup_failures += 1
+            if self.startup_failures >= self.num_workers and not self.ready_event.is_set():
+                print(f"Error: Inference workers failed to start (exit code {exitcode})")
+                with self.lock:
+                    del self.workers[worker.worker_id]
+                self.ready_event.set()
+                return
+
+        worker.crashes += 1
+        if worker.crashes > self.max_restarts:
+            print(f"Error: Inference worker {worker.worker_id} exited {worker.crashes} times in a row "
+                  f"(last exit code {exitcode}), not restarting it")
+            with self.lock:
+                del self.workers[worker.worker_id]
+            # Don't leave add_model waiting for a worker that will never start
+            if not self.workers:
+                self.ready_event.set()
+            return
+
+        delay = min(2.0 ** (worker.crashes - 1), MAX_RESTART_DELAY)
+        print(f"Warning: Inference worker {worker.worker_id} exited with code {exitcode}, restarting it in {delay:.0f}s")
+        worker.restart_at = time.monotonic() + delay
+
+    def _submit(self, img_batch, model_names):
+        """Copy a batch into a free slot and queue it on the least busy worker"""
+        if img_batch.nbytes > self.slot_bytes:
+            raise ValueError(f"Batch of {img_batch.nbytes} bytes does not fit a {self.slot_bytes} byte slot")
+
+        # Backpressure: wait for a slot instead of queueing without limit
+        try:
+            slot = self.free_slots.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError("Inference worker pool is busy")
+
+        view = np.ndarray(img_batch.shape, dtype=img_batch.dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+        view[...] = img_batch
+        del view
+
+        future = Future()
+        with self.lock:
+            available = [w for w in self.workers.values() if w.ready and w.process.is_alive()]
+            if not available:
+                self.free_slots.put(slot)
+                raise RuntimeError("No inference workers are available")
+            worker = min(available, key=lambda w: len(w.tasks))
+            task_id = next(self.task_ids)
+            self.pending[task_id] = (future, worker.worker_id, slot)
+            worker.tasks.add(task_id)
+
+        worker.task_queue.put((task_id, slot, img_batch.shape, img_batch.dtype.str, model_names))
+        return future, worker
+
+    def _wait(self, future, worker):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Treat a worker that stops answering as hung; the monitor restarts it
+            print(f"Warning: Inference worker {worker.worker_id} timed out, terminating it")
+            worker.process.terminate()
+            raise TimeoutError(f"Inference worker {worker.worker_id} did not answer within {self.timeout}s")
+
+    def run_batch(self, img_batch, model_names=None):
+        """Run models over a batch in the pool, splitting it across slots and workers
+
+        Returns (averaged probabilities, per-model probabilities); with
+        model_names None the workers run their whole ensemble.
+        """
+        if not self.started or self.closed:
+            raise RuntimeError("Inference worker pool is not running")
+
+        img_batch = np.ascontiguousarray(img_batch)
+        chunks = [
+            self._submit(img_batch[start:start + self.max_batch_size], model_names)
+            for start in range(0, len(img_batch), self.max_batch_size)
+        ]
+        results = [self._wait(future, worker) for future, worker in chunks]
+
+        names = set.intersection(*(set(predictions) for _, predictions in results))
+        ensemble_predictions = np.concatenate([ensemble for ensemble, _ in results])
+        predictions = {
+            name: np.concatenate([chunk_predictions[name] for _, chunk_predictions in results])
+            for name in names
+        }
+        return ensemble_predictions, predictions
+
+    def predict(self, name, img_batch):
+        return self.run_batch(img_batch, [name])[1][name]
+
+    def predict_ensemble(self, img_batch):
+        return self.run_batch(img_batch)
+
+    def get_metrics(self):
+        """Return worker health and slot usage"""
+        with self.lock:
+            return {
+                'workers': len(self.workers),
+                'workers_alive': sum(1 for w in self.workers.values() if w.process.is_alive()),
+                'workers_ready': sum(1 for w in self.workers.values() if w.ready),
+                'restarts': self.restarts,
+                'pending_batches': len(self.pending),
+                'free_slots': self.free_slots.qsize(),
+                'total_slots': self.num_slots
+            }
+
+    def close(self):
+        """Stop the workers and release the shared memory"""
+        if self.closed or not self.started:
+            return
+        self.closed = True
+
+        for worker in self.workers.values():
+            worker.task_queue.put(None)
+        for worker in self.workers.values():
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+        self.result_queue.put(None)
+        self.shm.close()
+        self.shm.unlink()
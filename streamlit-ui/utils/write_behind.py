@@ -0,0 +1,288 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from bson import json_util
+from pymongo.errors import ConnectionFailure, PyMongoError
+from config import (
+    PREDICTION_WRITE_BATCH_SIZE, PREDICTION_WRITE_INTERVAL_MS, PREDICTION_WRITE_RETRIES,
+    PREDICTION_WRITE_QUEUE_SIZE, PREDICTION_SPILL_FILE, PREDICTION_SPILL_MAX_BYTES
+)
+
+# Markers put on the queue to flush or stop the worker thread
+_STOP = object()
+
+class _Flush:
+    def __init__(self):
+        self.done = threading.Event()
+
+def is_transient_error(error):
+    """Whether retrying a failed write may succeed (lost connection, failover, timeout)"""
+    if isinstance(error, ConnectionFailure):
+        return True
+    return isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError")
+
+class WriteBehindQueue:
+    """Queue records in memory and write them in batches on a background thread
+
+    submit() returns immediately. The worker thread takes the first waiting
+    record, keeps collecting more until the batch is full or
+    flush_interval_ms has passed, and hands the batch to write_fn. Transient
+    errors are retried with exponential backoff; batches that still fail are
+    appended to spill_file (as extended JSON, at most spill_max_bytes) and
+    written again after the next successful batch. Records submitted while
+    max_queue_size are already waiting go straight to spill_file.
+
+    Spilled records that fail with an error that is not transient are moved
+    to spill_file + '.rejected' instead of being retried.
+
+    write_fn must be safe to call again with records it already wrote.
+    """
+
+    def __init__(self, write_fn, max_batch_size=PREDICTION_WRITE_BATCH_SIZE,
+                 flush_interval_ms=PREDICTION_WRITE_INTERVAL_MS, max_retries=PREDICTION_WRITE_RETRIES,
+                 max_queue_size=PREDICTION_WRITE_QUEUE_SIZE, spill_file=PREDICTION_SPILL_FILE,
+                 spill_max_bytes=PREDICTION_SPILL_MAX_BYTES, name='write-behind'):
+        self.write_fn = write_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_retries = max_retries
+        self.spill_file = spill_file
+        self.spill_max_bytes = spill_max_bytes
+        self.records = queue.Queue(maxsize=max(1, max_queue_size))
+        # Records are spilled by the worker and by submit() when the queue is full
+        self.spill_lock = threading.Lock()
+
+        # Metrics
+        self.lock = threading.Lock()
+        self.total_records = 0
+        self.total_batches = 0
+        self.total_retries = 0
+        self.spilled_records = 0
+        self.overflow_records = 0
+        self.rejected_records = 0
+        self.dropped_records = 0
+
+        self.worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self.worker.start()
+        atexit.register(self.close)
+
+    def submit(self, record):
+        """Queue a record for writing, spilling it if the queue is full"""
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.overflow_records += 1
+            self._spill([record])
+
+    def flush(self, timeout=None):
+        """Wait until everything submitted so far has been written (or spilled)
+
+        Returns False if that did not happen within timeout.
+        """
+        marker = _Flush()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            self.records.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+
+    def close(self, timeout=10):
+        """Write the queued records and stop the worker thread
+
+        Records still queued after timeout seconds are moved to the spill file.
+        """
+        if not self.worker.is_alive():
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            self.records.put(_STOP, timeout=timeout)
+            self.worker.join(max(0.0, deadline - time.monotonic()))
+        except queue.Full:
+            pass
+        if self.worker.is_alive():
+            # The worker is stuck, e.g. on an unreachable database
+            self._spill_queued()
+
+    def _spill_queued(self):
+        """Move every queued record to the spill file and release flush() callers"""
+        records = []
+        while True:
+            try:
+                item = self.records.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _Flush):
+                item.done.set()
+            elif item is not _STOP:
+                records.append(item)
+        if records:
+            print(f"Warning: Spilling {len(records)} queued records that were not written before shutdown")
+            self._spill(records)
+
+    def get_metrics(self):
+        """Return queue depth and write statistics"""
+        with self.lock:
+            return {
+                'queue_depth': self.records.qsize(),
+                'total_records': self.total_records,
+                'total_batches': self.total_batches,
+                'avg_batch_size': self.total_records / self.total_batches if self.total_batches else 0.0,
+                'total_retries': self.total_retries,
+                'spilled_records': self.spilled_records,
+                'overflow_records': self.overflow_records,
+                'rejected_records': self.rejected_records,
+                'dropped_records': self.dropped_records,
+                'spill_bytes': os.path.getsize(self.spill_file) if self.spill_file and os.path.exists(self.spill_file) else 0
+            }
+
+    def _collect_batch(self):
+        """Block for the first record, then gather more until full or the flush interval has passed
+
+        Returns (records, flush markers, whether to stop).
+        """
+        batch, markers = [], []
+        item = self.records.get()
+        deadline = time.perf_counter() + self.flush_interval
+        while True:
+            if item is _STOP:
+                return batch, markers, True
+            if isinstance(item, _Flush):
+                # Write what has been collected right away
+                markers.append(item)
+                return batch, markers, False
+            batch.append(item)
+            if len(batch) >= self.max_batch_size:
+                return batch, markers, False
+
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return batch, markers, False
+            try:
+                item = self.records.get(timeout=remaining)
+            except queue.Empty:
+                return batch, markers, False
+
+    def _run(self):
+        """Worker loop that writes one batch at a time"""
+        self._replay_spill()
+        while True:
+            batch, markers, stop = self._collect_batch()
+            if batch and self._write(batch):
+                self._replay_spill()
+            for marker in markers:
+                marker.done.set()
+            if stop:
+                return
+
+    def _write(self, batch):
+        """Write a batch, retrying transient errors; spill it if it still fails"""
+        attempt = 0
+        while True:
+            try:
+                self.write_fn(batch)
+                with self.lock:
+                    self.total_batches += 1
+                    self.total_records += len(batch)
+                return True
+            except Exception as e:
+                if is_transient_error(e) and attempt < self.max_retries:
+                    attempt += 1
+                    with self.lock:
+                        self.total_retries += 1
+                    time.sleep(min(0.1 * 2 ** attempt, 5.0))
+                    continue
+                print(f"Error writing {len(batch)} queued records: {e}")
+                self._spill(batch)
+                return False
+
+    def _append(self, path, batch):
+        """Append records to a file as extended JSON, returning False if that would exceed spill_max_bytes"""
+        lines = ''.join(json_util.dumps(record) + '\n' for record in batch)
+        with self.spill_lock:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size + len(lines) > self.spill_max_bytes:
+                return False
+            try:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(lines)
+            except OSError as e:
+                print(f"Error appending queued records to {path}: {e}")
+                return False
+        return True
+
+    def _spill(self, batch):
+        """Append a batch to the spill file to be written again later"""
+        if not self.spill_file or not self._append(self.spill_file, batch):
+            self._drop(batch)
+            return
+        with self.lock:
+            self.spilled_records += len(batch)
+
+    def _reject(self, batch, error):
+        """Move records that can never be written out of the spill file"""
+        rejected_file = self.spill_file + '.rejected'
+        print(f"Error: {len(batch)} spilled records cannot be written ({error}), moving them to {rejected_file}")
+        if not self._append(rejected_file, batch):
+            self._drop(batch)
+            return
+        with self.lock:
+            self.rejected_records += len(batch)
+
+    def _drop(self, batch):
+        print(f"Warning: Dropped {len(batch)} queued records that could not be written")
+        with self.lock:
+            self.dropped_records += len(batch)
+
+    def _replay_spill(self):
+        """Write the records of the spill file again
+
+        Records that fail with a transient error are spilled anew; ones that
+        fail for any other reason are rejected.
+        """
+        if not self.spill_file:
+            return
+        replay_file = self.spill_file + '.replay'
+
+        try:
+            with self.spill_lock:
+                if not os.path.exists(self.spill_file) and not os.path.exists(replay_file):
+                    return
+                if os.path.exists(self.spill_file):
+                    # A replay file left by an interrupted replay is written again as well
+                    with open(self.spill_file, encoding='utf-8') as src, open(replay_file, 'a', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                    os.remove(self.spill_file)
+            with open(replay_file, encoding='utf-8') as f:
+                records = [json_util.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            print(f"Error reading spilled records from {replay_file}: {e}")
+            return
+
+        for start in range(0, len(records), self.max_batch_size):
+            self._replay_batch(records[start:start + self.max_batch_size])
+        os.remove(replay_file)
+
+    def _replay_batch(self, batch):
+        """Write spilled records, respilling them on transient errors and rejecting the ones that always fail"""
+        try:
+            self.write_fn(batch)
+            with self.lock:
+                self.total_batches += 1
+                self.total_records += len(batch)
+            return
+        except Exception as e:
+            if is_transient_error(e):
+                print(f"Error writing {len(batch)} spilled records: {e}")
+                self._spill(batch)
+                return
+            if len(batch) == 1:
+                self._reject(batch, e)
+                return
+        # Write the records one at a time so only the ones that fail are rejected
+        for record in batch:
+            self._replay_batch([record])